@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# Telegram 告警发送
+# 复用长连接的 httpx 客户端，按聊天与全局间隔限速；超长消息按告警边界拆分，
+# 429 按 retry_after 等待后重试，发送结果计入投递统计。排队与批量合并见 notifier.py
+
+import asyncio
+import collections
+import html
+import logging
+import re
+import threading
+import time
+from typing import Any, Deque, Dict, List, Optional
+
+import httpx
+
+from loop_local import LoopLocal
+
+TELEGRAM_API = "https://api.telegram.org"
+MAX_MESSAGE_LENGTH = 4096   # Telegram 单条消息长度上限（UTF-16 码元）
+PRIVATE_CHAT_INTERVAL = 1.0  # 同一私聊两条消息的最小间隔（秒）
+GROUP_CHAT_INTERVAL = 3.0   # 同一群组两条消息的最小间隔（秒，群组上限 20 条/分钟）
+GLOBAL_INTERVAL = 1 / 30    # 全部聊天两条消息的最小间隔（秒，Bot 上限约 30 条/秒）
+SEND_ATTEMPTS = 5           # 单条消息最多发送次数
+RETRY_BASE_DELAY = 2        # 网络错误/5xx 的首次重试间隔（秒），之后翻倍
+MAX_RETRY_DELAY = 300       # 重试等待上限（秒），retry_after 超过该值时按该值等待
+HTTP_TIMEOUT = 10           # 单次请求超时（秒）
+POOL_CONNECTIONS = 4        # 保持的长连接数
+LATENCY_SAMPLES = 100       # 统计投递延迟参考的最近消息数
+
+_TAG_RE = re.compile(r"<[^>]+>")
+
+
+def text_length(text: str) -> int:
+    """按 Telegram 的计数方式（UTF-16 码元）计算文本长度。"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _split_long(text: str, limit: int) -> List[str]:
+    """单条告警超长时按行拆分，单行仍超长时硬切。"""
+    chunks: List[str] = []
+    current = ""
+    for line in text.split("\n"):
+        while text_length(line) > limit:
+            # 硬切到恰好不超过上限（表情等字符占两个 UTF-16 码元）
+            cut = limit
+            while text_length(line[:cut]) > limit:
+                cut -= text_length(line[:cut]) - limit
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:cut])
+            line = line[cut:]
+        candidate = f"{current}\n{line}" if current else line
+        if text_length(candidate) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_messages(messages: List[str], limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """把多条告警合并为尽量少的消息，每条不超过 limit，只在告警之间断开。"""
+    chunks: List[str] = []
+    current = ""
+    for message in messages:
+        if not message:
+            continue
+        if text_length(message) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.extend(_split_long(message, limit))
+            continue
+        candidate = f"{current}\n\n{message}" if current else message
+        if text_length(candidate) > limit:
+            chunks.append(current)
+            current = message
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def plain_text(text: str) -> str:
+    """去掉 HTML 标签（Telegram 无法解析 HTML 时改发纯文本，Webhook/邮件使用纯文本）。"""
+    return html.unescape(_TAG_RE.sub("", text))
+
+
+class DeliveryStats:
+    """Telegram 消息投递统计（进程内共享）。"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.sent = 0          # 发送成功的消息数
+        self.failed = 0        # 放弃发送的消息数
+        self.retried = 0       # 重试次数
+        self.rate_limited = 0  # 收到 429 的次数
+        self.split = 0         # 超过长度上限、被拆成多条消息的告警数
+        self._latencies: Deque[float] = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    def record_split(self, oversized: int) -> None:
+        with self._lock:
+            self.split += oversized
+
+    def record_done(self, ok: bool, latency: float) -> None:
+        with self._lock:
+            if ok:
+                self.sent += 1
+                self._latencies.append(latency)
+            else:
+                self.failed += 1
+
+    def record_retry(self, rate_limited: bool) -> None:
+        with self._lock:
+            self.retried += 1
+            if rate_limited:
+                self.rate_limited += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前统计：各项计数与最近消息的平均/最长发送耗时（秒，含重试等待）。"""
+        with self._lock:
+            latencies = list(self._latencies)
+            return {
+                "sent": self.sent,
+                "failed": self.failed,
+                "retried": self.retried,
+                "rate_limited": self.rate_limited,
+                "split": self.split,
+                "avg_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+                "max_latency": max(latencies, default=0.0),
+            }
+
+
+delivery_stats = DeliveryStats()
+
+
+class AlertDispatcher:
+    """绑定一个事件循环的 Telegram 发送器：共用一个 HTTP 连接池，按聊天限速。"""
+
+    def __init__(self, token: str) -> None:
+        self.token = token
+        self._client = httpx.AsyncClient(
+            base_url=f"{TELEGRAM_API}/bot{token}",
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=POOL_CONNECTIONS, max_keepalive_connections=POOL_CONNECTIONS),
+        )
+        # 聊天ID -> 下次允许发送的时间（monotonic）
+        self._chat_next: Dict[str, float] = {}
+        self._global_next = 0.0
+
+    async def send(self, chat_id: str, text: str) -> bool:
+        """发送一条消息（HTML），返回是否成功。"""
+        start = time.monotonic()
+        ok = False
+        try:
+            ok = await self._deliver(chat_id, text)
+        except Exception as exc:
+            logging.error("告警发送异常（聊天 %s）: %s", chat_id, exc)
+        delivery_stats.record_done(ok, time.monotonic() - start)
+        return ok
+
+    async def close(self) -> None:
+        """关闭连接池。"""
+        await self._client.aclose()
+
+    async def _pace(self, chat_id: str) -> None:
+        """按聊天间隔与全局间隔等待发送时机。"""
+        interval = GROUP_CHAT_INTERVAL if chat_id.startswith("-") else PRIVATE_CHAT_INTERVAL
+        now = time.monotonic()
+        start = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = start + interval
+        if start > now:
+            await asyncio.sleep(start - now)
+        # 聊天间隔到达后再占用全局名额，避免等待中的聊天阻塞其他聊天
+        now = time.monotonic()
+        start = max(now, self._global_next)
+        self._global_next = start + GLOBAL_INTERVAL
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def _deliver(self, chat_id: str, text: str) -> bool:
+        """发送一条消息，429/网络错误/5xx 时重试，其他错误直接放弃。"""
+        payload = {
+            "chat_id": chat_id,
+            "text": text,
+            "parse_mode": "HTML",
+            "disable_web_page_preview": "true",
+        }
+        delay = RETRY_BASE_DELAY
+        for attempt in range(1, SEND_ATTEMPTS + 1):
+            await self._pace(chat_id)
+            rate_limited = False
+            try:
+                response = await self._client.post("/sendMessage", data=payload)
+                result = response.json()
+            except (httpx.HTTPError, ValueError) as exc:
+                # 异常信息不含请求地址，不会泄露 Bot Token
+                error = f"{type(exc).__name__}: {exc}"
+                wait = delay
+            else:
+                if result.get("ok"):
+                    if attempt > 1:
+                        logging.info("告警发送成功（聊天 %s，第 %d 次尝试）", chat_id, attempt)
+                    else:
+                        logging.info("告警发送成功（聊天 %s）", chat_id)
+                    return True
+                error = f"HTTP {response.status_code} {result.get('description', '')}"
+                parameters = result.get("parameters") or {}
+                if response.status_code == 429:
+                    rate_limited = True
+                    wait = float(parameters.get("retry_after", delay))
+                    # 同一聊天的后续消息也需等待
+                    self._chat_next[chat_id] = time.monotonic() + min(wait, MAX_RETRY_DELAY)
+                elif response.status_code >= 500:
+                    wait = delay
+                elif "parse entities" in str(result.get("description", "")) and "parse_mode" in payload:
+                    # 拆分或转义问题导致 HTML 无法解析时改发纯文本，而不是丢弃告警
+                    logging.warning("告警 HTML 解析失败（聊天 %s），改发纯文本: %s", chat_id, error)
+                    payload = {"chat_id": chat_id, "text": plain_text(text), "disable_web_page_preview": "true"}
+                    continue
+                else:
+                    logging.error("告警发送失败（聊天 %s）: %s", chat_id, error)
+                    return False
+            if attempt == SEND_ATTEMPTS:
+                break
+            wait = min(wait, MAX_RETRY_DELAY)
+            delivery_stats.record_retry(rate_limited)
+            logging.warning("告警发送失败（聊天 %s），%.0fs 后重试（%d/%d）: %s", chat_id, wait, attempt, SEND_ATTEMPTS, error)
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+        logging.error("告警发送失败（聊天 %s），已重试 %d 次: %s", chat_id, SEND_ATTEMPTS, error)
+        return False
+
+
+# 当前事件循环上的发送器（见 loop_local）
+_dispatchers: LoopLocal[AlertDispatcher] = LoopLocal(AlertDispatcher.close)
+
+
+def get_dispatcher(config: Dict[str, Any]) -> Optional[AlertDispatcher]:
+    """获取当前事件循环上的告警发送器，Bot Token 变更时重建。"""
+    token = config.get("telegram_bot_token")
+    if not token:
+        return None
+    dispatcher = _dispatchers.get()
+    if dispatcher is None or dispatcher.token != token:
+        # 旧发送器在后台关闭
+        dispatcher = AlertDispatcher(token)
+        _dispatchers.set(dispatcher)
+    return dispatcher
+
+
+async def close_dispatcher() -> None:
+    """关闭当前事件循环上的发送器。"""
+    dispatcher = _dispatchers.pop()
+    if dispatcher is not None:
+        await dispatcher.close()
@@ -52,6 +52,19 @@ MAJOR_CITIES = [
     {"name": "呼和浩特", "pro_id": 183, "city_id": 433},
 ]
 
+# 省份ID → 省份名称（附录.md 国内省份城市表）
+PROVINCE_NAMES = {
+    12: "香港", 49: "重庆", 79: "福建", 80: "甘肃", 180: "北京", 183: "内蒙古",
+    184: "台湾", 188: "贵州", 189: "宁夏", 190: "山东", 192: "黑龙江", 193: "山西",
+    194: "陕西", 195: "广东", 196: "河南", 221: "上海", 227: "云南", 235: "湖北",
+    236: "安徽", 238: "西藏", 239: "江西", 241: "澳门", 243: "天津", 250: "河北",
+    346: "新疆", 349: "辽宁", 350: "湖南", 351: "吉林", 352: "广西", 353: "四川",
+    354: "海南", 355: "浙江", 356: "青海", 357: "江苏",
+}
+
+# 扩大检测时可选的运营商：电信、联通、移动
+ESCALATION_ISPS = [1, 2, 7]
+
 def get_province_ids():
     """获取去重后的省份ID列表"""
     return sorted(set(city["pro_id"] for city in MAJOR_CITIES))
@@ -106,6 +119,76 @@ def get_node_config():
         "areas": [1]
     }
 
+def get_economy_node_config():
+    """精简节点配置（积分预算紧张时定时检测使用）
+
+    - 2个省份：北京(180)、广东(195)
+    - 2个运营商：电信(1) + 联通(2)
+    - 1种节点类型：IDC(1)
+    - 理论节点数：2省 × 2运营商 × 1类型 × 1 = 4个，约为标准配置的 1/4
+    """
+    return {
+        "pro_ids": [180, 195],  # 北京、广东
+        "num": 1,
+        "nodetype": [1],
+        "isps": [1, 2],
+        "areas": [1]
+    }
+
+def get_sentinel_node_config():
+    """哨兵节点配置（分级检测第一阶段）
+
+    - 2个省份：北京(180)、广东(195)
+    - 3个运营商：电信(1) + 联通(2) + 移动(7)，每个运营商都有节点，单一运营商故障也能触发扩大检测
+    - 1种节点类型：IDC(1)
+    - 理论节点数：2省 × 3运营商 × 1类型 × 1 = 6个
+
+    全部节点正常时直接结束，任一节点失败才扩大检测范围。
+    """
+    return {
+        "pro_ids": [180, 195],  # 北京、广东
+        "num": 1,
+        "nodetype": [1],
+        "isps": [1, 2, 7],
+        "areas": [1]
+    }
+
+def get_escalation_node_config(failed_isps, failed_pro_ids):
+    """扩大检测节点配置（分级检测第二阶段）
+
+    - 省份：MAJOR_CITIES 覆盖的全部省份 + 哨兵检测中失败节点所在省份
+    - 运营商：哨兵检测中失败的运营商（无法识别时使用电信、联通、移动）
+    - 2种节点类型：IDC(1) + 路由器(2)
+    - 理论节点数：约 29省 × 失败运营商数 × 2类型，仅在哨兵发现异常时使用
+    """
+    isps = sorted(isp for isp in set(failed_isps) if isp in ESCALATION_ISPS) or list(ESCALATION_ISPS)
+    return {
+        "pro_ids": sorted(set(get_province_ids()) | set(failed_pro_ids)),
+        "num": 1,
+        "nodetype": [1, 2],
+        "isps": isps,
+        "areas": [1]
+    }
+
+def match_province_id(region):
+    """根据测速点地区描述（如 "广东深圳"、"北京"）识别省份ID，无法识别时返回 None"""
+    for pro_id, name in PROVINCE_NAMES.items():
+        if name in region:
+            return pro_id
+    for city in MAJOR_CITIES:
+        if city["name"] in region:
+            return city["pro_id"]
+    return None
+
+def estimate_node_count(node_config):
+    """按节点配置计算理论节点数（省份 × 运营商 × 节点类型 × num），作为单次任务节点数上限"""
+    return (
+        len(node_config.get("pro_ids", [])) *
+        len(node_config.get("isps", [])) *
+        len(node_config.get("nodetype", [])) *
+        node_config.get("num", 1)
+    )
+
 if __name__ == "__main__":
     print(f"🏙️ 配置城市总数: {len(MAJOR_CITIES)}")
     print(f"📍 省份数量: {len(get_province_ids())}")
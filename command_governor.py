@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Bot 高开销命令限流
+# /check、/checkone、/addmany、/deletemany 按聊天和全局限制同时执行的数量，超出立即拒绝；
+# 进行中的同一命令可以共享结果，重复请求只等待并复用
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Optional
+
+from probe_client import get_int_option
+
+DEFAULT_PER_CHAT_LIMIT = 2   # 每个聊天同时执行的高开销命令数
+DEFAULT_GLOBAL_LIMIT = 4     # 全部聊天同时执行的高开销命令数
+
+
+class CommandGovernor:
+    """高开销命令的并发名额与可共享的进行中任务。
+
+    只在 Bot 的事件循环中使用，不需要加锁。
+    """
+
+    def __init__(self) -> None:
+        # 聊天ID -> 执行中的命令数
+        self._running: Dict[int, int] = {}
+        self._total = 0
+        # 共享键 -> 进行中的任务
+        self._shared: Dict[str, asyncio.Task] = {}
+
+    @property
+    def total(self) -> int:
+        return self._total
+
+    def try_acquire(self, chat_id: int, command: str, config: Dict[str, Any]) -> Optional[str]:
+        """尝试占用一个名额，成功返回 None，超出限额返回拒绝原因（不排队）。
+
+        限额读取配置 command_per_chat_limit / command_global_limit。
+        """
+        per_chat = get_int_option(config, "command_per_chat_limit", DEFAULT_PER_CHAT_LIMIT)
+        global_limit = get_int_option(config, "command_global_limit", DEFAULT_GLOBAL_LIMIT)
+        running = self._running.get(chat_id, 0)
+        if running >= per_chat:
+            logging.warning("聊天 %s 的 %s 被限流：已有 %d 个命令在执行", chat_id, command, running)
+            return f"⏳ 当前聊天已有 {running} 个检测/批量命令在执行，请完成后再试"
+        if self._total >= global_limit:
+            logging.warning("聊天 %s 的 %s 被限流：全局已有 %d 个命令在执行", chat_id, command, self._total)
+            return f"⏳ Bot 正忙（{self._total} 个检测/批量命令在执行），请稍后再试"
+        self._running[chat_id] = running + 1
+        self._total += 1
+        return None
+
+    def release(self, chat_id: int) -> None:
+        """归还 try_acquire 占用的名额。"""
+        running = self._running.get(chat_id, 0) - 1
+        if running > 0:
+            self._running[chat_id] = running
+        else:
+            self._running.pop(chat_id, None)
+        self._total -= 1
+
+    def running(self, key: str) -> Optional[asyncio.Task]:
+        """返回共享键对应的进行中任务。"""
+        task = self._shared.get(key)
+        if task is None or task.done():
+            return None
+        return task
+
+    def run_shared(self, key: str, coro: Awaitable[Any]) -> asyncio.Task:
+        """以共享键启动任务，完成前其他请求可以通过 running() 加入等待。"""
+        task = asyncio.ensure_future(coro)
+        self._shared[key] = task
+
+        def _cleanup(done: asyncio.Task) -> None:
+            if self._shared.get(key) is done:
+                del self._shared[key]
+
+        task.add_done_callback(_cleanup)
+        return task
+
+
+# Bot 进程内共享的命令限流器
+command_governor = CommandGovernor()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# 17CE 积分预算
+# 按任务记录实际消耗的积分（返回的节点数），按天/站点汇总，预测余额耗尽时间并给出限流决策
+
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from site_store import DEFAULT_DB_FILE, connect_db, init_db
+
+# 预算模式
+MODE_NORMAL = "normal"       # 正常检测
+MODE_SHRINK = "shrink"       # 定时检测改用精简节点配置
+MODE_THROTTLE = "throttle"   # 定时检测只复查异常站点（精简节点配置）
+
+DEFAULT_MIN_DAYS = 30   # 预计剩余天数低于该值时启用精简节点配置
+SHRINK_RATIO = 0.8      # 当日消耗达到日预算的该比例时启用精简节点配置
+MEASURE_DAYS = 7        # 计算实测日均消耗参考的天数
+
+
+def today() -> str:
+    """当前本地日期（YYYY-MM-DD）。"""
+    return time.strftime("%Y-%m-%d")
+
+
+def days_ago(days: int) -> str:
+    """days 天前的本地日期（YYYY-MM-DD）。"""
+    return time.strftime("%Y-%m-%d", time.localtime(time.time() - days * 86400))
+
+
+class CreditLedger:
+    """基于 SQLite（WAL 模式）的积分消耗流水，与站点存储共用 db_file（表名 credit_usage）。"""
+
+    def __init__(self, path: str = DEFAULT_DB_FILE) -> None:
+        self.path = path
+        init_db(
+            path,
+            """
+            CREATE TABLE IF NOT EXISTS credit_usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts REAL NOT NULL,
+                day TEXT NOT NULL,
+                url TEXT NOT NULL,
+                credits INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_credit_usage_day ON credit_usage(day);
+            """,
+        )
+
+    def record(self, url: str, credits: int) -> None:
+        """记录一次测速任务消耗的积分。"""
+        if credits <= 0:
+            return
+        conn = connect_db(self.path)
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO credit_usage (ts, day, url, credits) VALUES (?, ?, ?, ?)",
+                    (time.time(), today(), url, credits),
+                )
+        except sqlite3.Error as exc:
+            logging.error("记录积分消耗失败: %s", exc)
+        finally:
+            conn.close()
+
+    def used_since(self, day: str) -> int:
+        """day（含）以来消耗的积分。"""
+        conn = connect_db(self.path)
+        try:
+            row = conn.execute("SELECT COALESCE(SUM(credits), 0) FROM credit_usage WHERE day >= ?", (day,)).fetchone()
+        finally:
+            conn.close()
+        return int(row[0])
+
+    def first_day(self) -> str:
+        """最早一条消耗记录的日期，无记录时返回空字符串。"""
+        conn = connect_db(self.path)
+        try:
+            row = conn.execute("SELECT MIN(day) FROM credit_usage").fetchone()
+        finally:
+            conn.close()
+        return str(row[0] or "")
+
+    def daily_totals(self, since: str) -> List[Tuple[str, int]]:
+        """since（含）以来每天消耗的积分，按日期升序。"""
+        conn = connect_db(self.path)
+        try:
+            rows = conn.execute(
+                "SELECT day, SUM(credits) FROM credit_usage WHERE day >= ? GROUP BY day ORDER BY day",
+                (since,),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [(day, int(total)) for day, total in rows]
+
+    def top_urls(self, since: str, limit: int = 5) -> List[Tuple[str, int]]:
+        """since（含）以来消耗积分最多的网址。"""
+        conn = connect_db(self.path)
+        try:
+            rows = conn.execute(
+                "SELECT url, SUM(credits) AS total FROM credit_usage WHERE day >= ? "
+                "GROUP BY url ORDER BY total DESC LIMIT ?",
+                (since, limit),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [(url, int(total)) for url, total in rows]
+
+
+_balance_date_warned = False
+
+_ledgers: Dict[str, CreditLedger] = {}
+_ledgers_lock = threading.Lock()
+
+
+def get_ledger(config: Dict[str, Any]) -> Optional[CreditLedger]:
+    """返回配置 db_file 对应的积分流水（进程内共享），打开失败时返回 None。"""
+    db_file = str(config.get("db_file") or DEFAULT_DB_FILE)
+    with _ledgers_lock:
+        ledger = _ledgers.get(db_file)
+        if ledger is None:
+            try:
+                ledger = CreditLedger(db_file)
+            except Exception as exc:
+                logging.error("打开积分流水失败: %s", exc)
+                return None
+            _ledgers[db_file] = ledger
+        return ledger
+
+
+class BudgetSettings:
+    """配置 budget 字段解析出的预算参数。
+
+    配置示例::
+
+        "budget": {
+            "balance": 10000,              # 账户余额
+            "balance_date": "2025-01-01",  # 余额对应的日期，此后的消耗从余额中扣除（未配置时取最早的消耗记录日期）
+            "daily_credits": 200,          # 每日积分预算
+            "min_days": 30                 # 预计剩余天数低于该值时精简节点配置
+        }
+    """
+
+    def __init__(self, config: Dict[str, Any]) -> None:
+        raw = config.get("budget", {})
+        if not isinstance(raw, dict):
+            logging.error("配置中的 budget 不是字典类型，已忽略")
+            raw = {}
+        self.balance = self._optional_int(raw, "balance")
+        self.balance_date = str(raw.get("balance_date") or "")
+        self.daily_credits = self._optional_int(raw, "daily_credits")
+        self.min_days = self._optional_int(raw, "min_days") or DEFAULT_MIN_DAYS
+
+    @staticmethod
+    def _optional_int(raw: Dict[str, Any], key: str) -> Optional[int]:
+        value = raw.get(key)
+        if value is None:
+            return None
+        try:
+            value = int(value)
+        except (ValueError, TypeError):
+            logging.warning("预算配置 %s=%r 解析失败，已忽略", key, value)
+            return None
+        return value if value > 0 else None
+
+
+def plan_budget(config: Dict[str, Any], ledger: Optional[CreditLedger], planned_daily: float) -> Dict[str, Any]:
+    """根据实际消耗与当前调度的预计消耗，给出预算状态与定时检测的限流决策。
+
+    Args:
+        config: 配置字典（读取 budget）
+        ledger: 积分流水，None 时按无消耗记录处理
+        planned_daily: 当前调度下预计的日均消耗
+
+    Returns:
+        {
+            "mode": 预算模式,
+            "reason": 非正常模式的原因,
+            "today": 今日已消耗,
+            "daily_credits": 每日预算,
+            "measured_daily": 最近 MEASURE_DAYS 天实测日均消耗,
+            "planned_daily": 预计日均消耗,
+            "remaining": 估算余额（未配置余额时为 None）,
+            "days_left": 预计可用天数（无法估算时为 None）,
+            "exhaust_date": 预计耗尽日期,
+        }
+    """
+    global _balance_date_warned
+    settings = BudgetSettings(config)
+    used_today = ledger.used_since(today()) if ledger is not None else 0
+    measured = ledger.used_since(days_ago(MEASURE_DAYS - 1)) / MEASURE_DAYS if ledger is not None else 0.0
+
+    remaining: Optional[int] = None
+    if settings.balance is not None:
+        balance_date = settings.balance_date
+        if not balance_date and ledger is not None:
+            # 未配置余额日期时从最早的消耗记录起扣除（偏保守），避免消耗始终不计入
+            balance_date = ledger.first_day()
+            if balance_date and not _balance_date_warned:
+                _balance_date_warned = True
+                logging.warning("预算配置了 balance 但未配置 balance_date，按最早的消耗记录日期 %s 起扣除", balance_date)
+        spent = ledger.used_since(balance_date) if ledger is not None and balance_date else 0
+        remaining = settings.balance - spent
+
+    days_left: Optional[float] = None
+    exhaust_date = ""
+    burn = max(planned_daily, measured)
+    if remaining is not None and burn > 0:
+        days_left = max(remaining, 0) / burn
+        exhaust_date = time.strftime("%Y-%m-%d", time.localtime(time.time() + days_left * 86400))
+
+    mode, reason = MODE_NORMAL, ""
+    if settings.daily_credits is not None and used_today >= settings.daily_credits:
+        mode, reason = MODE_THROTTLE, f"今日已消耗 {used_today} 积分，达到日预算 {settings.daily_credits}"
+    elif remaining is not None and remaining <= 0:
+        mode, reason = MODE_THROTTLE, f"估算余额已用尽（{remaining}）"
+    elif settings.daily_credits is not None and used_today >= settings.daily_credits * SHRINK_RATIO:
+        mode, reason = MODE_SHRINK, f"今日已消耗 {used_today} 积分，接近日预算 {settings.daily_credits}"
+    elif days_left is not None and days_left < settings.min_days:
+        mode, reason = MODE_SHRINK, f"预计 {days_left:.0f} 天后余额耗尽（低于 {settings.min_days} 天）"
+
+    return {
+        "mode": mode,
+        "reason": reason,
+        "today": used_today,
+        "daily_credits": settings.daily_credits,
+        "measured_daily": measured,
+        "planned_daily": planned_daily,
+        "remaining": remaining,
+        "days_left": days_left,
+        "exhaust_date": exhaust_date,
+    }
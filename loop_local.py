@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# 按事件循环隔离的共享对象
+# 定时检测与 Bot 共用一个事件循环，脚本入口（monitor_all、call_17ce_api）使用各自的事件循环；
+# 17CE 会话、Telegram 发送器、通知管道等绑定事件循环的对象每个循环各一个，循环结束后随之释放
+
+import asyncio
+import weakref
+from typing import Awaitable, Callable, Generic, Optional, Set, TypeVar
+
+T = TypeVar("T")
+
+
+class LoopLocal(Generic[T]):
+    """每个事件循环一个实例的注册表（弱引用事件循环）。
+
+    Args:
+        close: 关闭实例的协程函数，实例被替换时在后台调用；None 表示替换时无需关闭
+    """
+
+    def __init__(self, close: Optional[Callable[[T], Awaitable[None]]] = None) -> None:
+        self._close = close
+        self._items: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, T]" = weakref.WeakKeyDictionary()
+        # 被替换的旧实例在后台关闭的任务（保留引用，避免任务被回收）
+        self._closing: Set[asyncio.Task] = set()
+
+    def get(self) -> Optional[T]:
+        """当前事件循环上的实例，尚未创建时返回 None。"""
+        return self._items.get(asyncio.get_running_loop())
+
+    def set(self, value: T) -> None:
+        """设置当前事件循环上的实例，原有实例在后台关闭。"""
+        loop = asyncio.get_running_loop()
+        old = self._items.get(loop)
+        self._items[loop] = value
+        if old is not None and old is not value and self._close is not None:
+            task = loop.create_task(self._close(old))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    def pop(self) -> Optional[T]:
+        """移除并返回当前事件循环上的实例（由调用方关闭）。"""
+        return self._items.pop(asyncio.get_running_loop(), None)
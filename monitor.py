@@ -1,604 +1,687 @@
 import asyncio
-import base64
-import hashlib
+import atexit
+import copy
 import html
 import json
 import logging
-import re
+import os
+import signal
 import threading
 import time
 from typing import Any, Dict, List, Optional, Tuple
 
-import requests
-import schedule
-import websocket
 from telegram import BotCommand, Message, Update
 from telegram.ext import Application, CommandHandler, ContextTypes
 
+# 导入节点流式统计
+from round_analyzer import analyze_round, status_label
+# 导入 17CE 异步拨测客户端
+from probe_client import (
+    DEFAULT_RESULT_CACHE_TTL,
+    LANE_NAMES,
+    PRIORITY_BACKGROUND,
+    PRIORITY_CONFIRM,
+    PRIORITY_INTERACTIVE,
+    RETRY_TIMES,
+    circuit_breaker,
+    close_session,
+    get_int_option,
+    node_counts,
+    probe_limiter,
+    probe_site,
+    probe_sites,
+)
 # 导入城市节点配置
-from city_nodes_config import get_node_config
+from city_nodes_config import estimate_node_count, get_economy_node_config, get_node_config, get_sentinel_node_config
+# 导入积分预算
+from credit_budget import MEASURE_DAYS, MODE_NORMAL, MODE_THROTTLE, days_ago, get_ledger, plan_budget
+# 导入站点存储与匹配工具
+from site_store import (
+    DEFAULT_DB_FILE,
+    NameAllocator,
+    SiteIndex,
+    SqliteSiteStore,
+    extract_domain_from_url,
+    normalize_url,
+)
+# 导入站点最近状态存储
+from status_store import VERDICT_ALERT, VERDICT_API_FAILED, VERDICT_NORMAL, SiteStatusStore
+# 导入按站点自适应的调度器
+from scheduler import ScheduleConfig, SiteScheduler
+# 导入命令限流
+from command_governor import command_governor
+# 导入 Webhook 接收服务
+from webhook_server import WebhookServer, WebhookSettings
+# 导入 Telegram 告警发送
+from alert_dispatcher import close_dispatcher, delivery_stats
+# 导入告警通知管道
+from notifier import close_notifier, get_notifier
 
 CONFIG_FILE = "config.json"
 LOG_FILE = "monitor.log"
 DEFAULT_THRESHOLD = 0.20
-RETRY_TIMES = 3
-SLEEP_BETWEEN_RETRY = 5
 AUTO_DELETE_SECONDS = 60  # Bot消息自动删除时间（秒）
+CHECK_DEADLINE_SECONDS = 180  # /check 连续该时长没有站点完成时结束检测（秒）
+PROGRESS_EDIT_INTERVAL = 3  # /check 进度消息的最小编辑间隔（秒），避免触发 Telegram 编辑频率限制
+PROGRESS_MAX_ABNORMAL = 10  # /check 进度消息中最多列出的异常站点数
 
 # 配置文件读写锁，防止并发操作导致数据损坏
 _config_lock = threading.Lock()
 
+# 配置缓存：解析后的快照及对应的文件签名 (mtime, size, inode)
+_config_snapshot: Optional["ConfigSnapshot"] = None
+_config_signature: Optional[Tuple[int, int, int]] = None
 
-def extract_domain_from_url(url: str) -> str:
-    """从URL中提取域名作为站点名称。
+# 站点写操作锁（config.json 的读-改-写）与 SQLite 站点存储实例
+_sites_write_lock = threading.Lock()
+_site_store: Optional[SqliteSiteStore] = None
+_site_store_lock = threading.Lock()
 
-    示例:
-        https://www.example.com → example.com
-        https://www.example.com/path → example.com
-        www.example.com → example.com
-        example.com → example.com
-    """
-    # 移除协议前缀
-    url = re.sub(r'^https?://', '', url)
-    # 移除路径和参数
-    url = url.split('/')[0].split('?')[0].split('#')[0]
-    # 移除端口
-    url = url.split(':')[0]
-    # 移除 www. 前缀
-    url = re.sub(r'^www\.', '', url)
-    return url.strip()
+# 站点最近状态存储实例（供 /status 使用）
+_status_store: Optional[SiteStatusStore] = None
+_status_store_lock = threading.Lock()
 
+# 上一轮定时检测的预算模式（模式变化时发送提醒）
+_budget_mode = MODE_NORMAL
 
-def normalize_url(url: str) -> str:
-    """标准化URL，确保有协议前缀。
+# monitor_all 同步入口专用的事件循环（跨轮次复用）
+_round_loop: Optional[asyncio.AbstractEventLoop] = None
+# 与 Bot 同一事件循环上运行的定时检测任务
+_scheduler_task: Optional[asyncio.Task] = None
 
-    Args:
-        url: 原始URL（可能没有协议）
 
-    Returns:
-        标准化的URL（确保有https://协议）
+def setup_logging() -> None:
+    """初始化日志配置，记录到文件并输出基本格式。"""
+    logging.basicConfig(
+        filename=LOG_FILE,
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+    )
+    # httpx 的请求日志包含带 Bot Token 的地址，只记录警告以上
+    logging.getLogger("httpx").setLevel(logging.WARNING)
 
-    示例:
-        www.example.com → https://www.example.com
-        example.com → https://example.com
-        https://example.com → https://example.com
+
+class ConfigSnapshot:
+    """某一时刻已解析、已校验的配置快照（只读，多处共享）。
+
+    Attributes:
+        data: 原始配置字典（已补齐必填字段）
+        sites: 校验后的站点列表
+        allowed_chat_ids: 允许操作 Bot 的 Chat ID 集合（统一为字符串）
+        threshold: 校验后的告警阈值
     """
-    url = url.strip()
-    if not url.startswith(('http://', 'https://')):
-        url = f'https://{url}'
-    return url
 
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.data = data
 
-def generate_unique_name(base_name: str, existing_sites: List[Dict[str, Any]]) -> str:
-    """生成唯一的站点名称，如果重名则添加编号。
+        sites = data.get("sites", [])
+        if not isinstance(sites, list):
+            logging.error("配置中的 sites 不是列表类型: %s，降级为空列表", type(sites))
+            sites = []
+        self.sites: List[Dict[str, Any]] = sites
 
-    Args:
-        base_name: 基础名称（通常是域名）
-        existing_sites: 已存在的站点列表
+        allowed_ids = data.get("allowed_chat_ids", [])
+        if not isinstance(allowed_ids, list):
+            logging.error("配置中的 allowed_chat_ids 不是列表类型，已重置为空列表")
+            allowed_ids = []
+        # 支持字符串和整数格式的 Chat ID
+        self.allowed_chat_ids = frozenset(str(chat_id) for chat_id in allowed_ids)
 
-    Returns:
-        唯一的站点名称
-    """
-    existing_names = {site.get("name", "") for site in existing_sites}
+        self.threshold = parse_threshold(data)
+        self._site_index: Optional[SiteIndex] = None
 
-    # 如果名称不存在，直接返回
-    if base_name not in existing_names:
-        return base_name
+    @property
+    def site_index(self) -> SiteIndex:
+        """站点匹配索引，首次使用时构建；配置变化会产生新快照，索引随之重建。"""
+        if self._site_index is None:
+            self._site_index = SiteIndex(self.sites)
+        return self._site_index
 
-    # 否则添加编号
-    counter = 2
-    while f"{base_name}-{counter}" in existing_names:
-        counter += 1
-    return f"{base_name}-{counter}"
 
+def parse_threshold(config: Dict[str, Any]) -> float:
+    """安全地解析告警阈值，超出 [0,1] 或格式错误时使用默认值。"""
+    try:
+        threshold_raw = config.get("alert_threshold", DEFAULT_THRESHOLD)
+        threshold = float(threshold_raw)
+        if not 0 <= threshold <= 1:
+            logging.warning("告警阈值超出范围 [0,1]，使用默认值: %s", DEFAULT_THRESHOLD)
+            threshold = DEFAULT_THRESHOLD
+    except (ValueError, TypeError) as exc:
+        logging.warning("告警阈值解析失败，使用默认值 %s: %s", DEFAULT_THRESHOLD, exc)
+        threshold = DEFAULT_THRESHOLD
+    return threshold
 
-def match_site_by_url(url_or_domain: str, site: Dict[str, Any]) -> bool:
-    """判断站点是否匹配给定的URL或域名。
 
-    支持匹配：
-    - 完整URL: https://www.example.com
-    - 带www域名: www.example.com
-    - 纯域名: example.com
-    - 站点名称: example.com 或 example.com-2
-    """
-    site_url = site.get("url", "")
-    site_name = site.get("name", "")
-
-    # 提取输入的域名
-    input_domain = extract_domain_from_url(url_or_domain)
-    # 提取站点URL的域名
-    site_domain = extract_domain_from_url(site_url)
-
-    # 匹配条件：
-    # 1. 域名匹配
-    # 2. URL完全匹配
-    # 3. 名称匹配（支持 example.com 和 example.com-2）
-    return (
-        input_domain == site_domain or
-        url_or_domain == site_url or
-        url_or_domain == site_name or
-        site_name.startswith(f"{input_domain}-")
-    )
+def _config_file_signature() -> Optional[Tuple[int, int, int]]:
+    """配置文件的 (mtime, size, inode)，文件不存在时返回 None。"""
+    try:
+        st = os.stat(CONFIG_FILE)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
 
 
-def setup_logging() -> None:
-    """初始化日志配置，记录到文件并输出基本格式。"""
-    logging.basicConfig(
-        filename=LOG_FILE,
-        level=logging.INFO,
-        format="%(asctime)s - %(levelname)s - %(message)s",
-    )
+def _read_config_file() -> Dict[str, Any]:
+    """读取并解析配置文件，失败时返回默认结构以保证流程继续运行。"""
+    config: Dict[str, Any]
+    try:
+        with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    except Exception as exc:
+        logging.error("加载配置失败，将使用默认配置: %s", exc)
+        config = {"sites": [], "alert_threshold": DEFAULT_THRESHOLD}
 
+    if not isinstance(config, dict):
+        logging.error("配置文件顶层不是字典类型，已使用默认配置")
+        config = {"sites": [], "alert_threshold": DEFAULT_THRESHOLD}
 
-def load_config() -> Dict[str, Any]:
-    """读取配置文件，失败时返回默认结构以保证流程继续运行。"""
+    # 校验必填字段缺失时兜底为空字符串，避免后续功能报错
+    required_keys = ["17ce_username", "17ce_token", "telegram_bot_token", "telegram_chat_id"]
+    for key in required_keys:
+        if key not in config:
+            logging.error("配置缺少必填字段 %s，已使用默认值", key)
+            config[key] = ""
+    return config
+
+
+def get_config() -> ConfigSnapshot:
+    """获取进程内缓存的配置快照，仅在配置文件 mtime/size/inode 变化时重新解析。
+
+    返回的快照在多处共享，调用方不得修改；需要修改配置时使用 load_config()。
+    """
+    global _config_snapshot, _config_signature
     with _config_lock:
-        config: Dict[str, Any]
-        try:
-            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-                config = json.load(f)
-        except Exception as exc:
-            logging.error("加载配置失败，将使用默认配置: %s", exc)
-            config = {"sites": [], "alert_threshold": DEFAULT_THRESHOLD}
+        signature = _config_file_signature()
+        if _config_snapshot is None or signature != _config_signature:
+            _config_snapshot = ConfigSnapshot(_read_config_file())
+            _config_signature = signature
+        return _config_snapshot
 
-        if not isinstance(config, dict):
-            logging.error("配置文件顶层不是字典类型，已使用默认配置")
-            config = {"sites": [], "alert_threshold": DEFAULT_THRESHOLD}
 
-        # 校验必填字段缺失时兜底为空字符串，避免后续功能报错
-        required_keys = ["17ce_username", "17ce_token", "telegram_bot_token", "telegram_chat_id"]
-        for key in required_keys:
-            if key not in config:
-                logging.error("配置缺少必填字段 %s，已使用默认值", key)
-                config[key] = ""
-        return config
+def load_config() -> Dict[str, Any]:
+    """读取配置的可修改副本（基于缓存快照，不重复解析文件）。"""
+    return copy.deepcopy(get_config().data)
 
 
 def save_config(config: Dict[str, Any]) -> None:
     """保存配置到文件，失败时记录错误。使用文件锁防止并发写入。"""
+    global _config_snapshot, _config_signature
     with _config_lock:
         try:
             with open(CONFIG_FILE, "w", encoding="utf-8") as f:
                 json.dump(config, f, indent=4, ensure_ascii=False)
         except Exception as exc:
             logging.error("保存配置失败: %s", exc)
+            return
+        # 写入成功后直接刷新缓存，避免下次读取重新解析
+        _config_snapshot = ConfigSnapshot(copy.deepcopy(config))
+        _config_signature = _config_file_signature()
 
 
-def call_17ce_api(url: str, config: Dict[str, Any], retries: int = RETRY_TIMES) -> Optional[Dict[str, Any]]:
-    """调用 17CE WebSocket API 进行实时测速。"""
-    username = config.get("17ce_username")
-    token = config.get("17ce_token")
-    if not username or not token:
-        logging.error("17CE 凭证未配置")
+def get_site_store() -> Optional[SqliteSiteStore]:
+    """配置 site_store 为 "sqlite" 时返回 SQLite 站点存储（首次启用时迁移 config.json 中的站点），否则返回 None。"""
+    global _site_store
+    config = get_config().data
+    if str(config.get("site_store", "json")).lower() != "sqlite":
         return None
+    db_file = str(config.get("db_file") or DEFAULT_DB_FILE)
+    with _site_store_lock:
+        if _site_store is None or _site_store.path != db_file:
+            store = SqliteSiteStore(db_file)
+            store.migrate_from_config(get_config().sites)
+            _site_store = store
+        return _site_store
+
+
+def get_status_store() -> Optional[SiteStatusStore]:
+    """返回站点最近状态存储（与 SQLite 站点存储共用 db_file），打开失败时返回 None。"""
+    global _status_store
+    db_file = str(get_config().data.get("db_file") or DEFAULT_DB_FILE)
+    with _status_store_lock:
+        if _status_store is None or _status_store.path != db_file:
+            try:
+                _status_store = SiteStatusStore(db_file)
+            except Exception as exc:
+                logging.error("打开站点状态存储失败: %s", exc)
+                return None
+        return _status_store
 
-    normalized_url = normalize_url(url)
 
-    for attempt in range(retries):
-        ws = None
-        try:
-            # 生成认证签名（md5(token)[4:23] 与官方一致）
-            ut = str(int(time.time()))
-            pwd_md5 = hashlib.md5(token.encode()).hexdigest()[4:23]
-            code = hashlib.md5(
-                base64.b64encode((pwd_md5 + username + ut).encode())
-            ).hexdigest()
-
-            # 连接 WebSocket（在 URL 上附带认证参数，官方示例方式）
-            ws_url = f"wss://wsapi.17ce.com:8001/socket/?ut={ut}&code={code}&user={username}"
-            ws = websocket.create_connection(ws_url, timeout=30, sslopt={"cert_reqs": 0})
-            logging.info(f"17CE WebSocket 已连接 (第{attempt+1}次) {normalized_url}")
-
-            # 发送测速请求（全国主要城市覆盖配置）
-            txnid = int(time.time())
-
-            # 获取城市节点配置
-            node_config = get_node_config()
-
-            test_msg = json.dumps({
-                "txnid": txnid,
-                "nodetype": node_config["nodetype"],  # [1, 2] IDC + 路由器（数组格式）
-                "num": node_config["num"],            # 每省分配的节点数
-                "TestType": "HTTP",
-                "Url": normalized_url,
-                "TimeOut": 20,
-                "Request": "GET",
-                "NoCache": True,
-                "type": 1,
-                "isps": node_config["isps"],          # 运营商数组
-                "areas": node_config["areas"],        # 区域数组
-                "pro_ids": node_config["pro_ids"]     # 省份ID数组（官方API参数）
-            })
-            logging.info(f"17CE 测速请求（{len(node_config['pro_ids'])}个核心省份，每省{node_config['num']}个节点）: {test_msg}")
-            ws.send(test_msg)
-            logging.info(f"17CE 已发送测速请求: {normalized_url} (txnid={txnid})")
-
-            data_list: List[Dict[str, Any]] = []
-            start_time = time.time()
-            total_timeout = 60  # 总超时时间，避免无限等待
-
-            while time.time() - start_time < total_timeout:
-                ws.settimeout(5)
-                try:
-                    raw_msg = ws.recv()
-                except websocket.WebSocketTimeoutException:
-                    continue
-                except websocket.WebSocketConnectionClosedException:
-                    logging.error("17CE WebSocket 连接已关闭")
-                    break
-                except Exception as exc:
-                    logging.warning("17CE WebSocket 接收异常: %s", exc)
-                    break
-
-                try:
-                    resp = json.loads(raw_msg)
-                except ValueError as exc:
-                    logging.warning("17CE WebSocket 消息解析失败: %s", exc)
-                    continue
-
-                msg_type = str(resp.get("type") or "")
-                if msg_type == "TaskAccept":
-                    logging.info(f"17CE 任务已接受 (txnid={txnid})")
-                elif msg_type == "NewData":
-                    node_data = resp.get("data", {}) or {}
-                    if isinstance(node_data, dict):
-                        node_data["status"] = node_data.get("HttpCode", 0)
-                        node_data["loss"] = node_data.get("Loss", 0)
-                        data_list.append(node_data)
-                    else:
-                        logging.info("17CE 收到非字典节点数据，已忽略")
-                elif msg_type == "TaskEnd":
-                    logging.info(f"17CE 检测完成，获得 {len(data_list)} 个节点数据")
-                    return {"data": data_list}
-                elif msg_type == "TaskErr":
-                    logging.error(f"17CE 任务失败: {resp.get('error')}")
-                    break
-                else:
-                    logging.info(f"17CE 收到消息类型: {msg_type}, 完整消息: {resp}")
-
-            logging.error("17CE WebSocket 接收超时或任务未完成")
+def list_sites(snapshot: Optional[ConfigSnapshot] = None) -> List[Dict[str, Any]]:
+    """返回当前全部监控站点（SQLite 存储或 config.json）。"""
+    store = get_site_store()
+    if store is not None:
+        return store.list_sites()
+    return (snapshot or get_config()).sites
 
-        except Exception as exc:
-            logging.warning("17CE 调用失败（第 %s 次）: %s", attempt + 1, exc)
-        finally:
-            if ws:
-                try:
-                    ws.close()
-                except Exception:
-                    pass
 
-        if attempt < retries - 1:
-            time.sleep(SLEEP_BETWEEN_RETRY)
+def add_sites(urls: List[str]) -> List[Dict[str, str]]:
+    """批量添加站点，名称从URL提取域名并自动编号去重。
 
-    logging.error(f"17CE API 调用最终失败，已重试 {retries} 次: {normalized_url}")
-    return None
+    Returns:
+        新增的站点列表
+    """
+    store = get_site_store()
+    if store is not None:
+        return store.add_sites(urls)
+
+    with _sites_write_lock:
+        config = load_config()
+        sites = config.get("sites", [])
+        if not isinstance(sites, list):
+            logging.error("配置中的 sites 不是列表类型，已重置为空列表")
+            sites = []
+
+        added: List[Dict[str, str]] = []
+        allocator = NameAllocator(site.get("name", "") for site in sites if isinstance(site, dict))
+        for url in urls:
+            if not url:
+                continue
+            # 从URL提取域名作为名称，生成唯一名称（如果重复则自动编号）
+            name = allocator.allocate(extract_domain_from_url(url))
+            site = {"name": name, "url": url}
+            sites.append(site)
+            added.append(site)
+
+        config["sites"] = sites
+        save_config(config)
+        return added
+
+
+def delete_sites(items: List[str]) -> List[Dict[str, str]]:
+    """删除与任一输入（URL、域名或名称）匹配的站点，同时删除其最近状态记录。
 
+    Returns:
+        被删除的站点列表
+    """
+    deleted = _delete_matching_sites(items)
+    if deleted:
+        # 否则同名站点重新添加后会沿用旧结论（及重启后恢复的异常复查间隔）
+        status_store = get_status_store()
+        if status_store is not None:
+            status_store.delete([site["name"] for site in deleted])
+    return deleted
+
+
+def _delete_matching_sites(items: List[str]) -> List[Dict[str, str]]:
+    """从站点存储或 config.json 中删除匹配的站点，返回被删除的站点列表。"""
+    store = get_site_store()
+    if store is not None:
+        return store.delete_matching(items)
+
+    with _sites_write_lock:
+        snapshot = get_config()
+        # 通过快照上的索引查找匹配站点，下标与 snapshot.sites 一一对应
+        matched = snapshot.site_index.match_any(items)
+        if not matched:
+            return []
+
+        # 基于同一快照复制，保证下标与索引一致
+        config = copy.deepcopy(snapshot.data)
+        deleted: List[Dict[str, str]] = []
+        new_sites = []
+        for idx, site in enumerate(config["sites"]):
+            if idx in matched:
+                deleted.append({"name": site.get("name", ""), "url": site.get("url", "")})
+            else:
+                new_sites.append(site)
 
-def analyze_results(results: Optional[Dict[str, Any]], threshold: float) -> Tuple[Optional[Dict[str, int]], Optional[Dict[str, int]], Optional[Dict[str, Dict[str, int]]], float]:
-    """解析 17CE 返回结果，计算失败率并识别受影响运营商、地区和异常类型。
+        config["sites"] = new_sites
+        save_config(config)
+        return deleted
 
-    返回 (None, None, None, -1.0) 表示API数据无效，调用方应将其视为API失败。
-    """
-    # 检查结果是否为空或缺少data字段
-    if not results or "data" not in results:
-        logging.error("17CE API 返回数据缺少 data 字段")
-        return None, None, None, -1.0  # -1.0 表示API失败
-
-    data = results.get("data", [])
-    # 验证 data 是否为列表
-    if not isinstance(data, list):
-        logging.error("17CE 返回的 data 不是列表类型: %s", type(data))
-        return None, None, None, -1.0  # -1.0 表示API失败
-
-    total = len(data)
-    if total == 0:
-        logging.warning("17CE 返回的 data 为空列表")
-        return None, None, None, -1.0  # -1.0 表示API失败
-
-    failed = 0
-    skipped = 0
-    operators = {"电信": 0, "联通": 0, "移动": 0, "其他": 0}
-    regions: Dict[str, int] = {}
-    # 异常类型 -> 地区 -> 计数
-    error_types: Dict[str, Dict[str, int]] = {}
-
-    for node in data:
+
+def call_17ce_api(url: str, config: Dict[str, Any], retries: int = RETRY_TIMES, keep_nodes: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """调用 17CE WebSocket API 进行实时测速（同步封装，供脚本使用）。"""
+    async def _call() -> Optional[Dict[str, Any]]:
         try:
-            # 安全地提取和转换字段（新数据结构）
-            status_raw = node.get("status", 0)
-            loss_raw = node.get("loss", 0)
+            return await probe_site(normalize_url(url), config, retries, keep_nodes)
+        finally:
+            await close_session()
 
-            # 处理可能的字符串值（如 "--"、""、None）
-            try:
-                status = int(status_raw) if status_raw not in (None, "", "--") else 0
-            except (ValueError, TypeError):
-                status = 0
+    return asyncio.run(_call())
 
-            try:
-                loss = float(loss_raw) if loss_raw not in (None, "", "--") else 0
-            except (ValueError, TypeError):
-                loss = 0
-
-            # 从 NodeInfo 中提取运营商ID，转换为中文名称
-            node_info = node.get("NodeInfo", {}) or {}
-            isp_id = str(node_info.get("isp", ""))
-            isp_map = {"1": "电信", "2": "联通", "7": "移动"}
-            isp = isp_map.get(isp_id, "其他")
-
-            # 获取响应IP（SrcIP 字段）
-            response_ip = str(node.get("SrcIP", ""))
-
-            # 获取测速点地区信息（从 srcip.srcip_from）
-            srcip_info = node.get("srcip", {}) or {}
-            region = str(srcip_info.get("srcip_from", "未知"))
-        except Exception as exc:
-            # 跳过异常节点并记录
-            skipped += 1
-            logging.warning("跳过异常节点数据: %s", exc)
-            continue
 
-        # 判定节点是否失败（包含异常 IP 检测）
-        is_failed = (
-            status != 200 or
-            loss >= 100 or
-            response_ip == "0.0.0.0" or
-            response_ip.startswith("127.")
-        )
+def analyze_results_detailed(results: Optional[Dict[str, Any]]) -> Tuple[float, Dict[str, int], str]:
+    """解析 17CE 返回结果，返回详细检测状态（用于 /check 命令）。
 
-        if is_failed:
-            failed += 1
-            if "电信" in isp:
-                operators["电信"] += 1
-            elif "联通" in isp:
-                operators["联通"] += 1
-            elif "移动" in isp:
-                operators["移动"] += 1
-            else:
-                operators["其他"] += 1
-
-            # 统计地区
-            regions[region] = regions.get(region, 0) + 1
-
-            # 识别异常类型
-            error_type = ""
-            if response_ip == "0.0.0.0":
-                error_type = "DNS解析失败(0.0.0.0)"
-            elif response_ip.startswith("127."):
-                error_type = "DNS劫持(127.x.x.x)"
-            elif loss >= 100:
-                error_type = "连接超时/丢包100%"
-            elif status == 0:
-                error_type = "无法连接"
-            elif status == 404:
-                error_type = "404页面不存在"
-            elif status in (500, 502, 503):
-                error_type = f"{status}服务器错误"
-            else:
-                error_type = f"HTTP{status}错误"
+    返回: (失败率, 地区分布字典, 状态描述)
+    """
+    summary = analyze_round(results, DEFAULT_THRESHOLD)
+    if not summary["valid"]:
+        return -1.0, {}, summary["error"]
+    return summary["fail_rate"], summary["regions"], status_label(summary["fail_rate"])
 
-            # 统计异常类型的地区分布
-            if error_type not in error_types:
-                error_types[error_type] = {}
-            error_types[error_type][region] = error_types[error_type].get(region, 0) + 1
 
-    # 记录跳过的节点数
-    if skipped > 0:
-        logging.warning("本轮检测跳过 %d 个异常节点", skipped)
+def result_cache_ttl(config: Dict[str, Any]) -> int:
+    """Bot 命令可复用的检测结果有效期（秒），配置 result_cache_ttl 为 0 时总是重新检测。"""
+    return get_int_option(config, "result_cache_ttl", DEFAULT_RESULT_CACHE_TTL, minimum=0)
 
-    # 使用有效节点数计算失败率（排除跳过的节点）
-    valid_total = total - skipped
-    if valid_total == 0:
-        # 所有节点都被跳过，无法计算失败率
-        logging.error("所有节点数据异常，无法计算失败率")
-        return None, None, None, -1.0
 
-    fail_rate = failed / valid_total
+def format_age(seconds: float) -> str:
+    """将结果时长格式化为 "N 秒" / "N 分钟"。"""
+    if seconds < 60:
+        return f"{int(seconds)} 秒"
+    return f"{int(seconds // 60)} 分钟"
 
-    # 检查是否需要告警（满足任一条件即可）
-    should_alert = False
 
-    # 条件1：全国失败率超过阈值
-    if fail_rate > threshold:
-        should_alert = True
-        logging.info("触发全国告警：失败率 %.2f%% > 阈值 %.2f%%", fail_rate * 100, threshold * 100)
+def group_by_target(sites: List[Dict[str, Any]]) -> Dict[str, List[int]]:
+    """按标准化URL分组站点，返回 {检测目标: [站点下标]}（按首次出现顺序）。"""
+    groups: Dict[str, List[int]] = {}
+    for idx, site in enumerate(sites):
+        if site.get("url"):
+            groups.setdefault(normalize_url(site["url"]), []).append(idx)
+    return groups
 
-    # 条件2：单地区失败节点数 >= 3
-    if not should_alert:
-        for region, count in regions.items():
-            if count >= 3:
-                should_alert = True
-                logging.info("触发区域告警：%s 失败 %d 个节点（≥3）", region, count)
-                break
 
-    if should_alert:
-        return operators, regions, error_types, fail_rate
-    return None, None, None, fail_rate
+def per_probe_credits(config: Dict[str, Any]) -> int:
+    """定时检测单次任务的预期积分消耗（分级检测时按哨兵节点计）。"""
+    node_config = get_sentinel_node_config() if config.get("tiered_probe", False) else get_node_config()
+    return node_counts.expected(node_config) or estimate_node_count(node_config)
 
 
-def analyze_results_detailed(results: Optional[Dict[str, Any]]) -> Tuple[float, Dict[str, int], str]:
-    """解析 17CE 返回结果，返回详细检测状态（用于 /check 命令）。
+def planned_daily_credits(sites: List[Dict[str, Any]], config: Dict[str, Any]) -> float:
+    """按当前调度配置与预期节点数估算定时检测的日均积分消耗。
 
-    返回: (失败率, 地区分布字典, 状态描述)
+    同一网址的多个站点每轮只检测一次，按其中最短的检测间隔计。
     """
-    if not results or "data" not in results:
-        return -1.0, {}, "❌ API调用失败"
-
-    data = results.get("data", [])
-    if not isinstance(data, list) or len(data) == 0:
-        return -1.0, {}, "❌ 无检测数据"
-
-    total = len(data)
-    failed = 0
-    regions: Dict[str, int] = {}
+    schedule_config = ScheduleConfig(config)
+    probes = sum(
+        schedule_config.probes_per_day(min(schedule_config.site_interval(sites[idx], False) for idx in indexes))
+        for indexes in group_by_target(sites).values()
+    )
+    return probes * per_probe_credits(config)
 
-    for node in data:
-        try:
-            status_raw = node.get("status", 0)
-            loss_raw = node.get("loss", 0)
 
-            try:
-                status = int(status_raw) if status_raw not in (None, "", "--") else 0
-            except (ValueError, TypeError):
-                status = 0
+def duplicate_savings(sites: List[Dict[str, Any]], config: Dict[str, Any]) -> Tuple[int, int, float]:
+    """重复网址合并检测的效果：(站点数, 检测目标数, 每日节省的预计积分)。"""
+    schedule_config = ScheduleConfig(config)
+    groups = group_by_target(sites)
+    separate = sum(
+        schedule_config.probes_per_day(schedule_config.site_interval(sites[idx], False))
+        for indexes in groups.values()
+        for idx in indexes
+    )
+    site_count = sum(len(indexes) for indexes in groups.values())
+    return site_count, len(groups), separate * per_probe_credits(config) - planned_daily_credits(sites, config)
 
-            try:
-                loss = float(loss_raw) if loss_raw not in (None, "", "--") else 0
-            except (ValueError, TypeError):
-                loss = 0
-
-            # 获取响应IP（SrcIP 字段）
-            response_ip = str(node.get("SrcIP", ""))
-
-            # 获取测速点地区信息（从 srcip.srcip_from）
-            srcip_info = node.get("srcip", {}) or {}
-            region = str(srcip_info.get("srcip_from", "未知"))
-
-            # 判定节点是否失败
-            is_failed = (
-                status != 200 or
-                loss >= 100 or
-                response_ip == "0.0.0.0" or
-                response_ip.startswith("127.")
-            )
 
-            if is_failed:
-                failed += 1
-                regions[region] = regions.get(region, 0) + 1
-        except Exception:
-            continue
+def budget_status(snapshot: ConfigSnapshot, sites: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """当前积分预算状态（见 credit_budget.plan_budget）。"""
+    return plan_budget(snapshot.data, get_ledger(snapshot.data), planned_daily_credits(sites, snapshot.data))
 
-    fail_rate = failed / total if total > 0 else 0.0
 
-    # 生成状态描述
-    if fail_rate >= 0.20:
-        status_emoji = "❌"
-        status_text = "异常"
-    elif fail_rate >= 0.10:
-        status_emoji = "⚠️"
-        status_text = "警告"
-    else:
-        status_emoji = "✅"
-        status_text = "正常"
+def send_alerts(messages: List[str], config: Dict[str, Any]) -> None:
+    """把告警消息（HTML）放入通知管道，分发给配置的每个通知目标，不等待发送结果。
 
-    return fail_rate, regions, f"{status_emoji} {status_text}"
+    需在事件循环中调用；合并、重试与死信见 notifier。
+    """
+    get_notifier().publish(messages, config)
 
 
 def send_alert(message: str, config: Dict[str, Any]) -> None:
-    """通过 Telegram 发送告警消息。"""
-    token = config.get("telegram_bot_token")
-    chat_id = config.get("telegram_chat_id")
-    if not token or not chat_id:
-        logging.error("Telegram 凭证未配置，跳过告警发送")
-        return
+    """发送单条告警消息（见 send_alerts）。"""
+    send_alerts([message], config)
+
+
+def format_alert(name: str, url: str, summary: Dict[str, Any], note: str = "") -> str:
+    """根据分析结果生成单个站点的告警消息（HTML），note 为附加说明。"""
+    # HTML转义所有动态字段防止注入
+    safe_name = html.escape(name)
+    safe_url = html.escape(url)
+
+    # 构建异常详情文本
+    error_details = []
+    for error_type, region_counts in summary["error_types"].items():
+        # 按节点数排序，取前5个地区
+        sorted_error_regions = sorted(region_counts.items(), key=lambda x: x[1], reverse=True)[:5]
+        # 转义地区名称
+        region_text = " ".join([f"{html.escape(r[0])}({r[1]})" for r in sorted_error_regions])
+        error_details.append(f"{html.escape(error_type)}: {region_text}")
+
+    partial_note = ""
+    if summary["partial"]:
+        partial_note = f"（提前判定，已收到 {summary['total']}/{summary['expected']} 个节点）"
+
+    operators = summary["operators"]
+    return (
+        f"<b>⚠️ 网站故障告警</b>\n"
+        f"站点: {safe_name} ({safe_url})\n"
+        f"异常占比: {summary['fail_rate']:.2%}{partial_note}\n"
+        f"{note + chr(10) if note else ''}\n"
+        f"<b>【异常详情】</b>\n"
+        f"{chr(10).join(error_details)}\n\n"
+        f"受影响运营商: 电信{operators['电信']} "
+        f"联通{operators['联通']} 移动{operators['移动']} 其他{operators['其他']}\n"
+        f"检测时间: {time.strftime('%Y-%m-%d %H:%M:%S')}"
+    )
 
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
-    payload = {
-        "chat_id": chat_id,
-        "text": message,
-        "parse_mode": "HTML",
-    }
-    try:
-        requests.post(url, data=payload, timeout=10)
-        logging.info("告警发送成功")
-    except Exception as exc:
-        logging.error("告警发送失败: %s", exc)
 
+async def run_monitor_round(sites: Optional[List[Dict[str, Any]]] = None) -> Dict[str, str]:
+    """执行一轮监控：读取配置、并发调用 17CE、判定并发送告警。
 
-def monitor_all() -> None:
-    """执行一轮监控：读取配置、调用 17CE、判定并发送告警。"""
-    logging.info("开始新一轮检测")
-    config = load_config()
+    Args:
+        sites: 本轮检测的站点，默认检测全部站点
 
-    # 安全地解析阈值
-    try:
-        threshold_raw = config.get("alert_threshold", DEFAULT_THRESHOLD)
-        threshold = float(threshold_raw)
-        if not 0 <= threshold <= 1:
-            logging.warning("告警阈值超出范围 [0,1]，使用默认值: %s", DEFAULT_THRESHOLD)
-            threshold = DEFAULT_THRESHOLD
-    except (ValueError, TypeError) as exc:
-        logging.warning("告警阈值解析失败，使用默认值 %s: %s", DEFAULT_THRESHOLD, exc)
-        threshold = DEFAULT_THRESHOLD
+    Returns:
+        {站点名称: 结论}，超过截止时间未完成的站点不在其中
+    """
+    global _budget_mode
+    logging.info("开始新一轮检测")
+    snapshot = get_config()
+    config = snapshot.data
+    threshold = snapshot.threshold
 
     alerts: List[str] = []
     api_failures: List[str] = []
+    timed_out: List[str] = []
+    # 17CE 熔断期间未能检测的站点（保留上一次状态，统一发送一条服务不可用告警）
+    provider_down: List[str] = []
+    verdicts: Dict[str, str] = {}
 
-    # 验证 sites 是否为列表
-    sites = config.get("sites", [])
-    if not isinstance(sites, list):
-        logging.error("配置中的 sites 不是列表类型: %s，降级为空列表", type(sites))
-        sites = []
+    # 定时检测与 Bot 共用事件循环，数据库读取放到线程池中
+    all_sites = await asyncio.to_thread(list_sites, snapshot)
+    if sites is None:
+        sites = all_sites
 
+    targets: List[Dict[str, Any]] = []
     for site in sites:
         name = site.get("name", "未知站点")
         url = site.get("url", "")
         if not url:
             logging.warning("站点 %s 未配置 URL，跳过", name)
             continue
+        targets.append(site)
+
+    status_store = await asyncio.to_thread(get_status_store)
+    states = await asyncio.to_thread(status_store.load_all) if status_store is not None else {}
+    # 结论写入放到线程池中（SQLite 锁等待最长 30 秒），本轮结束前等待全部写完
+    state_writes: List[asyncio.Future] = []
+
+    def save_states(rows: List[Tuple[Any, ...]]) -> None:
+        for row in rows:
+            status_store.record(*row)
 
-        results = call_17ce_api(url, config)
+    # 上次告警/API 失败的站点为告警复核，排在后台检测之前
+    degraded = [
+        site for site in targets
+        if states.get(site.get("name", ""), {}).get("verdict") in (VERDICT_ALERT, VERDICT_API_FAILED)
+    ]
+    degraded_names = {site.get("name", "") for site in degraded}
+
+    # 积分预算紧张时定时检测改用精简节点配置，超出预算时只复查异常站点
+    budget = await asyncio.to_thread(budget_status, snapshot, all_sites)
+    node_config: Optional[Dict[str, Any]] = None
+    if budget["mode"] != MODE_NORMAL:
+        node_config = get_economy_node_config()
+        if budget["mode"] == MODE_THROTTLE:
+            logging.warning("积分预算限流：本轮跳过 %d 个正常站点，仅复查 %d 个异常站点", len(targets) - len(degraded), len(degraded))
+            targets = degraded
+    if budget["mode"] != _budget_mode:
+        logging.warning("积分预算模式变更: %s → %s %s", _budget_mode, budget["mode"], budget["reason"])
+        if budget["mode"] != MODE_NORMAL:
+            action = "暂停正常站点的定时检测，仅复查异常站点" if budget["mode"] == MODE_THROTTLE else "定时检测改用精简节点配置"
+            send_alert(
+                f"<b>💳 17CE 积分预算提醒</b>\n{html.escape(budget['reason'])}\n已{action}，详情见 /budget",
+                config,
+            )
+        _budget_mode = budget["mode"]
+
+    targets.sort(key=lambda site: site.get("name", "") not in degraded_names)
+    priorities = [
+        PRIORITY_CONFIRM if site.get("name", "") in degraded_names else PRIORITY_BACKGROUND for site in targets
+    ]
+
+    # 多个站点指向同一标准化URL时只检测一次，分析结果分发给每个站点
+    groups = group_by_target(targets)
+    probe_urls = list(groups)
+    probe_priorities = [min(priorities[idx] for idx in groups[url]) for url in probe_urls]
+
+    def handle_result(probe_idx: int, results: Optional[Dict[str, Any]]) -> None:
+        """一个检测目标完成即判定（只分析一次），并更新共用该目标的每个站点的最近状态。"""
+        group = [targets[idx] for idx in groups[probe_urls[probe_idx]]]
+        names = [site.get("name", "未知站点") for site in group]
 
         # 区分 API 失败和站点异常
+        if results is None and not circuit_breaker.is_closed:
+            provider_down.extend(names)
+            return
         if results is None:
-            api_failures.append(name)
-            logging.error("站点 %s 监控数据获取失败（17CE API调用失败）", name)
-            continue
-
-        operators, regions, error_types, fail_rate = analyze_results(results, threshold)
+            summary: Optional[Dict[str, Any]] = None
+            reason = "17CE API调用失败"
+            logging.error("站点 %s 监控数据获取失败（17CE API调用失败）", "、".join(names))
+        else:
+            summary = analyze_round(results, threshold)
+            reason = summary["error"]
+            # 数据无效视为 API 失败
+            if not summary["valid"]:
+                logging.error("站点 %s API返回数据无效: %s", "、".join(names), reason)
+        if summary is None or not summary["valid"]:
+            api_failures.extend(names)
+            for name in names:
+                verdicts[name] = VERDICT_API_FAILED
+            if status_store is not None:
+                rows = [(name, site.get("url", ""), VERDICT_API_FAILED, None, None, reason) for site, name in zip(group, names)]
+                state_writes.append(asyncio.ensure_future(asyncio.to_thread(save_states, rows)))
+            return
+
+        if summary["skipped"] > 0:
+            logging.warning("站点 %s 本轮检测跳过 %d 个异常节点", "、".join(names), summary["skipped"])
+
+        if summary["should_alert"]:
+            logging.info("站点 %s 触发告警：%s", "、".join(names), summary["alert_reason"])
+            note = ""
+            if results.get("escalated"):
+                note = f"🔎 哨兵检测 {results['sentinel_failed']} 个节点异常，已扩大至 {summary['total']} 个节点复测"
+            # 同一网址的多个站点只发送一条告警
+            alerts.append(format_alert("、".join(names), group[0].get("url", ""), summary, note))
+
+        verdict = VERDICT_ALERT if summary["should_alert"] else VERDICT_NORMAL
+        for name in names:
+            verdicts[name] = verdict
+        if status_store is not None:
+            rows = [
+                (
+                    name, site.get("url", ""), verdict, summary["fail_rate"], summary["regions"], summary["alert_reason"],
+                    summary["total"], summary["expected"], summary["partial"],
+                )
+                for site, name in zip(group, names)
+            ]
+            state_writes.append(asyncio.ensure_future(asyncio.to_thread(save_states, rows)))
+
+    # 所有站点并发检测，整轮耗时取决于最慢的站点
+    # 启用 early_verdict 时，告警结论确定后即停止等待该站点的剩余节点
+    early_threshold = threshold if config.get("early_verdict", False) else None
+    round_start = time.monotonic()
+    tiered = node_config is None and bool(config.get("tiered_probe", False))
+    saved = len(targets) - len(probe_urls)
+    if saved:
+        profile = node_config or (get_sentinel_node_config() if tiered else get_node_config())
+        per_probe = node_counts.expected(profile) or estimate_node_count(profile)
+        logging.info(
+            "本轮 %d 个站点合并为 %d 个检测目标，节省 %d 次 17CE 任务（约 %d 积分）",
+            len(targets), len(probe_urls), saved, saved * per_probe,
+        )
+    probe_results = await probe_sites(
+        probe_urls,
+        config,
+        early_threshold=early_threshold,
+        on_result=handle_result,
+        node_config=node_config,
+        # 分级检测：先用哨兵节点，发现异常再扩大范围（预算降级时不扩大）
+        tiered=tiered,
+        priorities=probe_priorities,
+    )
+    lanes = probe_limiter.snapshot()["lanes"]
+    logging.info(
+        "本轮 %d 个站点检测完成，耗时 %.1fs（17CE 排队: %s）",
+        len(targets), time.monotonic() - round_start,
+        "，".join(
+            f"{LANE_NAMES[priority]} 平均 {lane['avg_wait']:.1f}s/最长 {lane['max_wait']:.1f}s"
+            for priority, lane in lanes.items() if lane["count"]
+        ) or "无",
+    )
 
-        # fail_rate为-1.0表示API返回数据无效
-        if fail_rate < 0:
-            api_failures.append(name)
-            logging.error("站点 %s API返回数据无效", name)
-            continue
+    for outcome in await asyncio.gather(*state_writes, return_exceptions=True):
+        if isinstance(outcome, Exception):
+            logging.error("写入站点最近状态失败: %s", outcome)
 
-        if operators and regions and error_types:
-            # HTML转义所有动态字段防止注入
-            safe_name = html.escape(name)
-            safe_url = html.escape(url)
-
-            # 构建异常详情文本
-            error_details = []
-            for error_type, region_counts in error_types.items():
-                # 按节点数排序，取前5个地区
-                sorted_error_regions = sorted(region_counts.items(), key=lambda x: x[1], reverse=True)[:5]
-                # 转义地区名称
-                region_text = " ".join([f"{html.escape(r[0])}({r[1]})" for r in sorted_error_regions])
-                error_details.append(f"{html.escape(error_type)}: {region_text}")
-
-            msg = (
-                f"<b>⚠️ 网站故障告警</b>\n"
-                f"站点: {safe_name} ({safe_url})\n"
-                f"异常占比: {fail_rate:.2%}\n\n"
-                f"<b>【异常详情】</b>\n"
-                f"{chr(10).join(error_details)}\n\n"
-                f"受影响运营商: 电信{operators['电信']} "
-                f"联通{operators['联通']} 移动{operators['移动']} 其他{operators['其他']}\n"
-                f"检测时间: {time.strftime('%Y-%m-%d %H:%M:%S')}"
-            )
-            alerts.append(msg)
+    # 超过截止时间的站点保留上一次的状态
+    finished = {idx for probe_idx in probe_results for idx in groups[probe_urls[probe_idx]]}
+    timed_out.extend(site.get("name", "未知站点") for idx, site in enumerate(targets) if idx not in finished)
 
     # 发送告警
     if alerts:
-        send_alert("\n\n".join(alerts), config)
+        send_alerts(alerts, config)
+
+    # 17CE 熔断状态变化时只发送一条通知，而不是逐个站点报告 API 失败
+    notice = circuit_breaker.pop_notice()
+    if notice == "open":
+        send_alert(
+            "<b>🔌 17CE 拨测服务不可用</b>\n"
+            f"连续调用失败已触发熔断，{len(provider_down)} 个站点本轮未能检测，将自动试探恢复\n"
+            f"检测时间: {time.strftime('%Y-%m-%d %H:%M:%S')}",
+            config,
+        )
+    elif notice == "recovered":
+        send_alert("<b>✅ 17CE 拨测服务已恢复</b>", config)
+    if provider_down:
+        logging.warning("17CE 熔断中，本轮 %d 个站点未能检测", len(provider_down))
 
     # 区分正常和 API 失败的情况
     if api_failures:
         logging.warning("以下站点监控数据获取失败: %s", ", ".join(api_failures))
+    if timed_out:
+        logging.warning("以下站点超过本轮截止时间未完成检测: %s", ", ".join(timed_out))
 
-    if not alerts and not api_failures:
+    if not alerts and not api_failures and not timed_out and not provider_down:
         logging.info("所有站点正常")
+    return verdicts
+
+
+def monitor_all() -> None:
+    """执行一轮监控（同步入口，供脚本调用；常驻运行时由 run_scheduler 在 Bot 的事件循环中调度）。
+
+    多次调用复用同一个事件循环，使 17CE 长连接会话可以跨轮次保持。告警只入队、不等待发送：
+    未发送完的告警在下次调用时继续发送，进程退出时统一发送完。
+    """
+    global _round_loop
+    if _round_loop is None:
+        _round_loop = asyncio.new_event_loop()
+        atexit.register(_close_round_loop)
+    _round_loop.run_until_complete(run_monitor_round())
 
 
-def check_user_permission(chat_id: int, config: Dict[str, Any]) -> bool:
+def _close_round_loop() -> None:
+    """进程退出时发送完 monitor_all 入队的告警并关闭连接。"""
+    _round_loop.run_until_complete(close_notifier())
+    _round_loop.run_until_complete(close_dispatcher())
+    _round_loop.run_until_complete(close_session())
+
+
+def check_user_permission(chat_id: int, snapshot: ConfigSnapshot) -> bool:
     """验证用户是否有权限操作 Bot。"""
-    allowed_ids = config.get("allowed_chat_ids", [])
-    if not isinstance(allowed_ids, list):
-        logging.error("配置中的 allowed_chat_ids 不是列表类型，已重置为空列表")
-        allowed_ids = []
-        config["allowed_chat_ids"] = allowed_ids
-    # 支持字符串和整数格式的 Chat ID
-    return str(chat_id) in [str(id) for id in allowed_ids]
+    return str(chat_id) in snapshot.allowed_chat_ids
 
 
 async def auto_delete_message(message: Message, delay: int = AUTO_DELETE_SECONDS) -> None:
@@ -616,13 +699,59 @@ async def auto_delete_message(message: Message, delay: int = AUTO_DELETE_SECONDS
         logging.debug(f"消息自动删除失败: {exc}")
 
 
+class ProgressMessage:
+    """节流编辑的进度消息：最多每 PROGRESS_EDIT_INTERVAL 秒编辑一次，只发送最新内容。
+
+    Telegram 返回 RetryAfter 时按其要求推迟下一次编辑。
+    """
+
+    def __init__(self, message: Message, interval: float = PROGRESS_EDIT_INTERVAL) -> None:
+        self.message = message
+        self.interval = interval
+        self._text = ""
+        self._sent = ""
+        self._next_edit = time.monotonic() + interval
+        self._task: Optional[asyncio.Task] = None
+
+    def update(self, text: str) -> None:
+        """更新进度内容，到达编辑间隔后发送。"""
+        self._text = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        while self._text != self._sent:
+            delay = self._next_edit - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            text = self._text
+            self._next_edit = time.monotonic() + self.interval
+            try:
+                await self.message.edit_text(text, parse_mode="HTML")
+            except Exception as exc:
+                retry_after = getattr(exc, "retry_after", None)
+                if retry_after is None:
+                    logging.warning("更新进度消息失败: %s", exc)
+                    return
+                retry_seconds = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+                self._next_edit = time.monotonic() + retry_seconds
+                continue
+            self._sent = text
+
+    async def close(self) -> None:
+        """停止尚未发送的编辑。"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
 async def cmd_add(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Telegram /add 命令，添加监控站点（自动从URL提取域名作为名称）。"""
-    config = load_config()
+    snapshot = get_config()
     chat_id = update.effective_chat.id
 
     # 验证用户权限
-    if not check_user_permission(chat_id, config):
+    if not check_user_permission(chat_id, snapshot):
         reply = await update.message.reply_text("❌ 无权限操作此 Bot")
         asyncio.create_task(auto_delete_message(reply))
         logging.warning(f"未授权用户尝试操作 Bot: {chat_id}")
@@ -638,18 +767,9 @@ async def cmd_add(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
 
     url = " ".join(context.args)
-    # 从URL提取域名作为名称
-    domain = extract_domain_from_url(url)
-    # 生成唯一名称（如果重复则自动编号）
-    sites = config.get("sites", [])
-    if not isinstance(sites, list):
-        logging.error("配置中的 sites 不是列表类型，已重置为空列表")
-        sites = []
-    config["sites"] = sites
-    name = generate_unique_name(domain, sites)
-
-    config.setdefault("sites", []).append({"name": name, "url": url})
-    save_config(config)
+    # 从URL提取域名作为名称，重名时自动编号
+    added = await asyncio.to_thread(add_sites, [url])
+    name = added[0]["name"]
     reply = await update.message.reply_text(f"✅ 添加成功\n📌 {name} → {url}")
     asyncio.create_task(auto_delete_message(reply))
     logging.info(f"添加站点: {name} → {url}")
@@ -657,11 +777,11 @@ async def cmd_add(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def cmd_delete(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Telegram /delete 命令，删除监控站点（支持URL、域名或名称匹配）。"""
-    config = load_config()
+    snapshot = get_config()
     chat_id = update.effective_chat.id
 
     # 验证用户权限
-    if not check_user_permission(chat_id, config):
+    if not check_user_permission(chat_id, snapshot):
         reply = await update.message.reply_text("❌ 无权限操作此 Bot")
         asyncio.create_task(auto_delete_message(reply))
         logging.warning(f"未授权用户尝试操作 Bot: {chat_id}")
@@ -679,29 +799,16 @@ async def cmd_delete(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         return
 
     url_or_domain = " ".join(context.args)
-    sites = config.get("sites", [])
-    if not isinstance(sites, list):
-        logging.error("配置中的 sites 不是列表类型，已重置为空列表")
-        sites = []
-    config["sites"] = sites
-
-    # 查找匹配的站点
-    deleted_sites = []
-    new_sites = []
-    for site in sites:
-        if match_site_by_url(url_or_domain, site):
-            deleted_sites.append(f"{site.get('name', '')} → {site.get('url', '')}")
-        else:
-            new_sites.append(site)
+
+    # 查找并删除匹配的站点
+    deleted = await asyncio.to_thread(delete_sites, [url_or_domain])
+    deleted_sites = [f"{site['name']} → {site['url']}" for site in deleted]
 
     if not deleted_sites:
         reply = await update.message.reply_text(f"❌ 未找到匹配 '{url_or_domain}' 的站点")
         asyncio.create_task(auto_delete_message(reply))
         return
 
-    config["sites"] = new_sites
-    save_config(config)
-
     # 显示删除结果
     if len(deleted_sites) == 1:
         reply = await update.message.reply_text(f"🗑️ 删除成功\n📌 {deleted_sites[0]}")
@@ -715,21 +822,17 @@ async def cmd_delete(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
 
 async def cmd_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Telegram /list 命令，列出当前监控站点。"""
-    config = load_config()
+    snapshot = get_config()
     chat_id = update.effective_chat.id
 
     # 验证用户权限
-    if not check_user_permission(chat_id, config):
+    if not check_user_permission(chat_id, snapshot):
         reply = await update.message.reply_text("❌ 无权限操作此 Bot")
         asyncio.create_task(auto_delete_message(reply))
         logging.warning(f"未授权用户尝试操作 Bot: {chat_id}")
         return
 
-    sites = config.get("sites", [])
-    if not isinstance(sites, list):
-        logging.error("配置中的 sites 不是列表类型，已重置为空列表")
-        sites = []
-    config["sites"] = sites
+    sites = await asyncio.to_thread(list_sites, snapshot)
     if not sites:
         reply = await update.message.reply_text("📋 当前无监控站点")
         asyncio.create_task(auto_delete_message(reply))
@@ -755,11 +858,11 @@ async def cmd_addmany(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     https://www.backup.com
     https://www.cdn.com
     """
-    config = load_config()
+    snapshot = get_config()
     chat_id = update.effective_chat.id
 
     # 验证用户权限
-    if not check_user_permission(chat_id, config):
+    if not check_user_permission(chat_id, snapshot):
         reply = await update.message.reply_text("❌ 无权限操作此 Bot")
         asyncio.create_task(auto_delete_message(reply))
         logging.warning(f"未授权用户尝试操作 Bot: {chat_id}")
@@ -798,29 +901,17 @@ async def cmd_addmany(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         asyncio.create_task(auto_delete_message(reply))
         return
 
-    # 批量添加站点
-    sites = config.get("sites", [])
-    if not isinstance(sites, list):
-        logging.error("配置中的 sites 不是列表类型，已重置为空列表")
-        sites = []
-    config["sites"] = sites
-    added_sites = []
-
-    for url in urls:
-        if not url:
-            continue
-
-        # 从URL提取域名作为名称
-        domain = extract_domain_from_url(url)
-        # 生成唯一名称（如果重复则自动编号）
-        name = generate_unique_name(domain, sites)
-
-        # 添加到配置
-        sites.append({"name": name, "url": url})
-        added_sites.append(f"• {name} → {url}")
-
-    config["sites"] = sites
-    save_config(config)
+    reason = command_governor.try_acquire(chat_id, "/addmany", snapshot.data)
+    if reason is not None:
+        reply = await update.message.reply_text(reason)
+        asyncio.create_task(auto_delete_message(reply))
+        return
+    # 批量添加站点（自动从URL提取域名作为名称）
+    try:
+        added = await asyncio.to_thread(add_sites, urls)
+    finally:
+        command_governor.release(chat_id)
+    added_sites = [f"• {site['name']} → {site['url']}" for site in added]
 
     # 发送成功消息
     success_msg = "✅ 批量添加成功！\n\n" + "\n".join(added_sites) + f"\n\n📊 共添加 {len(added_sites)} 个站点"
@@ -844,11 +935,11 @@ async def cmd_deletemany(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     backup.com
     cdn.com-2
     """
-    config = load_config()
+    snapshot = get_config()
     chat_id = update.effective_chat.id
 
     # 验证用户权限
-    if not check_user_permission(chat_id, config):
+    if not check_user_permission(chat_id, snapshot):
         reply = await update.message.reply_text("❌ 无权限操作此 Bot")
         asyncio.create_task(auto_delete_message(reply))
         logging.warning(f"未授权用户尝试操作 Bot: {chat_id}")
@@ -887,35 +978,23 @@ async def cmd_deletemany(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         asyncio.create_task(auto_delete_message(reply))
         return
 
-    sites = config.get("sites", [])
-    if not isinstance(sites, list):
-        logging.error("配置中的 sites 不是列表类型，已重置为空列表")
-        sites = []
-    config["sites"] = sites
-    deleted_sites = []
-    new_sites = []
-
-    # 遍历所有站点，匹配要删除的项
-    for site in sites:
-        should_delete = False
-        for item in delete_list:
-            if match_site_by_url(item, site):
-                should_delete = True
-                break
-
-        if should_delete:
-            deleted_sites.append(f"• {site.get('name', '')} → {site.get('url', '')}")
-        else:
-            new_sites.append(site)
+    reason = command_governor.try_acquire(chat_id, "/deletemany", snapshot.data)
+    if reason is not None:
+        reply = await update.message.reply_text(reason)
+        asyncio.create_task(auto_delete_message(reply))
+        return
+    # 删除与任一输入匹配的站点
+    try:
+        deleted = await asyncio.to_thread(delete_sites, delete_list)
+    finally:
+        command_governor.release(chat_id)
+    deleted_sites = [f"• {site['name']} → {site['url']}" for site in deleted]
 
     if not deleted_sites:
         reply = await update.message.reply_text(f"❌ 未找到匹配的站点")
         asyncio.create_task(auto_delete_message(reply))
         return
 
-    config["sites"] = new_sites
-    save_config(config)
-
     # 发送成功消息
     success_msg = "🗑️ 批量删除成功！\n\n" + "\n".join(deleted_sites) + f"\n\n📊 共删除 {len(deleted_sites)} 个站点"
     reply = await update.message.reply_text(success_msg)
@@ -923,60 +1002,39 @@ async def cmd_deletemany(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     logging.info(f"批量删除 {len(deleted_sites)} 个站点")
 
 
-async def cmd_check(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Telegram /check 命令，检测所有站点并返回详细报告。"""
-    config = load_config()
-    chat_id = update.effective_chat.id
-
-    # 验证用户权限
-    if not check_user_permission(chat_id, config):
-        reply = await update.message.reply_text("❌ 无权限操作此 Bot")
-        asyncio.create_task(auto_delete_message(reply))
-        logging.warning(f"未授权用户尝试操作 Bot: {chat_id}")
-        return
-
-    sites = config.get("sites", [])
-    if not isinstance(sites, list):
-        logging.error("配置中的 sites 不是列表类型，已重置为空列表")
-        sites = []
-    config["sites"] = sites
+async def run_check(update: Update, snapshot: ConfigSnapshot) -> str:
+    """检测所有站点并生成 /check 报告文本（进度消息发送在发起命令的聊天中）。"""
+    sites = await asyncio.to_thread(list_sites, snapshot)
     if not sites:
-        reply = await update.message.reply_text("📋 当前无监控站点，请先使用 /add 添加站点")
-        asyncio.create_task(auto_delete_message(reply))
-        return
+        return "📋 当前无监控站点，请先使用 /add 添加站点"
 
     # 发送进度提示
     progress_msg = await update.message.reply_text(
         f"🔍 检测中，请稍候...\n📊 正在检测 {len(sites)} 个站点"
     )
 
-    # 收集检测结果
-    results = []
+    # 收集检测结果（按站点下标，每个站点完成即写入）
+    results_by_idx: Dict[int, Dict[str, Any]] = {}
     normal_count = 0
     warning_count = 0
     error_count = 0
     api_failure_count = 0
-    start_time = time.time()
-
-    for idx, site in enumerate(sites, 1):
-        # 超时保护：检测总时长不超过3分钟
-        elapsed = time.time() - start_time
-        if elapsed > 180:  # 3分钟
-            await progress_msg.edit_text(
-                f"⏱️ 检测超时（已检测 {idx-1}/{len(sites)} 个站点）\n"
-                f"已检测站点结果将在下方显示"
-            )
-            break
+    cached_count = 0
+    oldest_age = 0.0
 
-        name = site.get("name", "未知")
-        url = site.get("url", "")
-        if not url:
-            continue
+    targets = [site for site in sites if site.get("url", "")]
+    progress = ProgressMessage(progress_msg)
+    check_start = time.time()
 
-        # 使用 asyncio.to_thread 避免阻塞事件循环
-        api_result = await asyncio.to_thread(call_17ce_api, url, config)
+    def handle_result(idx: int, api_result: Optional[Dict[str, Any]]) -> None:
+        """单个站点完成即统计，并节流刷新进度消息。"""
+        nonlocal normal_count, warning_count, error_count, api_failure_count, cached_count, oldest_age
+        site = targets[idx]
         fail_rate, regions, status = analyze_results_detailed(api_result)
         api_failed = fail_rate < 0
+        if api_result is not None and api_result["finished_at"] < check_start:
+            cached_count += 1
+            oldest_age = max(oldest_age, check_start - api_result["finished_at"])
 
         # 分类统计
         if api_failed:
@@ -992,16 +1050,49 @@ async def cmd_check(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         region_text = ""
         if regions:
             sorted_regions = sorted(regions.items(), key=lambda x: x[1], reverse=True)[:3]
-            region_text = " | " + " ".join([f"{r[0]}({r[1]})" for r in sorted_regions])
+            region_text = " | " + " ".join([f"{html.escape(r[0])}({r[1]})" for r in sorted_regions])
 
-        results.append({
-            "name": name,
-            "url": url,
+        results_by_idx[idx] = {
+            "name": site.get("name", "未知"),
+            "url": site.get("url", ""),
             "fail_rate": fail_rate,
             "status": status,
             "region_text": region_text,
             "api_failed": api_failed
-        })
+        }
+
+        # 进度消息：计数与目前发现的异常站点
+        progress_lines = [
+            f"🔍 检测中 {len(results_by_idx)}/{len(targets)}",
+            f"✅ 正常: {normal_count} | ⚠️ 警告: {warning_count} | ❌ 异常: {error_count} | 🚫 API失败: {api_failure_count}",
+        ]
+        abnormal = [r for _, r in sorted(results_by_idx.items()) if r["fail_rate"] >= 0.10 or r["api_failed"]]
+        if abnormal:
+            progress_lines.append("\n<b>已发现：</b>")
+            for r in abnormal[:PROGRESS_MAX_ABNORMAL]:
+                fail_rate_text = "API失败" if r["api_failed"] else f"{r['fail_rate']:.1%}"
+                progress_lines.append(f"{r['status']} <b>{html.escape(r['name'])}</b> {fail_rate_text}{r['region_text']}")
+            if len(abnormal) > PROGRESS_MAX_ABNORMAL:
+                progress_lines.append(f"…另有 {len(abnormal) - PROGRESS_MAX_ABNORMAL} 个")
+        progress.update("\n".join(progress_lines))
+
+    # 所有站点并发检测，完成一个即更新进度；连续 CHECK_DEADLINE_SECONDS 秒没有站点完成时结束，
+    # 整体不超过 round_deadline_seconds。有效期内已有检测结果（定时任务或其他命令）的站点直接复用
+    probe_results = await probe_sites(
+        [normalize_url(site["url"]) for site in targets],
+        snapshot.data,
+        max_age=result_cache_ttl(snapshot.data),
+        on_result=handle_result,
+        priority=PRIORITY_INTERACTIVE,
+        idle_timeout=CHECK_DEADLINE_SECONDS,
+    )
+    await progress.close()
+    if len(probe_results) < len(targets):
+        await progress_msg.edit_text(
+            f"⏱️ 检测超时（已检测 {len(probe_results)}/{len(targets)} 个站点）\n"
+            f"已检测站点结果将在下方显示"
+        )
+    results = [results_by_idx[idx] for idx in sorted(results_by_idx)]
 
     # 删除进度消息
     try:
@@ -1044,19 +1135,64 @@ async def cmd_check(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             report_lines.append("✅ 所有站点运行正常")
 
     report_lines.append(f"\n📊 总计: {total_checked} 个站点")
+    if api_failure_count and not circuit_breaker.is_closed:
+        report_lines.append("🔌 17CE 服务暂不可用（熔断保护中），请稍后再试")
+    if cached_count:
+        report_lines.append(f"♻️ 其中 {cached_count} 个站点复用 {format_age(oldest_age)}内的检测结果")
 
-    reply = await update.message.reply_text("\n".join(report_lines), parse_mode="HTML")
-    asyncio.create_task(auto_delete_message(reply))
     logging.info(f"执行 /check 命令，检测 {total_checked} 个站点")
+    return "\n".join(report_lines)
+
+
+async def cmd_check(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Telegram /check 命令，检测所有站点并返回详细报告。
+
+    已有 /check 在进行时不再重新检测，等待其完成后在本聊天发送同一份报告。
+    """
+    snapshot = get_config()
+    chat_id = update.effective_chat.id
+
+    # 验证用户权限
+    if not check_user_permission(chat_id, snapshot):
+        reply = await update.message.reply_text("❌ 无权限操作此 Bot")
+        asyncio.create_task(auto_delete_message(reply))
+        logging.warning(f"未授权用户尝试操作 Bot: {chat_id}")
+        return
+
+    running = command_governor.running("check")
+    if running is not None:
+        logging.info("聊天 %s 的 /check 加入进行中的检测", chat_id)
+        waiting_msg = await update.message.reply_text("⏳ 已有 /check 正在进行，完成后在此发送同一份报告")
+        try:
+            # shield 防止本请求被取消时连带取消共享的检测
+            report = await asyncio.shield(running)
+        finally:
+            try:
+                await waiting_msg.delete()
+            except Exception:
+                pass
+    else:
+        reason = command_governor.try_acquire(chat_id, "/check", snapshot.data)
+        if reason is not None:
+            reply = await update.message.reply_text(reason)
+            asyncio.create_task(auto_delete_message(reply))
+            return
+        try:
+            report = await asyncio.shield(command_governor.run_shared("check", run_check(update, snapshot)))
+        finally:
+            command_governor.release(chat_id)
+
+    reply = await update.message.reply_text(report, parse_mode="HTML")
+    asyncio.create_task(auto_delete_message(reply))
 
 
 async def cmd_checkone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Telegram /checkone 命令，检测单个站点。"""
-    config = load_config()
+    snapshot = get_config()
     chat_id = update.effective_chat.id
 
     # 验证用户权限
-    if not check_user_permission(chat_id, config):
+    if not check_user_permission(chat_id, snapshot):
         reply = await update.message.reply_text("❌ 无权限操作此 Bot")
         asyncio.create_task(auto_delete_message(reply))
         logging.warning(f"未授权用户尝试操作 Bot: {chat_id}")
@@ -1072,11 +1208,28 @@ async def cmd_checkone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
     url = " ".join(context.args)
 
+    reason = command_governor.try_acquire(chat_id, "/checkone", snapshot.data)
+    if reason is not None:
+        reply = await update.message.reply_text(reason)
+        asyncio.create_task(auto_delete_message(reply))
+        return
+    try:
+        await checkone_report(update, snapshot, url)
+    finally:
+        command_governor.release(chat_id)
+
+
+async def checkone_report(update: Update, snapshot: ConfigSnapshot, url: str) -> None:
+    """检测单个站点并回复 /checkone 报告。"""
     # 发送进度提示
     progress_msg = await update.message.reply_text(f"🔍 正在检测 {url}...")
 
-    # 使用 asyncio.to_thread 避免阻塞事件循环
-    api_result = await asyncio.to_thread(call_17ce_api, url, config)
+    # 同一站点正在检测时共享结果，有效期内的结果直接复用
+    check_start = time.time()
+    # 交互优先级：插队到定时检测之前，并提升共享的进行中任务
+    api_result = await probe_site(
+        normalize_url(url), snapshot.data, max_age=result_cache_ttl(snapshot.data), priority=PRIORITY_INTERACTIVE
+    )
     fail_rate, regions, status = analyze_results_detailed(api_result)
     api_failed = fail_rate < 0
 
@@ -1094,9 +1247,13 @@ async def cmd_checkone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         f"📊 失败率: {'API失败' if api_failed else f'{fail_rate:.2%}'}",
         f"🏷️ 状态: {status}\n"
     ]
+    if api_result is not None and api_result["finished_at"] < check_start:
+        report_lines.insert(2, f"♻️ 结果来自 {format_age(check_start - api_result['finished_at'])}前的检测")
 
     # 添加地区详情
-    if api_failed:
+    if api_failed and not circuit_breaker.is_closed:
+        report_lines.append("🔌 17CE 服务暂不可用（熔断保护中），请稍后再试")
+    elif api_failed:
         report_lines.append("🚫 API调用失败，未获取到地区数据")
     elif regions:
         sorted_regions = sorted(regions.items(), key=lambda x: x[1], reverse=True)[:10]
@@ -1111,13 +1268,170 @@ async def cmd_checkone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     logging.info(f"执行 /checkone 命令，检测 {url}")
 
 
+async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Telegram /status 命令，显示定时检测记录的各站点最近状态（不调用 17CE）。"""
+    snapshot = get_config()
+    chat_id = update.effective_chat.id
+
+    # 验证用户权限
+    if not check_user_permission(chat_id, snapshot):
+        reply = await update.message.reply_text("❌ 无权限操作此 Bot")
+        asyncio.create_task(auto_delete_message(reply))
+        logging.warning(f"未授权用户尝试操作 Bot: {chat_id}")
+        return
+
+    sites = await asyncio.to_thread(list_sites, snapshot)
+    if not sites:
+        reply = await update.message.reply_text("📋 当前无监控站点，请先使用 /add 添加站点")
+        asyncio.create_task(auto_delete_message(reply))
+        return
+
+    status_store = await asyncio.to_thread(get_status_store)
+    states = await asyncio.to_thread(status_store.load_all) if status_store is not None else {}
+
+    now = time.time()
+    counts = {VERDICT_NORMAL: 0, VERDICT_ALERT: 0, VERDICT_API_FAILED: 0, None: 0}
+    lines: List[Tuple[str, str]] = []
+    for site in sites:
+        name = site.get("name", "未知")
+        state = states.get(name)
+        verdict = state["verdict"] if state else None
+        counts[verdict if verdict in counts else None] += 1
+
+        if state is None:
+            icon, detail = "❔", "暂无检测记录"
+        elif verdict == VERDICT_API_FAILED:
+            icon, detail = "🚫", f"API失败 · {format_age(now - state['checked_at'])}前"
+        else:
+            icon = "❌" if verdict == VERDICT_ALERT else "✅"
+            region_text = ""
+            if state["top_regions"]:
+                region_text = " | " + " ".join(f"{html.escape(r)}({c})" for r, c in state["top_regions"])
+            # 提前判定的失败率只覆盖已收到的节点，标明节点数
+            partial_text = f"（提前判定 {state['nodes']}/{state['expected']} 节点）" if state["partial"] else ""
+            detail = f"失败率 {state['fail_rate']:.1%}{partial_text}{region_text} · {format_age(now - state['checked_at'])}前"
+        lines.append((verdict or "", f"{icon} <b>{html.escape(name)}</b> {detail}"))
+
+    report_lines = [
+        f"📡 <b>站点状态</b>（共 {len(sites)} 个站点）",
+        f"✅ 正常: {counts[VERDICT_NORMAL]} | ❌ 告警: {counts[VERDICT_ALERT]} | "
+        f"🚫 API失败: {counts[VERDICT_API_FAILED]} | ❔ 暂无记录: {counts[None]}\n",
+    ]
+    # 站点较多时只列出需要关注的站点
+    if len(sites) <= 6:
+        report_lines.extend(line for _, line in lines)
+    else:
+        abnormal = [line for verdict, line in lines if verdict in (VERDICT_ALERT, VERDICT_API_FAILED)]
+        report_lines.extend(abnormal or ["✅ 所有已检测站点运行正常"])
+
+    limiter = probe_limiter.snapshot()
+    report_lines.append(
+        f"\n🚦 17CE 任务: 进行中 {limiter['inflight']}/{limiter['max_inflight']} · 排队 {limiter['queued']} · "
+        f"平均等待 {limiter['avg_wait']:.1f}s · 速率 {limiter['rate_per_minute']:.0f}/分钟"
+    )
+    for priority, lane in limiter["lanes"].items():
+        if lane["count"] or lane["queued"]:
+            report_lines.append(
+                f"  · {LANE_NAMES[priority]}: 排队 {lane['queued']} · 平均等待 {lane['avg_wait']:.1f}s · "
+                f"最长 {lane['max_wait']:.1f}s"
+            )
+    if limiter["throttled"]:
+        report_lines.append(f"⚠️ 17CE 已限流 {limiter['throttled']} 次，提交速率自动降低")
+
+    sinks = [sink for sink in get_notifier().snapshot() if sink["delivered"] or sink["pending"] or sink["dead"]]
+    if sinks:
+        report_lines.append("\n📨 告警通知:")
+        for sink in sinks:
+            line = f"  · {html.escape(sink['name'])}: 送达 {sink['delivered']} · 排队 {sink['pending']}"
+            if sink["retrying"]:
+                line += f" · 等待重试 {sink['retrying']} 批"
+            if sink["dead"]:
+                line += f" · 死信 {sink['dead']}"
+            report_lines.append(line)
+    delivery = delivery_stats.snapshot()
+    if delivery["rate_limited"]:
+        report_lines.append(
+            f"⚠️ Telegram 限流 {delivery['rate_limited']} 次，平均发送耗时 {delivery['avg_latency']:.1f}s"
+        )
+
+    reply = await update.message.reply_text("\n".join(report_lines), parse_mode="HTML")
+    asyncio.create_task(auto_delete_message(reply))
+    logging.info(f"执行 /status 命令，显示 {len(sites)} 个站点状态")
+
+
+async def cmd_budget(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Telegram /budget 命令，显示 17CE 积分消耗、余额预测与当前限流状态。"""
+    snapshot = get_config()
+    chat_id = update.effective_chat.id
+
+    # 验证用户权限
+    if not check_user_permission(chat_id, snapshot):
+        reply = await update.message.reply_text("❌ 无权限操作此 Bot")
+        asyncio.create_task(auto_delete_message(reply))
+        logging.warning(f"未授权用户尝试操作 Bot: {chat_id}")
+        return
+
+    def collect() -> Tuple[Dict[str, Any], List[Tuple[str, int]], List[Tuple[str, int]], List[Dict[str, Any]]]:
+        sites = list_sites(snapshot)
+        ledger = get_ledger(snapshot.data)
+        since = days_ago(MEASURE_DAYS - 1)
+        daily = ledger.daily_totals(since) if ledger is not None else []
+        top = ledger.top_urls(since) if ledger is not None else []
+        return budget_status(snapshot, sites), daily, top, sites
+
+    budget, daily, top, sites = await asyncio.to_thread(collect)
+
+    mode_text = {
+        MODE_NORMAL: "✅ 正常",
+        MODE_THROTTLE: "⛔ 限流（仅复查异常站点）",
+    }.get(budget["mode"], "⚠️ 精简节点配置")
+    daily_limit = budget["daily_credits"]
+    report_lines = [
+        "💳 <b>17CE 积分预算</b>",
+        f"⏰ {time.strftime('%Y-%m-%d %H:%M:%S')}\n",
+        f"📊 今日消耗: {budget['today']}" + (f" / {daily_limit}" if daily_limit else ""),
+        f"📈 近{MEASURE_DAYS}天日均: {budget['measured_daily']:.0f} | 按当前调度预计: {budget['planned_daily']:.0f}/天",
+    ]
+    if budget["remaining"] is not None:
+        report_lines.append(f"💰 估算余额: {budget['remaining']}")
+        if budget["days_left"] is not None:
+            report_lines.append(f"⏳ 预计可用 {budget['days_left']:.0f} 天（约 {budget['exhaust_date']} 耗尽）")
+    else:
+        report_lines.append("💰 未配置 budget.balance，无法预测余额耗尽时间")
+    report_lines.append(f"🚦 定时检测: {mode_text}")
+    if budget["reason"]:
+        report_lines.append(f"   原因: {html.escape(budget['reason'])}")
+    site_count, target_count, saved_daily = duplicate_savings(sites, snapshot.data)
+    if target_count < site_count:
+        report_lines.append(
+            f"♻️ 重复网址合并: {site_count} 个站点共 {target_count} 个检测目标，每天约节省 {saved_daily:.0f} 积分"
+        )
+
+    if daily:
+        report_lines.append("\n<b>每日消耗：</b>")
+        report_lines.extend(f"• {day}: {credits}" for day, credits in daily)
+    if top:
+        # 按网址汇总，显示对应的站点名称
+        names: Dict[str, List[str]] = {}
+        for site in sites:
+            names.setdefault(normalize_url(site.get("url", "")), []).append(site.get("name", ""))
+        report_lines.append(f"\n<b>近{MEASURE_DAYS}天消耗最多：</b>")
+        for url, credits in top:
+            label = ", ".join(names.get(url, [])) or url
+            report_lines.append(f"• {html.escape(label)}: {credits}")
+
+    reply = await update.message.reply_text("\n".join(report_lines), parse_mode="HTML")
+    asyncio.create_task(auto_delete_message(reply))
+    logging.info("执行 /budget 命令")
+
+
 async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Telegram /help 命令，显示帮助信息和所有可用命令。"""
-    config = load_config()
+    snapshot = get_config()
     chat_id = update.effective_chat.id
 
     # 验证用户权限
-    if not check_user_permission(chat_id, config):
+    if not check_user_permission(chat_id, snapshot):
         reply = await update.message.reply_text("❌ 无权限操作此 Bot")
         asyncio.create_task(auto_delete_message(reply))
         logging.warning(f"未授权用户尝试操作 Bot: {chat_id}")
@@ -1173,6 +1487,14 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "  检测所有站点并返回详细报告\n"
         "  ✅ 正常 (&lt;10%) | ⚠️ 警告 (10-20%) | ❌ 异常 (&gt;20%)\n\n"
 
+        "📡 <b>最近状态</b>\n"
+        "• /status\n"
+        "  查看定时检测记录的各站点最近状态（即时返回）\n\n"
+
+        "💳 <b>积分预算</b>\n"
+        "• /budget\n"
+        "  查看 17CE 积分消耗、余额预测与限流状态\n\n"
+
         "🎯 <b>单站点检测</b>\n"
         "• /checkone &#60;网址&#62;\n"
         "  检测单个站点的详细状态\n"
@@ -1186,9 +1508,10 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "• 全国失败率 > 20%\n"
         "• 任意单地区失败节点 ≥ 3 个\n\n"
 
-        "🔍 <b>检测频率</b>：\n"
-        "• 工作日: 9:00-11:00, 13:00-17:00 每小时检测\n"
-        "• 周末: 每天10:00检测一次\n\n"
+        "🔍 <b>检测频率</b>（默认，可在配置 schedule 中调整）：\n"
+        "• 工作日: 9:00-11:59, 13:00-17:59 每个站点每小时检测，各站点错开\n"
+        "• 周末: 10:00-10:59 每个站点检测一次\n"
+        "• 异常站点: 每10分钟复查，恢复后回到正常频率\n\n"
 
         "📊 <b>监控节点</b>：全国33个主要城市，66个节点（IDC+路由器，覆盖电信/联通/移动）"
     )
@@ -1203,6 +1526,8 @@ async def setup_bot_commands(app: Application) -> None:
         BotCommand("help", "💡 使用帮助"),
         BotCommand("check", "🔍 检测所有站点"),
         BotCommand("checkone", "🎯 检测单个站点"),
+        BotCommand("status", "📡 最近状态"),
+        BotCommand("budget", "💳 积分预算"),
         BotCommand("list", "📊 站点列表"),
         BotCommand("add", "➕ 添加站点"),
         BotCommand("addmany", "📦 批量添加"),
@@ -1223,91 +1548,144 @@ def start_bot(config: Dict[str, Any]) -> Optional[Application]:
         logging.error("未配置 Telegram Bot Token，Bot 不会启动")
         return None
 
-    app = Application.builder().token(token).build()
+    # 命令并发处理，/check 等高开销命令由 command_governor 限制并发数
+    app = Application.builder().token(token).concurrent_updates(True).build()
     app.add_handler(CommandHandler("help", cmd_help))
     app.add_handler(CommandHandler("check", cmd_check))
     app.add_handler(CommandHandler("checkone", cmd_checkone))
+    app.add_handler(CommandHandler("status", cmd_status))
+    app.add_handler(CommandHandler("budget", cmd_budget))
     app.add_handler(CommandHandler("list", cmd_list))
     app.add_handler(CommandHandler("add", cmd_add))
     app.add_handler(CommandHandler("delete", cmd_delete))
     app.add_handler(CommandHandler("addmany", cmd_addmany))
     app.add_handler(CommandHandler("deletemany", cmd_deletemany))
 
-    # 设置启动后的命令菜单初始化
-    app.post_init = setup_bot_commands
+    # 启动后设置命令菜单并在同一事件循环中启动定时检测，停止时先停定时检测
+    app.post_init = on_bot_start
+    app.post_stop = on_bot_stop
 
     logging.info("Telegram Bot 已配置，准备在主线程运行")
     return app
 
 
-def run_scheduler() -> None:
-    """在子线程中运行定时任务调度器。
+async def on_bot_start(app: Application) -> None:
+    """Bot 启动后：设置命令菜单，并在 Bot 的事件循环中启动定时检测任务。"""
+    global _scheduler_task
+    await setup_bot_commands(app)
+    _scheduler_task = asyncio.create_task(run_scheduler())
+
+
+async def on_bot_stop(app: Application) -> None:
+    """Bot 停止时取消定时检测任务并等待其清理完成。"""
+    global _scheduler_task
+    if _scheduler_task is not None:
+        _scheduler_task.cancel()
+        await asyncio.gather(_scheduler_task, return_exceptions=True)
+        _scheduler_task = None
+
+
+async def run_scheduler() -> None:
+    """按站点自适应的定时检测调度器，作为任务运行在 Bot 的事件循环中。
 
-    检测策略:
-    - 工作日(周一至周五): 早上9-11点每小时一次，下午13-17点每小时一次
-    - 周末(周六、周日): 每天10:00检测一次
+    检测策略（配置 schedule，见 scheduler.ScheduleConfig）:
+    - 启动时立即检测全部站点一次
+    - 之后每个站点按各自间隔（默认 60 分钟）在检测时段内错开检测
+    - 站点告警或 API 失败期间缩短为异常间隔（默认 10 分钟），恢复后回到正常间隔；
+      重启时按站点状态表中的上次结论恢复异常间隔
+
+    定时检测与 Bot 命令共用同一个 17CE 会话与限流器；任务被取消时中止进行中的检测并关闭会话。
     """
     logging.info("定时监控任务已启动")
 
-    # 工作日检测时间点
-    weekday_times = [
-        "09:00", "10:00", "11:00",  # 早上9-11点
-        "13:00", "14:00", "15:00", "16:00", "17:00"  # 下午13-17点
-    ]
+    def load() -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        snapshot = get_config()
+        return list_sites(snapshot), snapshot.data
 
-    # 配置工作日检测任务 (周一到周五)
-    for check_time in weekday_times:
-        schedule.every().monday.at(check_time).do(monitor_all)
-        schedule.every().tuesday.at(check_time).do(monitor_all)
-        schedule.every().wednesday.at(check_time).do(monitor_all)
-        schedule.every().thursday.at(check_time).do(monitor_all)
-        schedule.every().friday.at(check_time).do(monitor_all)
+    def load_states() -> Dict[str, Dict[str, Any]]:
+        store = get_status_store()
+        return store.load_all() if store is not None else {}
 
-    # 配置周末检测任务 (周六、周日各一次)
-    schedule.every().saturday.at("10:00").do(monitor_all)
-    schedule.every().sunday.at("10:00").do(monitor_all)
+    scheduler = SiteScheduler(run_monitor_round, load, load_states)
+    try:
+        await scheduler.run()
+    finally:
+        await close_session()
+        # 先发送完已入队的告警，再关闭 Telegram 连接池
+        await close_notifier()
+        await close_dispatcher()
+        logging.info("定时监控任务已停止")
 
-    logging.info("✅ 定时任务配置完成:")
-    logging.info("   📅 工作日: 9:00-11:00, 13:00-17:00 每小时检测")
-    logging.info("   📅 周末: 每天10:00检测一次")
 
-    # 立即执行一次，捕获异常避免调度停止
-    try:
-        monitor_all()
-    except Exception as exc:
-        logging.error("首次监控执行失败: %s", exc, exc_info=True)
+async def run_scheduler_only() -> None:
+    """未配置 Bot 时只运行定时检测，收到 SIGINT/SIGTERM 时取消任务并清理退出。"""
+    task = asyncio.create_task(run_scheduler())
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, task.cancel)
+    await asyncio.gather(task, return_exceptions=True)
+
 
-    while True:
+async def run_bot_webhook(app: Application, settings: WebhookSettings) -> None:
+    """以 Webhook 方式运行 Bot（与定时检测同一事件循环），Webhook 启动失败时退回长轮询。
+
+    Telegram 把更新 POST 到 settings.url（反向代理到本地 listen:port），
+    校验 secret token 后放入更新队列并发处理。收到 SIGINT/SIGTERM 时依次停止接收、定时检测与 Bot。
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with app:
+        # 手动管理生命周期时 Application 不会调用 post_init/post_stop
+        await on_bot_start(app)
+        server: Optional[WebhookServer] = WebhookServer(app, settings)
         try:
-            schedule.run_pending()
-            time.sleep(1)
+            await server.start()
+            await app.bot.set_webhook(
+                settings.url, allowed_updates=Update.ALL_TYPES, secret_token=settings.secret_token
+            )
+            logging.info("Telegram Webhook 已设置: %s", settings.url)
         except Exception as exc:
-            # 捕获异常但继续运行，避免调度停止
-            logging.error("定时任务执行异常: %s", exc, exc_info=True)
-            time.sleep(1)
+            logging.error("Webhook 启动失败，改用长轮询: %s", exc)
+            await server.close()
+            server = None
+            # start_polling 会先删除已设置的 Webhook
+            await app.updater.start_polling()
+        await app.start()
+        try:
+            await stop.wait()
+        finally:
+            if app.updater.running:
+                await app.updater.stop()
+            if server is not None:
+                await server.close()
+            await app.stop()
+            await on_bot_stop(app)
 
 
 def main() -> None:
-    """程序入口：初始化日志、启动定时任务（子线程）、运行 Bot（主线程）。"""
+    """程序入口：初始化日志，在单个事件循环中运行 Bot 与定时检测。"""
     setup_logging()
     logging.info("监控系统启动")
-    config = load_config()
-
-    # 启动定时监控任务（子线程）
-    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-    scheduler_thread.start()
+    config = get_config().data
 
-    # 构建 Bot 应用
+    # 构建 Bot 应用，定时检测在 Bot 启动后作为同一事件循环中的任务运行
     app = start_bot(config)
-    if app:
-        # 在主线程运行 Bot（避免 set_wakeup_fd 错误）
+    webhook = WebhookSettings(config)
+    if app and webhook.enabled:
+        logging.info("Telegram Bot 以 Webhook 方式运行")
+        asyncio.run(run_bot_webhook(app, webhook))
+    elif app:
+        # 在主线程运行 Bot（避免 set_wakeup_fd 错误），收到停止信号时依次停止定时检测与 Bot
         logging.info("Telegram Bot 开始运行于主线程")
         app.run_polling()
     else:
-        # 如果 Bot 未配置，则主线程保持运行
+        # 如果 Bot 未配置，则只运行定时监控
         logging.warning("Bot 未启动，仅运行定时监控")
-        while True:
-            time.sleep(60)
+        asyncio.run(run_scheduler_only())
+    logging.info("监控系统已退出")
 
 
 if __name__ == "__main__":
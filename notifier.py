@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+# 告警通知管道
+# 告警只入队，不等待发送：每个通知目标（Telegram 聊天、HTTP Webhook、SMTP）一个发送任务，
+# 在批量窗口内合并告警，失败的批次进入重试队列按指数退避重发，多次失败后写入死信日志
+
+import asyncio
+import json
+import logging
+import os
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+from typing import Any, Dict, List, Optional, Set, Type
+
+import httpx
+
+from alert_dispatcher import MAX_MESSAGE_LENGTH, delivery_stats, get_dispatcher, plain_text, split_messages, text_length
+from loop_local import LoopLocal
+from probe_client import get_int_option
+
+DEFAULT_MAX_ATTEMPTS = 4     # 每个批次最多发送次数，超过后写入死信日志
+RETRY_BASE_DELAY = 30        # 批次首次重试间隔（秒），之后翻倍
+MAX_RETRY_DELAY = 600        # 批次重试间隔上限（秒）
+MAX_BATCH_ALERTS = 50        # 单个批次最多合并的告警条数
+FLUSH_TIMEOUT = 30           # 停止时等待队列发送完成的最长时间（秒）
+SINK_TIMEOUT = 10            # Webhook/SMTP 单次请求超时（秒）
+DEAD_LETTER_FILE = "data/dead_letters.jsonl"  # 死信日志（每行一个 JSON）
+
+_dead_letter_lock = threading.Lock()
+
+
+class SinkError(Exception):
+    """通知目标发送失败，批次进入重试队列。"""
+
+
+class Sink:
+    """通知目标基类。
+
+    子类实现 from_config 与 deliver；pack 决定一个批次的告警拆成几个独立发送/重试的单元。
+    """
+
+    kind = ""
+    default_batch_seconds = 5.0
+
+    def __init__(self, name: str, batch_seconds: float) -> None:
+        self.name = name
+        self.batch_seconds = batch_seconds
+
+    @classmethod
+    def from_config(cls, entry: Dict[str, Any], config: Dict[str, Any], batch_seconds: float) -> "Sink":
+        raise NotImplementedError
+
+    def pack(self, messages: List[str]) -> List[List[str]]:
+        """默认整批作为一个发送单元。"""
+        return [messages]
+
+    async def deliver(self, messages: List[str]) -> None:
+        """发送一个单元，失败时抛出异常。"""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+class TelegramSink(Sink):
+    """发送到一个 Telegram 聊天（经 alert_dispatcher 限速、429 重试）。"""
+
+    kind = "telegram"
+    default_batch_seconds = 2.0
+
+    def __init__(self, name: str, batch_seconds: float, token: str, chat_id: Any) -> None:
+        super().__init__(name, batch_seconds)
+        self.token = token
+        self.chat_id = str(chat_id)
+
+    @classmethod
+    def from_config(cls, entry: Dict[str, Any], config: Dict[str, Any], batch_seconds: float) -> "Sink":
+        token = config.get("telegram_bot_token")
+        chat_id = entry.get("chat_id")
+        if not token or not chat_id:
+            raise ValueError("缺少 telegram_bot_token 或 chat_id")
+        return cls(entry.get("name") or f"telegram:{chat_id}", batch_seconds, token, chat_id)
+
+    def pack(self, messages: List[str]) -> List[List[str]]:
+        # 合并为尽量少的消息，超过 4096 字符时在告警之间拆分；每条消息单独重试，避免重复发送已成功的部分
+        oversized = sum(1 for message in messages if text_length(message) > MAX_MESSAGE_LENGTH)
+        if oversized:
+            delivery_stats.record_split(oversized)
+        return [[chunk] for chunk in split_messages(messages)]
+
+    async def deliver(self, messages: List[str]) -> None:
+        dispatcher = get_dispatcher({"telegram_bot_token": self.token})
+        if dispatcher is None or not await dispatcher.send(self.chat_id, messages[0]):
+            raise SinkError("Telegram 发送失败")
+
+
+class WebhookSink(Sink):
+    """以 JSON POST 到通用 HTTP Webhook，2xx 视为成功。
+
+    请求体: {"source": "TelePing", "sent_at": 时间戳, "alerts": [{"text": 纯文本, "html": 原始 HTML}]}
+    """
+
+    kind = "webhook"
+    default_batch_seconds = 5.0
+
+    def __init__(self, name: str, batch_seconds: float, url: str, headers: Dict[str, str]) -> None:
+        super().__init__(name, batch_seconds)
+        self.url = url
+        self.headers = headers
+        # 首次发送时创建（创建客户端需加载证书，不占用告警入队的时间）
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @classmethod
+    def from_config(cls, entry: Dict[str, Any], config: Dict[str, Any], batch_seconds: float) -> "Sink":
+        url = entry.get("url")
+        if not url:
+            raise ValueError("缺少 url")
+        headers = entry.get("headers") or {}
+        if not isinstance(headers, dict):
+            raise ValueError("headers 不是字典类型")
+        return cls(entry.get("name") or f"webhook:{httpx.URL(url).host}", batch_seconds, url, {str(k): str(v) for k, v in headers.items()})
+
+    async def deliver(self, messages: List[str]) -> None:
+        body = {
+            "source": "TelePing",
+            "sent_at": int(time.time()),
+            "alerts": [{"text": plain_text(message), "html": message} for message in messages],
+        }
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=SINK_TIMEOUT, headers=self.headers)
+        try:
+            response = await self._client.post(self.url, json=body)
+        except httpx.HTTPError as exc:
+            raise SinkError(f"{type(exc).__name__}: {exc}") from exc
+        if not response.is_success:
+            raise SinkError(f"HTTP {response.status_code}")
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+
+
+class SmtpSink(Sink):
+    """通过 SMTP 中继发送邮件，一个批次一封（纯文本）。"""
+
+    kind = "smtp"
+    default_batch_seconds = 60.0
+
+    def __init__(self, name: str, batch_seconds: float, entry: Dict[str, Any], recipients: List[str]) -> None:
+        super().__init__(name, batch_seconds)
+        self.host = str(entry.get("host") or "127.0.0.1")
+        self.port = int(entry.get("port", 25))
+        self.sender = str(entry.get("from") or "teleping@localhost")
+        self.recipients = recipients
+        self.username = str(entry.get("username") or "")
+        self.password = str(entry.get("password") or "")
+        self.starttls = bool(entry.get("starttls", False))
+        self.subject_prefix = str(entry.get("subject_prefix") or "[TelePing]")
+
+    @classmethod
+    def from_config(cls, entry: Dict[str, Any], config: Dict[str, Any], batch_seconds: float) -> "Sink":
+        recipients = entry.get("to") or []
+        if isinstance(recipients, str):
+            recipients = [recipients]
+        if not recipients:
+            raise ValueError("缺少收件人 to")
+        return cls(entry.get("name") or f"smtp:{','.join(recipients)}", batch_seconds, entry, [str(r) for r in recipients])
+
+    def _send(self, email: EmailMessage) -> None:
+        with smtplib.SMTP(self.host, self.port, timeout=SINK_TIMEOUT) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(email)
+
+    async def deliver(self, messages: List[str]) -> None:
+        texts = [plain_text(message) for message in messages]
+        email = EmailMessage()
+        first_line = texts[0].split("\n", 1)[0].strip()
+        email["Subject"] = f"{self.subject_prefix} {first_line}" if len(texts) == 1 else f"{self.subject_prefix} {len(texts)} 条告警"
+        email["From"] = self.sender
+        email["To"] = ", ".join(self.recipients)
+        email.set_content("\n\n".join(texts))
+        try:
+            # smtplib 为阻塞接口，放到线程池中，不占用事件循环
+            await asyncio.to_thread(self._send, email)
+        except (OSError, smtplib.SMTPException) as exc:
+            raise SinkError(f"{type(exc).__name__}: {exc}") from exc
+
+
+# 配置中 type 字段 -> 通知目标类型，新增类型时在此注册
+SINK_TYPES: Dict[str, Type[Sink]] = {
+    TelegramSink.kind: TelegramSink,
+    WebhookSink.kind: WebhookSink,
+    SmtpSink.kind: SmtpSink,
+}
+
+
+def _write_dead_letter(record: Dict[str, Any]) -> None:
+    try:
+        with _dead_letter_lock:
+            directory = os.path.dirname(DEAD_LETTER_FILE)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(DEAD_LETTER_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except Exception as exc:
+        logging.error("写入死信日志失败: %s", exc)
+
+
+class _Batch:
+    """一个发送单元及其重试状态。"""
+
+    def __init__(self, messages: List[str]) -> None:
+        self.messages = messages
+        self.attempts = 0
+        self.due = 0.0
+        self.error = ""
+
+
+class SinkWorker:
+    """一个通知目标的发送任务：批量窗口合并、重试队列与死信日志。"""
+
+    def __init__(self, sink: Sink, max_attempts: int) -> None:
+        self.sink = sink
+        self.max_attempts = max_attempts
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # 等待重试的批次，按重试时间排序
+        self._retry: List[_Batch] = []
+        # 批量窗口内已取出的告警与正在发送的批次（停止时写入死信，避免丢失）
+        self._collecting: List[str] = []
+        self._active: List[_Batch] = []
+        # 尚未送达也未进入死信的消息数（排队、发送中与等待重试）；
+        # 入队时按告警计数，合并/拆分为发送单元后按单元内的消息计数
+        self.pending = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.delivered = 0
+        self.dead = 0
+        self.last_error = ""
+        self._task = asyncio.create_task(self._run())
+
+    def put(self, messages: List[str]) -> None:
+        self._queue.put_nowait(list(messages))
+        self.pending += len(messages)
+        self._idle.clear()
+
+    async def flush(self, timeout: float) -> bool:
+        """等待队列与重试队列清空，超时返回 False。"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self, timeout: float = FLUSH_TIMEOUT) -> None:
+        """尽量发送完剩余告警，未送达的写入死信日志后停止。"""
+        if not await self.flush(timeout):
+            logging.error("通知目标 %s 未能在 %ss 内发送完，%d 条告警写入死信日志", self.sink.name, timeout, self.pending)
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        leftovers = self._active + self._retry
+        if self._collecting:
+            leftovers.append(_Batch(self._collecting))
+        while not self._queue.empty():
+            messages = self._queue.get_nowait()
+            leftovers.append(_Batch(messages))
+        for batch in leftovers:
+            batch.error = batch.error or "停止时未送达"
+            await self._dead_letter(batch)
+        self._retry.clear()
+        self._active = []
+        self._collecting = []
+        await self.sink.close()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "name": self.sink.name,
+            "kind": self.sink.kind,
+            "pending": self.pending,
+            "retrying": len(self._retry),
+            "delivered": self.delivered,
+            "dead": self.dead,
+            "last_error": self.last_error,
+        }
+
+    async def _get(self, timeout: Optional[float]) -> Optional[List[str]]:
+        """从队列取一组告警，超时返回 None（不使用 wait_for，避免取消被吞掉）。"""
+        getter = asyncio.ensure_future(self._queue.get())
+        try:
+            done, _ = await asyncio.wait({getter}, timeout=timeout)
+        except BaseException:
+            getter.cancel()
+            raise
+        if getter in done:
+            return getter.result()
+        getter.cancel()
+        return None
+
+    async def _next_batches(self) -> List[_Batch]:
+        """取出到期的重试批次，或等待新告警并在批量窗口内合并。"""
+        while True:
+            now = time.monotonic()
+            if self._retry and self._retry[0].due <= now:
+                return [self._retry.pop(0)]
+            messages = await self._get(self._retry[0].due - now if self._retry else None)
+            if messages is None:
+                continue
+            self._collecting = messages
+            deadline = time.monotonic() + self.sink.batch_seconds
+            while len(messages) < MAX_BATCH_ALERTS:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                more = await self._get(remaining)
+                if more is None:
+                    break
+                messages.extend(more)
+            batches = [_Batch(unit) for unit in self.sink.pack(messages) if unit]
+            self._collecting = []
+            self.pending += sum(len(batch.messages) for batch in batches) - len(messages)
+            self._check_idle()
+            return batches
+
+    async def _run(self) -> None:
+        while True:
+            self._active = await self._next_batches()
+            while self._active:
+                await self._attempt(self._active[0])
+                self._active.pop(0)
+
+    async def _attempt(self, batch: _Batch) -> None:
+        try:
+            await self.sink.deliver(batch.messages)
+        except Exception as exc:
+            batch.attempts += 1
+            batch.error = str(exc) or type(exc).__name__
+            self.last_error = batch.error
+            if batch.attempts >= self.max_attempts:
+                await self._dead_letter(batch)
+                self._settle(batch)
+                return
+            delay = min(RETRY_BASE_DELAY * 2 ** (batch.attempts - 1), MAX_RETRY_DELAY)
+            batch.due = time.monotonic() + delay
+            self._retry.append(batch)
+            self._retry.sort(key=lambda item: item.due)
+            logging.warning(
+                "通知目标 %s 发送失败，%ds 后重试（%d/%d）: %s",
+                self.sink.name, delay, batch.attempts, self.max_attempts, batch.error,
+            )
+            return
+        self.delivered += len(batch.messages)
+        self._settle(batch)
+
+    def _settle(self, batch: _Batch) -> None:
+        self.pending -= len(batch.messages)
+        self._check_idle()
+
+    def _check_idle(self) -> None:
+        if self.pending <= 0 and self._queue.empty() and not self._retry:
+            self._idle.set()
+
+    async def _dead_letter(self, batch: _Batch) -> None:
+        self.dead += len(batch.messages)
+        logging.error("通知目标 %s 放弃发送 %d 条消息，已写入死信日志: %s", self.sink.name, len(batch.messages), batch.error)
+        record = {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "sink": self.sink.name,
+            "attempts": batch.attempts,
+            "error": batch.error,
+            "messages": batch.messages,
+        }
+        await asyncio.to_thread(_write_dead_letter, record)
+
+
+def notify_options(config: Dict[str, Any]) -> Dict[str, Any]:
+    """配置中的 notify 字段，格式错误时返回空字典。"""
+    notify = config.get("notify", {})
+    if not isinstance(notify, dict):
+        logging.error("配置中的 notify 不是字典类型，已忽略")
+        return {}
+    return notify
+
+
+def build_sinks(config: Dict[str, Any]) -> List[Sink]:
+    """按配置 notify.sinks 创建通知目标，未配置时只发送到 telegram_chat_id。
+
+    配置错误的条目记录错误后跳过，不影响其他目标。
+    """
+    notify = notify_options(config)
+    entries = notify.get("sinks")
+    if not isinstance(entries, list) or not entries:
+        entries = [{"type": TelegramSink.kind, "chat_id": config.get("telegram_chat_id")}]
+
+    sinks: List[Sink] = []
+    names = set()
+    for entry in entries:
+        if not isinstance(entry, dict):
+            logging.error("通知目标配置不是字典类型: %r", entry)
+            continue
+        sink_type = SINK_TYPES.get(str(entry.get("type", "")))
+        if sink_type is None:
+            logging.error("未知的通知目标类型: %r", entry.get("type"))
+            continue
+        try:
+            batch_seconds = float(entry.get("batch_seconds", notify.get("batch_seconds", sink_type.default_batch_seconds)))
+            sink = sink_type.from_config(entry, config, max(batch_seconds, 0.0))
+        except Exception as exc:
+            logging.error("通知目标 %s 配置无效，已跳过: %s", entry.get("name") or entry.get("type"), exc)
+            continue
+        if sink.name in names:
+            sink.name = f"{sink.name}#{len(sinks) + 1}"
+        names.add(sink.name)
+        sinks.append(sink)
+    return sinks
+
+
+class Notifier:
+    """绑定一个事件循环的通知管道：把告警分发给每个通知目标的发送任务。"""
+
+    def __init__(self) -> None:
+        self._workers: List[SinkWorker] = []
+        self._signature: Optional[str] = None
+        # 配置变更后在后台关闭旧目标的任务（保留引用，避免任务被回收；停止时一并等待）
+        self._closing: Set[asyncio.Task] = set()
+
+    def publish(self, messages: List[str], config: Dict[str, Any]) -> int:
+        """告警入队（不等待发送），返回通知目标数。通知配置变化时先重建通知目标。"""
+        self._configure(config)
+        if not self._workers:
+            logging.error("未配置可用的通知目标，跳过告警发送")
+            return 0
+        for worker in self._workers:
+            worker.put(messages)
+        return len(self._workers)
+
+    def _configure(self, config: Dict[str, Any]) -> None:
+        signature = json.dumps(
+            [config.get("notify"), config.get("telegram_bot_token"), config.get("telegram_chat_id")],
+            sort_keys=True,
+            default=str,
+        )
+        if signature == self._signature:
+            return
+        if self._signature is not None:
+            logging.info("通知配置已变更，重建通知目标")
+        self._signature = signature
+        for worker in self._workers:
+            # 旧目标在后台发送完已入队的告警
+            task = asyncio.create_task(worker.close())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+        max_attempts = get_int_option(notify_options(config), "max_attempts", DEFAULT_MAX_ATTEMPTS)
+        self._workers = [SinkWorker(sink, max_attempts) for sink in build_sinks(config)]
+
+    async def close(self, timeout: float = FLUSH_TIMEOUT) -> None:
+        """发送完剩余告警（最长 timeout 秒）后停止全部发送任务。"""
+        workers, self._workers = self._workers, []
+        self._signature = None
+        await asyncio.gather(*(worker.close(timeout) for worker in workers), *self._closing)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """各通知目标的统计（见 SinkWorker.snapshot）。"""
+        return [worker.snapshot() for worker in self._workers]
+
+
+# 当前事件循环上的通知管道（见 loop_local）
+_notifiers: LoopLocal[Notifier] = LoopLocal()
+
+
+def get_notifier() -> Notifier:
+    """获取当前事件循环上的通知管道。"""
+    notifier = _notifiers.get()
+    if notifier is None:
+        notifier = Notifier()
+        _notifiers.set(notifier)
+    return notifier
+
+
+async def close_notifier(timeout: float = FLUSH_TIMEOUT) -> None:
+    """发送完剩余告警并关闭当前事件循环上的通知管道。"""
+    notifier = _notifiers.pop()
+    if notifier is not None:
+        await notifier.close(timeout)
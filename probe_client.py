@@ -0,0 +1,1205 @@
+#!/usr/bin/env python3
+# 17CE 异步拨测客户端
+# 基于 asyncio + websockets，支持多站点并发检测、并发上限与整轮截止时间
+
+import asyncio
+import base64
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import ssl
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import websockets
+
+# 导入城市节点配置
+from city_nodes_config import (
+    PROVINCE_NAMES,
+    estimate_node_count,
+    get_escalation_node_config,
+    get_node_config,
+    get_sentinel_node_config,
+    match_province_id,
+)
+# 导入节点流式统计
+from round_analyzer import NodeAggregator
+# 导入积分消耗流水
+from credit_budget import get_ledger
+# 导入按事件循环隔离的共享对象
+from loop_local import LoopLocal
+
+CE_WS_URL = "wss://wsapi.17ce.com:8001/socket/"
+RETRY_TIMES = 3
+SLEEP_BETWEEN_RETRY = 5
+CONNECT_TIMEOUT = 30       # WebSocket 建连超时（秒）
+TASK_TIMEOUT = 60          # 单个测速任务的总等待时间（秒）
+DEFAULT_CONCURRENCY = 8    # 默认同时进行的测速任务数
+DEFAULT_ROUND_DEADLINE = 900  # 默认整轮检测截止时间（秒）
+COMPLETION_GRACE = 3       # 收满预期节点数后等待 TaskEnd 的宽限期（秒）
+NODE_COUNT_WINDOW = 5      # 学习节点数时参考的最近完成任务数
+NODE_COUNTS_FILE = "data/node_counts.json"  # 学习到的节点数持久化文件
+KEEPALIVE_INTERVAL = 30    # 长连接心跳间隔（秒）
+SESSION_IDLE_TIMEOUT = 300  # 会话空闲超过该时长后重新签名建连（秒）
+DEFAULT_RESULT_CACHE_TTL = 300  # 检测结果缓存有效期（秒），Bot 命令在有效期内直接复用
+MAX_CACHED_RESULTS = 1000  # 缓存的检测结果数上限（按 URL × 节点配置计）
+MAX_RETRY_DELAY = 60       # 重试退避的最大间隔（秒）
+BREAKER_FAILURES = 5       # 连续失败多少次后熔断
+BREAKER_BASE_DELAY = 30    # 熔断后首次试探的等待时间（秒），每次试探失败翻倍
+BREAKER_MAX_DELAY = 600    # 熔断等待时间上限（秒）
+RETRY_BUDGET_RATIO = 0.2   # 重试预算：每次首次请求积累的重试额度
+RETRY_BUDGET_MAX = 10      # 重试额度上限
+TRIAL_POLL_INTERVAL = 0.5  # 等待熔断试探结果的轮询间隔（秒）
+DEFAULT_MAX_INFLIGHT = 8   # 全进程同时进行的 17CE 任务数上限
+DEFAULT_RATE_PER_MINUTE = 30  # 全进程每分钟提交的 17CE 任务数上限
+THROTTLE_MIN_FACTOR = 0.125   # 限流自适应降速的下限（相对配置速率）
+THROTTLE_RECOVERY_STEP = 0.1  # 每次成功提交后恢复的速率比例
+LIMITER_WAIT_SAMPLES = 100    # 统计排队等待时间参考的最近请求数（每个优先级）
+INTERACTIVE_RESERVED = 1      # 后台检测不能占用、为交互请求预留的并发名额
+
+# 17CE 任务优先级（数值越小越优先）
+PRIORITY_INTERACTIVE = 0   # Bot 命令，有人在 Telegram 中等待
+PRIORITY_CONFIRM = 1       # 告警复核：复查上次告警/API 失败的站点
+PRIORITY_BACKGROUND = 2    # 后台定时检测
+LANE_NAMES = {PRIORITY_INTERACTIVE: "交互", PRIORITY_CONFIRM: "告警复核", PRIORITY_BACKGROUND: "后台"}
+
+# 只与单次请求有关的 17CE 错误码（附录.md，10013 为节点配置找不到测速点），不计入熔断，也不重试
+REQUEST_ERROR_CODES = {10009, 10010, 10011, 10012, 10013, 10014, 10015}
+# 表示限流的 17CE 错误码：附录.md 未列出，限流通过建连 HTTP 429 与错误信息中的提示识别
+THROTTLE_ERROR_CODES: Set[int] = set()
+THROTTLE_HINTS = ("too many", "rate limit", "频繁", "busy")
+_ERROR_CODE_RE = re.compile(r"\b(100\d\d)\b")
+
+# 进程内唯一递增的 txnid，避免同一秒内提交的任务冲突
+_txnid_counter = itertools.count(int(time.time()))
+# 进程内递增的失败来源编号（每个连接、每条 TaskErr 消息各一个），供熔断器对同一来源去重；
+# 不使用 id()，对象释放后地址会被复用，连续的不同失败可能得到相同的 id
+_failure_sources = itertools.count(1)
+
+# 17CE 使用自签名证书，与官方示例一致关闭校验
+_ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+_ssl_context.check_hostname = False
+_ssl_context.verify_mode = ssl.CERT_NONE
+
+
+def get_int_option(config: Dict[str, Any], key: str, default: int, minimum: int = 1) -> int:
+    """从配置读取正整数参数，缺失或非法时返回默认值。"""
+    raw = config.get(key, default)
+    try:
+        value = int(raw)
+    except (ValueError, TypeError):
+        logging.warning("配置 %s=%r 解析失败，使用默认值 %s", key, raw, default)
+        return default
+    if value < minimum:
+        logging.warning("配置 %s=%s 小于 %s，使用默认值 %s", key, value, minimum, default)
+        return default
+    return value
+
+
+def build_auth_url(username: str, token: str) -> str:
+    """生成带认证签名的 WebSocket 地址（md5(token)[4:23] 与官方一致）。"""
+    ut = str(int(time.time()))
+    pwd_md5 = hashlib.md5(token.encode()).hexdigest()[4:23]
+    code = hashlib.md5(
+        base64.b64encode((pwd_md5 + username + ut).encode())
+    ).hexdigest()
+    return f"{CE_WS_URL}?ut={ut}&code={code}&user={username}"
+
+
+def build_task_message(txnid: int, url: str, node_config: Dict[str, Any]) -> str:
+    """构造 HTTP 测速任务请求（全国主要城市覆盖配置）。"""
+    return json.dumps({
+        "txnid": txnid,
+        "nodetype": node_config["nodetype"],  # [1, 2] IDC + 路由器（数组格式）
+        "num": node_config["num"],            # 每省分配的节点数
+        "TestType": "HTTP",
+        "Url": url,
+        "TimeOut": 20,
+        "Request": "GET",
+        "NoCache": True,
+        "type": 1,
+        "isps": node_config["isps"],          # 运营商数组
+        "areas": node_config["areas"],        # 区域数组
+        "pro_ids": node_config["pro_ids"]     # 省份ID数组（官方API参数）
+    })
+
+
+def backoff_delay(attempt: int) -> float:
+    """第 attempt 次失败后的重试间隔：指数退避并加入 ±50% 随机抖动。"""
+    return min(SLEEP_BETWEEN_RETRY * 2 ** attempt, MAX_RETRY_DELAY) * random.uniform(0.5, 1.5)
+
+
+class ProviderError(Exception):
+    """17CE 服务层面的失败（连接断开、认证/积分等非单次请求错误），计入熔断。
+
+    source 标识失败来源（同一连接断开、同一条广播错误），同一来源只计一次失败。
+    """
+
+    def __init__(self, message: str, source: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.source = source
+
+
+class RequestError(Exception):
+    """17CE 拒绝本次请求（网址错误、找不到测速点等），服务可用但重试也不会成功，不计入熔断。"""
+
+
+class ThrottledError(Exception):
+    """17CE 因提交过快拒绝任务（限流错误码或建连 HTTP 429），只降速重试，不计入熔断。"""
+
+
+def is_throttle_error(error: Any) -> bool:
+    """TaskErr 是否表示 17CE 限流。"""
+    text = str(error)
+    match = _ERROR_CODE_RE.search(text)
+    if match is not None:
+        return int(match.group(1)) in THROTTLE_ERROR_CODES
+    lowered = text.lower()
+    return any(hint in lowered for hint in THROTTLE_HINTS)
+
+
+def is_request_error(error: Any) -> bool:
+    """TaskErr 是否只与本次请求有关（如网址错误），这类错误不代表 17CE 不可用。"""
+    match = _ERROR_CODE_RE.search(str(error))
+    return match is not None and int(match.group(1)) in REQUEST_ERROR_CODES
+
+
+class CircuitBreaker:
+    """17CE 熔断器（进程内共享，线程安全）。
+
+    - 关闭：正常放行；连续 BREAKER_FAILURES 次服务层面失败后打开
+    - 打开：所有站点立即失败，等待期（指数退避 + 抖动）结束后进入半开
+    - 半开：只放行一个试探请求，成功则关闭，失败则以加倍的等待期重新打开
+
+    allow 返回放行凭证，结论随凭证上报：打开/半开期间只有试探请求的凭证能改变状态或释放试探名额，
+    熔断前已放行的请求迟到的结论不会重新打开熔断或延长等待期。
+    """
+
+    NORMAL_PERMIT = 0  # 关闭状态下放行的普通请求
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_count = 0
+        self._retry_at = 0.0
+        self._trial_in_flight = False
+        # 当前试探请求的凭证（每次试探递增）
+        self._trial_permit: Optional[int] = None
+        self._trial_permits = itertools.count(1)
+        self._reported_open = False
+        self._last_source: Optional[int] = None
+        # 重试预算，避免 17CE 异常时每个站点都重试满次数
+        self._retry_tokens = float(RETRY_BUDGET_MAX)
+
+    @property
+    def is_closed(self) -> bool:
+        return self.state == self.CLOSED
+
+    @property
+    def trial_pending(self) -> bool:
+        """半开状态下试探请求是否仍在进行。"""
+        return self.state == self.HALF_OPEN and self._trial_in_flight
+
+    def allow(self) -> Optional[int]:
+        """放行一次请求时返回凭证（半开状态下即为试探请求的凭证），不放行时返回 None。"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return self.NORMAL_PERMIT
+            if self.state == self.OPEN and time.monotonic() >= self._retry_at:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                self._trial_permit = next(self._trial_permits)
+                logging.info("17CE 熔断半开，发送试探请求")
+                return self._trial_permit
+            return None
+
+    def _is_stale(self, permit: int) -> bool:
+        """打开/半开期间，非当前试探请求的结论不改变熔断状态。"""
+        return self.state != self.CLOSED and permit != self._trial_permit
+
+    def record_success(self, permit: int = NORMAL_PERMIT) -> None:
+        with self._lock:
+            if self._is_stale(permit):
+                return
+            if self.state != self.CLOSED:
+                logging.warning("17CE 试探成功，熔断关闭")
+            self.state = self.CLOSED
+            self._failures = 0
+            self._opened_count = 0
+            self._trial_in_flight = False
+            self._trial_permit = None
+
+    def record_failure(self, source: Optional[int] = None, permit: int = NORMAL_PERMIT) -> None:
+        with self._lock:
+            if self._is_stale(permit):
+                return
+            trial = self.state == self.HALF_OPEN
+            if source is not None:
+                # 一次连接断开会让所有进行中的任务同时失败，只计一次；试探请求的失败总是计入
+                if source == self._last_source and not trial:
+                    return
+                self._last_source = source
+            self._failures += 1
+            if trial or self._failures >= BREAKER_FAILURES:
+                delay = min(BREAKER_BASE_DELAY * 2 ** self._opened_count, BREAKER_MAX_DELAY) * random.uniform(0.8, 1.2)
+                self._opened_count += 1
+                self.state = self.OPEN
+                self._trial_in_flight = False
+                self._trial_permit = None
+                self._retry_at = time.monotonic() + delay
+                logging.error("17CE 连续失败 %d 次，熔断 %.0f 秒", self._failures, delay)
+
+    def release(self, permit: int) -> None:
+        """试探请求被取消或限流、没有结论时释放试探名额；其他请求的凭证不影响试探。"""
+        with self._lock:
+            if self.state == self.HALF_OPEN and permit == self._trial_permit:
+                self._trial_in_flight = False
+                self._trial_permit = None
+
+    def acquire_retry(self) -> bool:
+        """消耗一次重试额度，额度不足时返回 False。"""
+        with self._lock:
+            if self._retry_tokens < 1:
+                return False
+            self._retry_tokens -= 1
+            return True
+
+    def earn_retry(self) -> None:
+        """每次首次请求积累 RETRY_BUDGET_RATIO 的重试额度。"""
+        with self._lock:
+            self._retry_tokens = min(self._retry_tokens + RETRY_BUDGET_RATIO, RETRY_BUDGET_MAX)
+
+    def pop_notice(self) -> Optional[str]:
+        """熔断状态相对上次通知发生变化时返回 "open" / "recovered"，否则返回 None。"""
+        with self._lock:
+            is_open = self.state != self.CLOSED
+            if is_open == self._reported_open:
+                return None
+            self._reported_open = is_open
+            return "open" if is_open else "recovered"
+
+
+# 进程内共享的熔断器（定时任务与 Bot 共用）
+circuit_breaker = CircuitBreaker()
+
+
+class ProbeTicket:
+    """一次 17CE 检测的排队凭据。共享同一任务的调用方可以提升其优先级。"""
+
+    def __init__(self, priority: int = PRIORITY_BACKGROUND) -> None:
+        self.priority = priority
+
+    def raise_to(self, priority: int) -> None:
+        """提升到更高的优先级（数值越小越优先），不会降低。"""
+        if priority < self.priority:
+            self.priority = priority
+
+
+class ProbeLimiter:
+    """17CE 任务的全局限流器：并发上限加令牌桶提交速率。进程内共享，跨事件循环、线程安全。
+
+    定时检测、Bot 命令与脚本入口（各自的事件循环）共用同一组名额，按优先级分道排队：
+    - 交互（Bot 命令）优先于告警复核，告警复核优先于后台定时检测，同级按到达顺序
+    - 后台任务最多占用 max_inflight - INTERACTIVE_RESERVED 个名额，为交互请求预留空位
+    - 令牌桶空时交互请求可预支一个令牌
+    17CE 返回限流错误时速率减半，最低为 THROTTLE_MIN_FACTOR。之后每次成功逐步恢复。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.max_inflight = DEFAULT_MAX_INFLIGHT
+        self.rate_per_minute = DEFAULT_RATE_PER_MINUTE
+        self._inflight = 0
+        self._background_inflight = 0
+        # 排队等待并发名额的 [到达序号, 凭据, 事件循环, Future]
+        self._waiters: List[Tuple[int, ProbeTicket, asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._tokens = float(DEFAULT_MAX_INFLIGHT)
+        self._refilled_at = time.monotonic()
+        self._rate_factor = 1.0
+        self._waits: Dict[int, Deque[float]] = {
+            priority: collections.deque(maxlen=LIMITER_WAIT_SAMPLES) for priority in LANE_NAMES
+        }
+        self.throttled = 0
+
+    def configure(self, config: Dict[str, Any]) -> None:
+        """按配置 probe_max_inflight / probe_rate_per_minute 更新限额。"""
+        max_inflight = get_int_option(config, "probe_max_inflight", DEFAULT_MAX_INFLIGHT)
+        rate = get_int_option(config, "probe_rate_per_minute", DEFAULT_RATE_PER_MINUTE)
+        with self._lock:
+            if max_inflight != self.max_inflight or rate != self.rate_per_minute:
+                logging.info("17CE 限流配置: 并发 %d，每分钟 %d 个任务", max_inflight, rate)
+            self.max_inflight = max_inflight
+            self.rate_per_minute = rate
+            self._wake_locked()
+
+    @property
+    def effective_rate(self) -> float:
+        """当前每分钟提交速率（含自适应降速）。"""
+        return self.rate_per_minute * self._rate_factor
+
+    def _has_room_locked(self, priority: int) -> bool:
+        if self._inflight >= self.max_inflight:
+            return False
+        if priority == PRIORITY_BACKGROUND and self.max_inflight > INTERACTIVE_RESERVED:
+            return self._background_inflight < self.max_inflight - INTERACTIVE_RESERVED
+        return True
+
+    def _occupy_locked(self, priority: int) -> None:
+        self._inflight += 1
+        if priority == PRIORITY_BACKGROUND:
+            self._background_inflight += 1
+
+    def _wake_locked(self) -> None:
+        # 调用方需持有 _lock：按 (优先级, 到达顺序) 唤醒排队者，名额直接转交
+        self._waiters.sort(key=lambda item: (item[1].priority, item[0]))
+        remaining = []
+        for item in self._waiters:
+            _, ticket, loop, future = item
+            if not self._has_room_locked(ticket.priority):
+                remaining.append(item)
+                continue
+            try:
+                loop.call_soon_threadsafe(self._grant, future, ticket.priority)
+            except RuntimeError:
+                # 等待方的事件循环已关闭
+                continue
+            self._occupy_locked(ticket.priority)
+        self._waiters = remaining
+
+    def _grant(self, future: asyncio.Future, priority: int) -> None:
+        if future.done():
+            # 等待方已取消，归还转交的名额
+            self.release(priority)
+        else:
+            future.set_result(priority)
+
+    def _take_token_locked(self, priority: int) -> float:
+        # 调用方需持有 _lock：取得令牌返回 0，否则返回需要等待的秒数
+        now = time.monotonic()
+        per_second = self.effective_rate / 60
+        self._tokens = min(self._tokens + (now - self._refilled_at) * per_second, float(self.max_inflight))
+        self._refilled_at = now
+        # 交互请求可预支一个令牌，由之后的后台请求偿还
+        floor = 0.0 if priority == PRIORITY_INTERACTIVE else 1.0
+        if self._tokens >= floor:
+            self._tokens -= 1
+            return 0.0
+        return (floor - self._tokens) / per_second
+
+    async def acquire(self, ticket: ProbeTicket) -> int:
+        """取得一个并发名额与提交令牌。
+
+        Returns:
+            占用名额时的优先级，用完后必须以该值调用 release()
+        """
+        started = time.monotonic()
+        future: Optional[asyncio.Future] = None
+        with self._lock:
+            ahead = any(item[1].priority <= ticket.priority for item in self._waiters)
+            if not ahead and self._has_room_locked(ticket.priority):
+                self._occupy_locked(ticket.priority)
+                priority = ticket.priority
+            else:
+                loop = asyncio.get_running_loop()
+                future = loop.create_future()
+                self._waiters.append((next(self._seq), ticket, loop, future))
+        if future is not None:
+            try:
+                priority = await future
+            except asyncio.CancelledError:
+                with self._lock:
+                    queued = any(item[3] is future for item in self._waiters)
+                    if queued:
+                        self._waiters = [item for item in self._waiters if item[3] is not future]
+                # 名额已转交但尚未送达时由 _grant 归还
+                if not queued and future.done() and not future.cancelled():
+                    self.release(future.result())
+                raise
+
+        try:
+            while True:
+                with self._lock:
+                    delay = self._take_token_locked(ticket.priority)
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+        except BaseException:
+            self.release(priority)
+            raise
+
+        waited = time.monotonic() - started
+        with self._lock:
+            self._waits[ticket.priority].append(waited)
+        if waited >= 1:
+            logging.info("17CE %s任务排队等待 %.1f 秒", LANE_NAMES[ticket.priority], waited)
+        return priority
+
+    def boost(self, ticket: ProbeTicket, priority: int) -> None:
+        """提升排队中凭据的优先级（如 Bot 命令加入了进行中的后台检测），并按新顺序分配名额。"""
+        with self._lock:
+            ticket.raise_to(priority)
+            self._wake_locked()
+
+    def release(self, priority: int) -> None:
+        """归还并发名额。"""
+        with self._lock:
+            self._inflight -= 1
+            if priority == PRIORITY_BACKGROUND:
+                self._background_inflight -= 1
+            self._wake_locked()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, ticket: ProbeTicket) -> AsyncIterator[None]:
+        priority = await self.acquire(ticket)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    def on_throttled(self) -> None:
+        """17CE 返回限流错误：速率减半并清空令牌桶。"""
+        with self._lock:
+            self._rate_factor = max(self._rate_factor / 2, THROTTLE_MIN_FACTOR)
+            self._tokens = 0.0
+            self.throttled += 1
+            logging.warning("17CE 限流，提交速率降至每分钟 %.1f 个任务", self.effective_rate)
+
+    def on_success(self) -> None:
+        """任务被正常受理，逐步恢复提交速率。"""
+        if self._rate_factor >= 1:
+            return
+        with self._lock:
+            self._rate_factor = min(self._rate_factor + THROTTLE_RECOVERY_STEP, 1.0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """当前限流状态：进行中/排队任务数、速率与各优先级最近请求的排队等待时间。
+
+        Returns:
+            {
+                "inflight"/"max_inflight"/"queued": 任务数,
+                "rate_per_minute": 当前提交速率,
+                "throttled": 累计限流次数,
+                "avg_wait"/"max_wait": 全部优先级的排队等待时间（秒）,
+                "lanes": {优先级: {"queued", "count", "avg_wait", "max_wait"}},
+            }
+        """
+        with self._lock:
+            all_waits: List[float] = []
+            lanes: Dict[int, Dict[str, Any]] = {}
+            for priority, samples in self._waits.items():
+                waits = list(samples)
+                all_waits.extend(waits)
+                lanes[priority] = {
+                    "queued": sum(1 for item in self._waiters if item[1].priority == priority),
+                    "count": len(waits),
+                    "avg_wait": sum(waits) / len(waits) if waits else 0.0,
+                    "max_wait": max(waits, default=0.0),
+                }
+            return {
+                "inflight": self._inflight,
+                "max_inflight": self.max_inflight,
+                "queued": len(self._waiters),
+                "rate_per_minute": self.effective_rate,
+                "throttled": self.throttled,
+                "avg_wait": sum(all_waits) / len(all_waits) if all_waits else 0.0,
+                "max_wait": max(all_waits, default=0.0),
+                "lanes": lanes,
+            }
+
+
+# 进程内共享的 17CE 限流器（定时任务与 Bot 共用）
+probe_limiter = ProbeLimiter()
+
+
+def profile_key(node_config: Dict[str, Any]) -> str:
+    """节点配置的唯一标识，用于区分不同配置学习到的节点数。"""
+    return json.dumps(node_config, sort_keys=True)
+
+
+class NodeCountTracker:
+    """学习每种节点配置实际返回的节点数，并持久化到文件以便重启后继续使用。
+
+    取最近 NODE_COUNT_WINDOW 次完整任务（收到 TaskEnd）中的最大值作为预期节点数。
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._history: Dict[str, List[int]] = {}
+        self._loaded = False
+
+    def _load(self) -> None:
+        self._loaded = True
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as exc:
+            logging.warning("读取节点数学习记录失败，将重新学习: %s", exc)
+            return
+        if isinstance(raw, dict):
+            for key, counts in raw.items():
+                if isinstance(counts, list):
+                    self._history[key] = [int(c) for c in counts if isinstance(c, int) and c > 0][-NODE_COUNT_WINDOW:]
+
+    def _save(self) -> None:
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._history, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as exc:
+            logging.error("保存节点数学习记录失败: %s", exc)
+
+    def expected(self, node_config: Dict[str, Any]) -> Optional[int]:
+        """返回该配置学习到的预期节点数，尚未学习时返回 None。"""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            counts = self._history.get(profile_key(node_config))
+            return max(counts) if counts else None
+
+    def record(self, node_config: Dict[str, Any], count: int) -> None:
+        """记录一次完整任务实际返回的节点数。"""
+        if count <= 0:
+            return
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            key = profile_key(node_config)
+            counts = self._history.setdefault(key, [])
+            previous = max(counts) if counts else None
+            counts.append(count)
+            del counts[:-NODE_COUNT_WINDOW]
+            current = max(counts)
+            # 预期节点数变化时才写盘，避免每个任务都写文件
+            if previous != current:
+                self._save()
+        if previous != current:
+            logging.info("节点配置预期节点数更新: %s → %s", previous, current)
+
+
+# 进程内共享的节点数学习记录
+node_counts = NodeCountTracker(NODE_COUNTS_FILE)
+
+
+class _ConnectionLost:
+    """连接断开时投递给等待中任务的标记，source 为该连接的失败来源编号。"""
+
+    __slots__ = ("source",)
+
+    def __init__(self, source: int) -> None:
+        self.source = source
+
+
+class CE17Session:
+    """长连接 17CE 会话：一个认证连接承载多个并发任务，按 txnid 分发消息。
+
+    连接断开后在下一次提交任务时自动重连并重新签名；websockets 负责心跳保活。
+    """
+
+    def __init__(self, username: str, token: str) -> None:
+        self.username = username
+        self.token = token
+        self._ws: Optional[Any] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._connect_lock = asyncio.Lock()
+        # txnid -> 该任务的消息队列
+        self._waiters: Dict[int, asyncio.Queue] = {}
+        self._last_seen = 0.0
+
+    @property
+    def connected(self) -> bool:
+        return self._ws is not None and self._reader_task is not None and not self._reader_task.done()
+
+    async def _ensure_connected(self) -> Any:
+        """确保连接可用，断开时重新签名并重连。"""
+        async with self._connect_lock:
+            if self.connected:
+                # 事件循环空闲期间心跳无法运行，长时间无消息的连接主动重建
+                if self._waiters or time.monotonic() - self._last_seen < SESSION_IDLE_TIMEOUT:
+                    return self._ws
+                logging.info("17CE WebSocket 会话空闲过久，重新建立连接")
+                await self.close()
+            try:
+                self._ws = await websockets.connect(
+                    build_auth_url(self.username, self.token),
+                    ssl=_ssl_context,
+                    open_timeout=CONNECT_TIMEOUT,
+                    ping_interval=KEEPALIVE_INTERVAL,
+                    ping_timeout=KEEPALIVE_INTERVAL,
+                    max_size=None,
+                )
+            except websockets.InvalidStatus as exc:
+                if getattr(exc.response, "status_code", None) == 429:
+                    raise ThrottledError("17CE 建连被限流 (HTTP 429)") from exc
+                raise
+            self._last_seen = time.monotonic()
+            self._reader_task = asyncio.create_task(self._read_loop(self._ws, next(_failure_sources)))
+            logging.info("17CE WebSocket 会话已建立")
+            return self._ws
+
+    async def _read_loop(self, ws: Any, source: int) -> None:
+        """持续读取连接上的消息，按 txnid 路由给等待中的任务；source 为该连接的失败来源编号。"""
+        try:
+            async for raw_msg in ws:
+                self._last_seen = time.monotonic()
+                try:
+                    resp = json.loads(raw_msg)
+                except ValueError as exc:
+                    logging.warning("17CE WebSocket 消息解析失败: %s", exc)
+                    continue
+                if isinstance(resp, dict):
+                    self._dispatch(resp)
+        except websockets.ConnectionClosed as exc:
+            logging.warning("17CE WebSocket 会话已断开: %s", exc)
+        except Exception as exc:
+            logging.warning("17CE WebSocket 接收异常: %s", exc)
+        finally:
+            if self._ws is ws:
+                self._ws = None
+            # 通知所有等待中的任务连接已断开（同一连接的断开只计一次熔断失败）
+            lost = _ConnectionLost(source)
+            for queue in self._waiters.values():
+                queue.put_nowait(lost)
+
+    def _dispatch(self, resp: Dict[str, Any]) -> None:
+        """按 txnid 把消息投递给对应任务；缺少 txnid 的错误消息广播给所有任务。"""
+        msg_type = str(resp.get("type") or "")
+        try:
+            txnid = int(resp["txnid"])
+        except (KeyError, ValueError, TypeError):
+            txnid = None
+
+        if msg_type == "TaskErr":
+            # 每条错误消息一个来源编号，广播给多个任务时只计一次熔断失败
+            resp["_source"] = next(_failure_sources)
+        if txnid is not None and txnid in self._waiters:
+            self._waiters[txnid].put_nowait(resp)
+        elif txnid is None and msg_type == "TaskErr":
+            for queue in self._waiters.values():
+                queue.put_nowait(resp)
+        elif txnid is None and len(self._waiters) == 1 and msg_type in ("TaskAccept", "NewData", "TaskEnd"):
+            next(iter(self._waiters.values())).put_nowait(resp)
+        elif msg_type:
+            # 提前判定或超时结束的任务仍会陆续收到消息，直接丢弃
+            logging.debug(f"17CE 收到无法匹配任务的消息: {msg_type} (txnid={txnid})")
+        else:
+            logging.info(f"17CE 收到消息: {resp}")
+
+    async def run_task(
+        self,
+        url: str,
+        node_config: Dict[str, Any],
+        keep_nodes: int = 0,
+        early_threshold: Optional[float] = None,
+        on_usage: Optional[Callable[[int], None]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """在会话上提交一个测速任务并等待结果。
+
+        节点数据到达时即折叠进 NodeAggregator，原始节点最多保留 keep_nodes 个。
+        指定 early_threshold 时启用提前判定：告警结论已无法改变即停止等待，
+        结果标记为部分结果（stats.partial）。
+        任务结束（含失败、超时）时以收到的节点数调用 on_usage，用于积分统计；
+        提前判定或被取消而不再等待的任务在 17CE 仍会完整执行并计费，按预期节点数（学习值或理论值）计。
+
+        Returns:
+            {"data": [保留的原始节点], "stats": NodeAggregator}，失败返回 None
+
+        Raises:
+            RequestError: 17CE 拒绝本次请求（REQUEST_ERROR_CODES）
+            ThrottledError: 17CE 限流
+            ProviderError: 连接断开或 17CE 服务层面的错误
+        """
+        ws = await self._ensure_connected()
+        txnid = next(_txnid_counter)
+        queue: asyncio.Queue = asyncio.Queue()
+        self._waiters[txnid] = queue
+        stats = NodeAggregator(keep_nodes)
+        # 是否在 TaskEnd 之前停止等待（任务仍在 17CE 上执行）
+        stopped_early = False
+        try:
+            test_msg = build_task_message(txnid, url, node_config)
+            logging.info(f"17CE 测速请求（{len(node_config['pro_ids'])}个核心省份，每省{node_config['num']}个节点）: {test_msg}")
+            await ws.send(test_msg)
+            logging.info(f"17CE 已发送测速请求: {url} (txnid={txnid})")
+
+            # 优先使用学习到的实际节点数，未学习过的配置退回理论节点数
+            learned = node_counts.expected(node_config)
+            stats.expected = learned or estimate_node_count(node_config)
+            deadline = time.monotonic() + TASK_TIMEOUT
+
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    resp = await asyncio.wait_for(queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                if isinstance(resp, _ConnectionLost):
+                    raise ProviderError(f"17CE WebSocket 连接已关闭 (txnid={txnid})", source=resp.source)
+
+                msg_type = str(resp.get("type") or "")
+                if msg_type == "TaskAccept":
+                    logging.info(f"17CE 任务已接受 (txnid={txnid})")
+                elif msg_type == "NewData":
+                    node_data = resp.get("data", {}) or {}
+                    if isinstance(node_data, dict):
+                        node_data["status"] = node_data.get("HttpCode", 0)
+                        node_data["loss"] = node_data.get("Loss", 0)
+                        stats.add(node_data)
+                        if early_threshold is not None and stats.decide_early(early_threshold, stats.expected) is not None:
+                            stats.partial = True
+                            stopped_early = True
+                            logging.info(f"17CE 提前判定完成，已收到 {stats.total}/{stats.expected} 个节点数据 (txnid={txnid})")
+                            return {"data": stats.nodes, "stats": stats}
+                        if learned and stats.total == learned:
+                            # 已收到学习到的节点数，只再等待短暂宽限期的 TaskEnd
+                            deadline = min(deadline, time.monotonic() + COMPLETION_GRACE)
+                    else:
+                        logging.info("17CE 收到非字典节点数据，已忽略")
+                elif msg_type == "TaskEnd":
+                    logging.info(f"17CE 检测完成，获得 {stats.total} 个节点数据 (txnid={txnid})")
+                    node_counts.record(node_config, stats.total)
+                    return {"data": stats.nodes, "stats": stats}
+                elif msg_type == "TaskErr":
+                    if is_throttle_error(resp.get("error")):
+                        raise ThrottledError(f"17CE 任务被限流: {resp.get('error')} (txnid={txnid})")
+                    if not is_request_error(resp.get("error")):
+                        raise ProviderError(f"17CE 任务失败: {resp.get('error')} (txnid={txnid})", source=resp.get("_source"))
+                    raise RequestError(f"17CE 任务失败: {resp.get('error')} (txnid={txnid})")
+
+            if learned and stats.total >= learned:
+                logging.info(f"17CE 未收到 TaskEnd，已达预期节点数 {stats.total}/{learned}，视为完成 (txnid={txnid})")
+                return {"data": stats.nodes, "stats": stats}
+
+            logging.error("17CE WebSocket 接收超时或任务未完成 (txnid=%s)", txnid)
+            return None
+        except asyncio.CancelledError:
+            stopped_early = True
+            raise
+        finally:
+            self._waiters.pop(txnid, None)
+            credits = max(stats.total, stats.expected or 0) if stopped_early else stats.total
+            if on_usage is not None and credits:
+                on_usage(credits)
+
+    async def close(self) -> None:
+        """关闭会话连接。"""
+        ws = self._ws
+        self._ws = None
+        if ws is not None:
+            try:
+                await ws.close()
+            except Exception:
+                pass
+        if self._reader_task is not None:
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+            self._reader_task = None
+
+
+# 当前事件循环上的共享会话（见 loop_local）
+_sessions: LoopLocal[CE17Session] = LoopLocal(CE17Session.close)
+
+
+def get_session(config: Dict[str, Any]) -> Optional[CE17Session]:
+    """获取当前事件循环上的共享 17CE 会话，凭证变更时重建。"""
+    username = config.get("17ce_username")
+    token = config.get("17ce_token")
+    if not username or not token:
+        logging.error("17CE 凭证未配置")
+        return None
+
+    session = _sessions.get()
+    if session is None or session.username != username or session.token != token:
+        # 旧会话在后台关闭
+        session = CE17Session(username, token)
+        _sessions.set(session)
+    return session
+
+
+async def close_session() -> None:
+    """关闭当前事件循环上的共享会话。"""
+    session = _sessions.pop()
+    if session is not None:
+        await session.close()
+
+
+class _ProbeAbandoned(Exception):
+    """共享任务的发起方被取消，等待方需自行重新检测。"""
+
+
+class ProbeCache:
+    """按标准化URL共享进行中的测速任务，并按 (URL, 节点配置) 缓存最近一次完整结果。
+
+    进行中的任务以 concurrent.futures.Future 登记，同一事件循环或其他事件循环
+    （脚本入口 monitor_all、call_17ce_api）上的调用方都通过 wrap_future 等待同一结果。
+    提前判定得到的部分结果不写入缓存；哨兵、精简等其他节点配置的结果只供同一配置复用，
+    不会被当作标准配置的结果返回。
+    写入时清理超过有效期（最近一次查询使用的 max_age）的结果，并最多保留 MAX_CACHED_RESULTS 条，
+    已删除站点与不再使用的节点配置的结果不会长期占用内存。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # (标准化URL, 节点配置) -> 最近一次完整结果（含 finished_at），按写入时间排序
+        self._results: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._ttl: float = DEFAULT_RESULT_CACHE_TTL
+        # (URL, 提前判定阈值, 保留节点数, 节点配置) -> (进行中的任务, 排队凭据)
+        self._inflight: Dict[Tuple[str, Optional[float], int, str], Tuple[concurrent.futures.Future, ProbeTicket]] = {}
+
+    def get(self, url: str, profile: str, max_age: float) -> Optional[Dict[str, Any]]:
+        """返回该节点配置 max_age 秒内完成的缓存结果，没有则返回 None。"""
+        with self._lock:
+            self._ttl = max_age
+            result = self._results.get((url, profile))
+        if result is None or time.time() - result["finished_at"] > max_age:
+            return None
+        return result
+
+    def join(self, key: Tuple[str, Optional[float], int, str], ticket: ProbeTicket) -> Tuple[concurrent.futures.Future, ProbeTicket, bool]:
+        """登记或加入进行中的任务。
+
+        加入已有任务时按调用方的优先级提升该任务的排队凭据。
+
+        Returns:
+            (future, 任务的排队凭据, 是否由调用方负责执行)
+        """
+        with self._lock:
+            entry = self._inflight.get(key)
+            if entry is None:
+                future: concurrent.futures.Future = concurrent.futures.Future()
+                self._inflight[key] = (future, ticket)
+                return future, ticket, True
+        future, owner_ticket = entry
+        if ticket.priority < owner_ticket.priority:
+            probe_limiter.boost(owner_ticket, ticket.priority)
+        return future, owner_ticket, False
+
+    def finish(self, key: Tuple[str, Optional[float], int, str], future: concurrent.futures.Future, result: Optional[Dict[str, Any]]) -> None:
+        """发布任务结果，完整结果同时写入缓存。"""
+        with self._lock:
+            if self._inflight.get(key, (None,))[0] is future:
+                del self._inflight[key]
+            if result is not None and not result["stats"].partial:
+                # 先删除再写入，保持按写入时间排序，过期结果都在最前面
+                self._results.pop((key[0], key[3]), None)
+                self._results[(key[0], key[3])] = result
+                self._evict()
+        future.set_result(result)
+
+    def _evict(self) -> None:
+        """删除过期结果，超过数量上限时删除最早的结果（调用方持有锁）。"""
+        expire_before = time.time() - self._ttl
+        while self._results:
+            oldest = next(iter(self._results))
+            if len(self._results) <= MAX_CACHED_RESULTS and self._results[oldest]["finished_at"] >= expire_before:
+                break
+            del self._results[oldest]
+
+    def abandon(self, key: Tuple[str, Optional[float], int, str], future: concurrent.futures.Future) -> None:
+        """发起方被取消或异常退出时释放登记，通知等待方。"""
+        with self._lock:
+            if self._inflight.get(key, (None,))[0] is future:
+                del self._inflight[key]
+        future.set_exception(_ProbeAbandoned())
+
+    def clear(self) -> None:
+        """清空缓存结果。"""
+        with self._lock:
+            self._results.clear()
+
+
+# 进程内共享的进行中任务与结果缓存
+probe_cache = ProbeCache()
+
+
+async def _probe_with_retries(
+    url: str,
+    config: Dict[str, Any],
+    retries: int,
+    keep_nodes: int,
+    early_threshold: Optional[float],
+    node_config: Dict[str, Any],
+    ticket: ProbeTicket,
+) -> Optional[Dict[str, Any]]:
+    """异步调用 17CE WebSocket API 对单个站点测速，失败时按次数重试。
+
+    每次尝试实际收到的节点数记入积分流水，每次尝试都按 ticket 的优先级排队。
+
+    Returns:
+        {"data": [保留的原始节点], "stats": NodeAggregator}，全部尝试失败时返回 None
+    """
+    session = get_session(config)
+    if session is None:
+        return None
+    # 打开积分流水（首次调用会建表）与写入都放到线程池中，SQLite 锁等待不阻塞事件循环
+    ledger = await asyncio.to_thread(get_ledger, config)
+    loop = asyncio.get_running_loop()
+
+    def record_usage(credits: int) -> None:
+        if ledger is not None:
+            # 任务结束时由 run_task 同步回调，写入在后台完成，不等待
+            loop.run_in_executor(None, ledger.record, url, credits)
+
+    circuit_breaker.earn_retry()
+    attempt = 0
+    for attempt in range(retries):
+        # 试探请求进行中时等待其结论，试探成功后本轮其余站点照常检测
+        while circuit_breaker.trial_pending:
+            await asyncio.sleep(TRIAL_POLL_INTERVAL)
+        # 熔断打开时立即失败，不再为每个站点等待连接与任务超时
+        permit = circuit_breaker.allow()
+        if permit is None:
+            logging.warning("17CE 熔断中，跳过检测: %s", url)
+            return None
+        try:
+            # 全局限流：定时任务与 Bot 命令共用 17CE 并发名额与提交速率
+            probe_limiter.configure(config)
+            async with probe_limiter.slot(ticket):
+                result = await session.run_task(url, node_config, keep_nodes, early_threshold, record_usage)
+        except asyncio.CancelledError:
+            circuit_breaker.release(permit)
+            raise
+        except RequestError as exc:
+            # 网址或节点配置错误，17CE 可用，重试也不会成功
+            circuit_breaker.record_success(permit)
+            probe_limiter.on_success()
+            logging.error("17CE 拒绝检测请求，不再重试: %s", exc)
+            return None
+        except ThrottledError as exc:
+            # 限流说明 17CE 可用，只降速重试，不计入熔断
+            circuit_breaker.release(permit)
+            probe_limiter.on_throttled()
+            logging.warning("17CE 调用被限流（第 %s 次）: %s", attempt + 1, exc)
+        except Exception as exc:
+            circuit_breaker.record_failure(getattr(exc, "source", None), permit)
+            logging.warning("17CE 调用失败（第 %s 次）: %s", attempt + 1, exc)
+        else:
+            # 17CE 正常响应（含任务超时），服务可用
+            circuit_breaker.record_success(permit)
+            probe_limiter.on_success()
+            if result is not None:
+                return result
+
+        if attempt < retries - 1:
+            if not circuit_breaker.acquire_retry():
+                logging.warning("17CE 重试额度不足，放弃重试: %s", url)
+                break
+            await asyncio.sleep(backoff_delay(attempt))
+
+    logging.error(f"17CE API 调用最终失败，共尝试 {attempt + 1} 次: {url}")
+    return None
+
+
+async def probe_site(
+    url: str,
+    config: Dict[str, Any],
+    retries: int = RETRY_TIMES,
+    keep_nodes: Optional[int] = None,
+    early_threshold: Optional[float] = None,
+    max_age: Optional[float] = None,
+    node_config: Optional[Dict[str, Any]] = None,
+    priority: int = PRIORITY_BACKGROUND,
+) -> Optional[Dict[str, Any]]:
+    """检测单个站点：同一URL同时只进行一个测速任务，并发调用方共享同一结果。
+
+    Args:
+        url: 已标准化的站点URL
+        config: 配置字典（读取 17CE 凭证）
+        retries: 最大尝试次数
+        keep_nodes: 保留的原始节点数上限，默认读取配置 keep_raw_nodes
+        early_threshold: 告警阈值，指定时启用提前判定
+        max_age: 可接受的缓存结果最大时长（秒），None 表示必须重新检测；只复用同一节点配置的结果
+        node_config: 节点配置，默认使用 get_node_config()
+        priority: 17CE 排队优先级（PRIORITY_*），加入进行中的任务时提升其优先级
+
+    Returns:
+        {"data": [保留的原始节点], "stats": NodeAggregator, "finished_at": 完成时间戳}，
+        全部尝试失败时返回 None
+    """
+    if node_config is None:
+        node_config = get_node_config()
+    profile = profile_key(node_config)
+
+    if max_age is not None and max_age > 0:
+        cached = probe_cache.get(url, profile, max_age)
+        if cached is not None:
+            logging.info("17CE 复用 %.0f 秒前的检测结果: %s", time.time() - cached["finished_at"], url)
+            return cached
+    if keep_nodes is None:
+        keep_nodes = get_int_option(config, "keep_raw_nodes", 0, minimum=0)
+
+    key = (url, early_threshold, keep_nodes, profile)
+    while True:
+        future, ticket, owner = probe_cache.join(key, ProbeTicket(priority))
+        if not owner:
+            logging.info("17CE 等待进行中的同一站点检测: %s", url)
+            try:
+                # shield 防止等待方被取消时连带取消共享任务
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except _ProbeAbandoned:
+                # 发起方被取消，由当前调用方重新发起
+                continue
+
+        try:
+            result = await _probe_with_retries(url, config, retries, keep_nodes, early_threshold, node_config, ticket)
+        except BaseException:
+            probe_cache.abandon(key, future)
+            raise
+        if result is not None:
+            result["finished_at"] = time.time()
+        probe_cache.finish(key, future, result)
+        return result
+
+
+async def probe_site_tiered(
+    url: str,
+    config: Dict[str, Any],
+    early_threshold: Optional[float] = None,
+    priority: int = PRIORITY_BACKGROUND,
+) -> Optional[Dict[str, Any]]:
+    """分级检测单个站点：先用哨兵节点配置检测，任一节点失败时再扩大范围复测。
+
+    第二阶段覆盖 MAJOR_CITIES 全部省份与哨兵失败节点所在省份，运营商限定为失败的运营商。
+    哨兵节点数太少，不能单独作为告警依据：扩大检测失败时按检测失败返回 None。
+
+    Returns:
+        与 probe_site 相同（哨兵或扩大检测失败时为 None）；额外包含 "escalated"
+        （是否进行了第二阶段）与 "sentinel_failed"（哨兵失败节点数）
+    """
+    # 哨兵阶段总是重新检测：复用缓存会跳过本轮的异常判定与扩大检测
+    result = await probe_site(url, config, node_config=get_sentinel_node_config(), priority=priority)
+    if result is None:
+        return None
+    sentinel = result["stats"]
+    if sentinel.failed == 0 and sentinel.skipped == 0:
+        return {**result, "escalated": False, "sentinel_failed": 0}
+
+    failed_isps, failed_regions = sentinel.failed_isps_regions()
+    failed_pro_ids = {pro_id for pro_id in map(match_province_id, failed_regions) if pro_id is not None}
+    wide_config = get_escalation_node_config(failed_isps, failed_pro_ids)
+    logging.info(
+        "哨兵检测发现 %d/%d 个节点异常，扩大检测: %s（失败省份: %s）",
+        sentinel.failed, sentinel.total, url,
+        "、".join(PROVINCE_NAMES.get(pro_id, str(pro_id)) for pro_id in sorted(failed_pro_ids)) or "未识别",
+    )
+    wide = await probe_site(url, config, early_threshold=early_threshold, node_config=wide_config, priority=priority)
+    if wide is None:
+        logging.warning("扩大检测失败，哨兵 %d/%d 个节点异常不足以判定，按检测失败处理: %s", sentinel.failed, sentinel.total, url)
+        return None
+    return {**wide, "escalated": True, "sentinel_failed": sentinel.failed}
+
+
+async def probe_sites(
+    urls: List[str],
+    config: Dict[str, Any],
+    concurrency: Optional[int] = None,
+    deadline: Optional[float] = None,
+    early_threshold: Optional[float] = None,
+    max_age: Optional[float] = None,
+    on_result: Optional[Callable[[int, Optional[Dict[str, Any]]], None]] = None,
+    node_config: Optional[Dict[str, Any]] = None,
+    tiered: bool = False,
+    priority: int = PRIORITY_BACKGROUND,
+    priorities: Optional[List[int]] = None,
+    idle_timeout: Optional[float] = None,
+) -> Dict[int, Optional[Dict[str, Any]]]:
+    """并发检测多个站点，整轮耗时取决于最慢的站点而非所有站点之和。
+
+    Args:
+        urls: 已标准化的站点URL列表
+        config: 配置字典
+        concurrency: 同时进行的任务数上限，默认读取配置 probe_concurrency
+        deadline: 整轮截止时间（秒），默认读取配置 round_deadline_seconds
+        early_threshold: 告警阈值，指定时对每个站点启用提前判定
+        max_age: 可接受的缓存结果最大时长（秒），None 表示全部重新检测
+        on_result: 每个站点完成时立即调用 on_result(urls下标, 结果)，用于增量处理
+        node_config: 节点配置，默认使用 get_node_config()
+        tiered: 是否使用分级检测（probe_site_tiered，忽略 node_config 与 max_age）
+        priority: 17CE 排队优先级（PRIORITY_*）
+        priorities: 按 urls 下标指定的优先级，指定时覆盖 priority
+        idle_timeout: 连续该时长（秒）没有站点完成时提前结束，None 表示只受 deadline 限制
+
+    Returns:
+        {urls下标: 结果}，检测失败的站点结果为 None；
+        超过截止时间仍未完成的站点不在返回字典中
+    """
+    if concurrency is None:
+        concurrency = get_int_option(config, "probe_concurrency", DEFAULT_CONCURRENCY)
+    if deadline is None:
+        deadline = get_int_option(config, "round_deadline_seconds", DEFAULT_ROUND_DEADLINE)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _probe(idx: int, url: str) -> Optional[Dict[str, Any]]:
+        site_priority = priorities[idx] if priorities is not None else priority
+        async with semaphore:
+            try:
+                if tiered:
+                    result = await probe_site_tiered(url, config, early_threshold=early_threshold, priority=site_priority)
+                else:
+                    result = await probe_site(
+                        url, config, early_threshold=early_threshold, max_age=max_age,
+                        node_config=node_config, priority=site_priority,
+                    )
+            except Exception as exc:
+                logging.error("站点检测任务异常 %s: %s", url, exc)
+                result = None
+        if on_result is not None:
+            on_result(idx, result)
+        return result
+
+    tasks = [asyncio.create_task(_probe(idx, url)) for idx, url in enumerate(urls)]
+    if not tasks:
+        return {}
+
+    stop_at = time.monotonic() + deadline
+    pending = set(tasks)
+    while pending:
+        remaining = stop_at - time.monotonic()
+        if remaining <= 0:
+            logging.warning("本轮检测超过截止时间 %ss，%d 个站点未完成", deadline, len(pending))
+            break
+        timeout = remaining if idle_timeout is None else min(remaining, idle_timeout)
+        finished, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if not finished and idle_timeout is not None and timeout < remaining:
+            logging.warning("检测连续 %ss 没有站点完成，%d 个站点未完成", idle_timeout, len(pending))
+            break
+    done = set(tasks) - pending
+    if pending:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    results: Dict[int, Optional[Dict[str, Any]]] = {}
+    for idx, task in enumerate(tasks):
+        if task not in done:
+            continue
+        if task.exception() is not None:
+            logging.error("站点检测任务异常 %s: %s", urls[idx], task.exception())
+            results[idx] = None
+        else:
+            results[idx] = task.result()
+    return results
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# 17CE 节点数据流式统计与列式分析
+# 每收到一个 NewData 节点即解析一次并写入紧凑的列式表，告警判定与 /check 详情都基于同一张表计算
+
+import logging
+import threading
+from array import array
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# 17CE 运营商ID → 中文名称
+ISP_NAMES = {1: "电信", 2: "联通", 7: "移动"}
+# 区域告警规则：单地区失败节点数达到该值即告警
+REGION_ALERT_NODES = 3
+# /check 状态分级阈值
+ERROR_RATE = 0.20
+WARNING_RATE = 0.10
+
+# 响应IP标记
+IP_NORMAL = 0
+IP_ZERO = 1       # 0.0.0.0，DNS解析失败
+IP_LOOPBACK = 2   # 127.x.x.x，DNS劫持
+
+# 地区名称驻留表（进程内共享，地区以 uint16 编号存储）
+_region_lock = threading.Lock()
+_region_ids: Dict[str, int] = {}
+_region_names: List[str] = []
+
+
+def intern_region(name: str) -> int:
+    """返回地区名称对应的编号，首次出现时分配新编号。"""
+    region_id = _region_ids.get(name)
+    if region_id is not None:
+        return region_id
+    with _region_lock:
+        region_id = _region_ids.get(name)
+        if region_id is None:
+            region_id = len(_region_names)
+            _region_names.append(name)
+            _region_ids[name] = region_id
+        return region_id
+
+
+def region_name(region_id: int) -> str:
+    """返回地区编号对应的名称。"""
+    return _region_names[region_id]
+
+
+def _to_int(raw: Any) -> int:
+    # 处理可能的字符串值（如 "--"、""、None）
+    if raw in (None, "", "--"):
+        return 0
+    try:
+        return int(raw)
+    except (ValueError, TypeError):
+        return 0
+
+
+def _to_float(raw: Any) -> float:
+    if raw in (None, "", "--"):
+        return 0.0
+    try:
+        return float(raw)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def parse_node(node: Dict[str, Any]) -> Tuple[int, float, int, int, int]:
+    """安全地提取单个节点的字段，格式异常时抛出异常由调用方跳过。
+
+    Returns:
+        (HTTP状态码, 丢包率, 运营商ID, 地区编号, 响应IP标记)
+    """
+    status = _to_int(node.get("status", 0))
+    # 超出 int16 范围的状态码按无法连接处理
+    if not -32768 <= status <= 32767:
+        status = 0
+    loss = _to_float(node.get("loss", 0))
+
+    # 从 NodeInfo 中提取运营商ID（NodeInfo 格式异常时归为其他）
+    node_info = node.get("NodeInfo", {}) or {}
+    isp = _to_int(node_info.get("isp", 0)) if isinstance(node_info, dict) else 0
+    if not 0 <= isp <= 255:
+        isp = 0
+
+    # 获取响应IP（SrcIP 字段）
+    response_ip = str(node.get("SrcIP", ""))
+    if response_ip == "0.0.0.0":
+        ip_flag = IP_ZERO
+    elif response_ip.startswith("127."):
+        ip_flag = IP_LOOPBACK
+    else:
+        ip_flag = IP_NORMAL
+
+    # 获取测速点地区信息（从 srcip.srcip_from）
+    srcip_info = node.get("srcip", {}) or {}
+    region = intern_region(str(srcip_info.get("srcip_from", "未知")))
+    return status, loss, isp, region, ip_flag
+
+
+def is_failed(status: int, loss: float, ip_flag: int) -> bool:
+    """判定节点是否失败（包含异常 IP 检测）。"""
+    return status != 200 or loss >= 100 or ip_flag != IP_NORMAL
+
+
+def classify_error(status: int, loss: float, ip_flag: int) -> str:
+    """识别失败节点的异常类型。"""
+    if ip_flag == IP_ZERO:
+        return "DNS解析失败(0.0.0.0)"
+    if ip_flag == IP_LOOPBACK:
+        return "DNS劫持(127.x.x.x)"
+    if loss >= 100:
+        return "连接超时/丢包100%"
+    if status == 0:
+        return "无法连接"
+    if status == 404:
+        return "404页面不存在"
+    if status in (500, 502, 503):
+        return f"{status}服务器错误"
+    return f"HTTP{status}错误"
+
+
+class RoundTable:
+    """一个测速任务的列式节点表，每个节点约 10 字节。
+
+    列: status(int16) loss(float32) isp(uint8) region(uint16 地区编号) ip_flag(uint8)
+    """
+
+    def __init__(self) -> None:
+        self.status = array("h")
+        self.loss = array("f")
+        self.isp = array("B")
+        self.region = array("H")
+        self.ip_flag = array("B")
+
+    def __len__(self) -> int:
+        return len(self.status)
+
+    def append(self, status: int, loss: float, isp: int, region: int, ip_flag: int) -> None:
+        self.status.append(status)
+        self.loss.append(loss)
+        self.isp.append(isp)
+        self.region.append(region)
+        self.ip_flag.append(ip_flag)
+
+
+class NodeAggregator:
+    """增量统计一个测速任务的节点结果：节点到达时解析一次写入 RoundTable。
+
+    同时维护失败数与各地区失败数的实时计数，供提前判定使用。
+
+    Args:
+        keep_nodes: 额外保留的原始节点数上限（默认 0，不保留）
+    """
+
+    def __init__(self, keep_nodes: int = 0) -> None:
+        self.keep_nodes = keep_nodes
+        self.table = RoundTable()
+        self.total = 0
+        self.skipped = 0
+        self.failed = 0
+        # 地区编号 -> 失败节点数
+        self._region_failures: Dict[int, int] = {}
+        self.nodes: List[Dict[str, Any]] = []
+        # 是否为提前判定的部分结果
+        self.partial = False
+        self.expected = 0
+
+    @property
+    def valid_total(self) -> int:
+        """有效节点数（排除格式异常被跳过的节点）。"""
+        return self.total - self.skipped
+
+    def add(self, node: Dict[str, Any]) -> None:
+        """解析并记录一个节点数据。"""
+        self.total += 1
+        if len(self.nodes) < self.keep_nodes:
+            self.nodes.append(node)
+
+        try:
+            row = parse_node(node)
+        except Exception as exc:
+            # 跳过异常节点并记录
+            self.skipped += 1
+            logging.warning("跳过异常节点数据: %s", exc)
+            return
+
+        self.table.append(*row)
+        status, loss, _, region, ip_flag = row
+        if is_failed(status, loss, ip_flag):
+            self.failed += 1
+            self._region_failures[region] = self._region_failures.get(region, 0) + 1
+
+    def failed_isps_regions(self) -> Tuple[Set[int], Set[str]]:
+        """失败节点涉及的运营商ID与地区名称（用于分级检测扩大范围）。"""
+        isps: Set[int] = set()
+        regions: Set[str] = set()
+        table = self.table
+        for status, loss, isp, region, ip_flag in zip(table.status, table.loss, table.isp, table.region, table.ip_flag):
+            if is_failed(status, loss, ip_flag):
+                isps.add(isp)
+                regions.add(region_name(region))
+        return isps, regions
+
+    def decide_early(self, threshold: float, expected: int) -> Optional[bool]:
+        """根据预期节点数判断告警结论是否已无法改变。
+
+        剩余节点按最坏情况推算：全部成功时仍超过阈值、或已有地区达到区域告警
+        规则，则结论为告警；全部失败且集中在同一地区时仍不触发，则结论为正常。
+
+        Returns:
+            True 表示必然告警，False 表示必然不告警，None 表示仍需等待
+        """
+        remaining = max(expected - self.total, 0)
+        max_region = max(self._region_failures.values(), default=0)
+        if max_region >= REGION_ALERT_NODES:
+            return True
+
+        best_total = self.valid_total + remaining
+        if best_total == 0:
+            return None
+        if self.failed / best_total > threshold:
+            return True
+        if (self.failed + remaining) / best_total <= threshold and max_region + remaining < REGION_ALERT_NODES:
+            return False
+        return None
+
+
+def get_stats(results: Optional[Dict[str, Any]]) -> Optional[NodeAggregator]:
+    """从测速结果中取得节点统计。
+
+    客户端流式统计的结果直接返回 results["stats"]；只有原始节点列表
+    results["data"] 的旧格式结果会在此解析一次。结构无效时返回 None。
+    """
+    if not results:
+        return None
+    stats = results.get("stats")
+    if isinstance(stats, NodeAggregator):
+        return stats
+
+    if "data" not in results:
+        return None
+    data = results.get("data", [])
+    # 验证 data 是否为列表
+    if not isinstance(data, list):
+        logging.error("17CE 返回的 data 不是列表类型: %s", type(data))
+        return None
+
+    stats = NodeAggregator()
+    for node in data:
+        stats.add(node)
+    return stats
+
+
+def analyze_round(results: Optional[Dict[str, Any]], threshold: float) -> Dict[str, Any]:
+    """单次遍历列式表，同时得出告警判定与 /check 详情所需的全部统计。
+
+    失败率统一以有效节点数为分母，告警与 /check 两条路径结论始终一致。
+
+    Returns:
+        {
+            "valid": 数据是否有效,
+            "error": 数据无效时的状态描述,
+            "total"/"skipped"/"failed": 节点计数,
+            "fail_rate": 失败率（无效时为 -1.0）,
+            "operators": 失败节点运营商分布,
+            "regions": 失败节点地区分布,
+            "error_types": 异常类型 -> 地区 -> 计数,
+            "should_alert": 是否满足告警条件,
+            "alert_reason": 告警原因描述,
+            "partial": 是否为提前判定的部分结果,
+            "expected": 预期节点数,
+        }
+    """
+    summary: Dict[str, Any] = {
+        "valid": False,
+        "error": "",
+        "total": 0,
+        "skipped": 0,
+        "failed": 0,
+        "fail_rate": -1.0,
+        "operators": {"电信": 0, "联通": 0, "移动": 0, "其他": 0},
+        "regions": {},
+        "error_types": {},
+        "should_alert": False,
+        "alert_reason": "",
+        "partial": False,
+        "expected": 0,
+    }
+
+    # 检查结果是否为空、缺少data字段或 data 不是列表
+    stats = get_stats(results)
+    if stats is None:
+        summary["error"] = "❌ API调用失败" if not results or "data" not in results else "❌ 无检测数据"
+        return summary
+    if stats.total == 0:
+        summary["error"] = "❌ 无检测数据"
+        return summary
+
+    summary["total"] = stats.total
+    summary["skipped"] = stats.skipped
+    summary["partial"] = stats.partial
+    summary["expected"] = stats.expected
+    if stats.valid_total == 0:
+        # 所有节点都被跳过，无法计算失败率
+        summary["error"] = "❌ 节点数据异常"
+        return summary
+
+    table = stats.table
+    operators = summary["operators"]
+    region_counts: Dict[int, int] = {}
+    error_counts: Dict[Tuple[str, int], int] = {}
+    failed = 0
+    for status, loss, isp, region, ip_flag in zip(table.status, table.loss, table.isp, table.region, table.ip_flag):
+        if status == 200 and loss < 100 and ip_flag == IP_NORMAL:
+            continue
+        failed += 1
+        operators[ISP_NAMES.get(isp, "其他")] += 1
+        region_counts[region] = region_counts.get(region, 0) + 1
+        key = (classify_error(status, loss, ip_flag), region)
+        error_counts[key] = error_counts.get(key, 0) + 1
+
+    regions = {region_name(r): count for r, count in region_counts.items()}
+    error_types: Dict[str, Dict[str, int]] = {}
+    for (error_type, region), count in error_counts.items():
+        error_types.setdefault(error_type, {})[region_name(region)] = count
+
+    fail_rate = failed / stats.valid_total
+    summary.update({
+        "valid": True,
+        "failed": failed,
+        "fail_rate": fail_rate,
+        "regions": regions,
+        "error_types": error_types,
+    })
+
+    # 检查是否需要告警（满足任一条件即可）
+    # 条件1：全国失败率超过阈值
+    if fail_rate > threshold:
+        summary["should_alert"] = True
+        summary["alert_reason"] = f"全国失败率 {fail_rate:.2%} > 阈值 {threshold:.2%}"
+    else:
+        # 条件2：单地区失败节点数 >= 3
+        for region, count in regions.items():
+            if count >= REGION_ALERT_NODES:
+                summary["should_alert"] = True
+                summary["alert_reason"] = f"{region} 失败 {count} 个节点（≥{REGION_ALERT_NODES}）"
+                break
+    return summary
+
+
+def status_label(fail_rate: float) -> str:
+    """按失败率生成 /check 状态描述。"""
+    if fail_rate >= ERROR_RATE:
+        return "❌ 异常"
+    if fail_rate >= WARNING_RATE:
+        return "⚠️ 警告"
+    return "✅ 正常"
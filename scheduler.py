@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# 按站点自适应的定时检测调度器
+# 每个站点独立排期（优先队列），开始时间按站点错开并加入随机抖动；
+# 站点异常期间自动缩短检测间隔，恢复后回到正常间隔
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from site_store import normalize_url
+# 站点结论（与 status_store 一致）
+from status_store import VERDICT_ALERT, VERDICT_API_FAILED
+
+DEFAULT_INTERVAL_MINUTES = 60          # 正常站点检测间隔（分钟）
+DEFAULT_DEGRADED_INTERVAL_MINUTES = 10  # 异常站点检测间隔（分钟）
+DEFAULT_JITTER_SECONDS = 60            # 每次排期的随机抖动范围（±秒）
+# 默认检测时段：工作日 9:00-11:59、13:00-17:59，周末 10:00-10:59
+DEFAULT_WINDOWS = {
+    "weekday": ["09:00-12:00", "13:00-18:00"],
+    "weekend": ["10:00-11:00"],
+}
+RESYNC_SECONDS = 60    # 最长休眠时间，到期后重新读取站点列表与调度配置
+BATCH_WINDOW = 5       # 到期时间相差不超过该秒数的站点合并为同一批检测
+
+DEGRADED_VERDICTS = (VERDICT_ALERT, VERDICT_API_FAILED)
+
+
+def _parse_hhmm(text: str) -> int:
+    """解析 "HH:MM" 为当天分钟数（允许 24:00）。"""
+    hour, minute = text.strip().split(":")
+    value = int(hour) * 60 + int(minute)
+    if not 0 <= value <= 24 * 60:
+        raise ValueError(text)
+    return value
+
+
+def _parse_windows(raw: Any) -> List[Tuple[int, int]]:
+    """解析 ["09:00-12:00", ...] 为 [(起始分钟, 结束分钟)]，忽略格式错误的时段。"""
+    windows: List[Tuple[int, int]] = []
+    if not isinstance(raw, list):
+        return windows
+    for item in raw:
+        try:
+            start_text, end_text = str(item).split("-")
+            start, end = _parse_hhmm(start_text), _parse_hhmm(end_text)
+        except ValueError:
+            logging.warning("检测时段格式错误，已忽略: %r", item)
+            continue
+        if start < end:
+            windows.append((start, end))
+    return sorted(windows)
+
+
+class ScheduleConfig:
+    """从配置 schedule 字段解析出的调度参数。
+
+    配置示例::
+
+        "schedule": {
+            "interval_minutes": 60,
+            "degraded_interval_minutes": 10,
+            "jitter_seconds": 60,
+            "windows": {"weekday": ["09:00-12:00", "13:00-18:00"], "weekend": ["10:00-11:00"]}
+        }
+
+    windows 为空对象时全天检测；站点条目中的 interval_minutes 可覆盖默认间隔。
+    """
+
+    def __init__(self, config: Dict[str, Any]) -> None:
+        raw = config.get("schedule", {})
+        if not isinstance(raw, dict):
+            logging.error("配置中的 schedule 不是字典类型，使用默认调度")
+            raw = {}
+        self.interval = self._minutes(raw, "interval_minutes", DEFAULT_INTERVAL_MINUTES) * 60
+        self.degraded_interval = self._minutes(raw, "degraded_interval_minutes", DEFAULT_DEGRADED_INTERVAL_MINUTES) * 60
+        try:
+            self.jitter = max(float(raw.get("jitter_seconds", DEFAULT_JITTER_SECONDS)), 0.0)
+        except (ValueError, TypeError):
+            self.jitter = float(DEFAULT_JITTER_SECONDS)
+
+        windows = raw.get("windows", DEFAULT_WINDOWS)
+        if not isinstance(windows, dict):
+            windows = DEFAULT_WINDOWS
+        # 0-6 对应周一至周日；两类均未配置时表示全天检测
+        weekday = _parse_windows(windows.get("weekday", []))
+        weekend = _parse_windows(windows.get("weekend", []))
+        self.all_day = not weekday and not weekend
+        self.windows: Dict[int, List[Tuple[int, int]]] = {
+            day: (weekday if day < 5 else weekend) for day in range(7)
+        }
+
+    @staticmethod
+    def _minutes(raw: Dict[str, Any], key: str, default: int) -> float:
+        try:
+            value = float(raw.get(key, default))
+        except (ValueError, TypeError):
+            logging.warning("调度配置 %s 解析失败，使用默认值 %s", key, default)
+            return float(default)
+        if value <= 0:
+            logging.warning("调度配置 %s 必须大于 0，使用默认值 %s", key, default)
+            return float(default)
+        return value
+
+    def site_interval(self, site: Dict[str, Any], degraded: bool) -> float:
+        """站点的检测间隔（秒）。"""
+        if degraded:
+            return self.degraded_interval
+        override = site.get("interval_minutes")
+        if override is not None:
+            try:
+                value = float(override)
+                if value > 0:
+                    return value * 60
+            except (ValueError, TypeError):
+                pass
+        return self.interval
+
+    def probes_per_day(self, interval: float) -> float:
+        """按检测时段与间隔估算单个站点平均每天的检测次数（每个时段至少一次）。"""
+        if self.all_day:
+            return 86400 / interval
+        total = 0.0
+        for day in range(7):
+            for start, end in self.windows[day]:
+                total += max((end - start) * 60 / interval, 1.0)
+        return total / 7
+
+    def next_active(self, ts: float) -> Tuple[float, float]:
+        """返回 ts 之后（含）最近的可检测时刻及其所在时段长度（秒）。
+
+        ts 已在检测时段内时原样返回；7 天内都没有可用时段时按全天处理。
+        """
+        if self.all_day:
+            return ts, 0.0
+        local = time.localtime(ts)
+        day_start = ts - (local.tm_hour * 3600 + local.tm_min * 60 + local.tm_sec)
+        minute = local.tm_hour * 60 + local.tm_min
+        for offset in range(8):
+            weekday = (local.tm_wday + offset) % 7
+            for start, end in self.windows[weekday]:
+                if offset == 0 and minute >= end:
+                    continue
+                if offset == 0 and minute >= start:
+                    return ts, (end - start) * 60
+                # 夏令时切换日的偏差在下一次排期时自动修正
+                return day_start + offset * 86400 + start * 60, (end - start) * 60
+        return ts, 0.0
+
+
+class _Entry:
+    """调度队列中的单个站点。"""
+
+    __slots__ = ("key", "site", "due", "degraded", "running", "version")
+
+    def __init__(self, key: str, site: Dict[str, Any], due: float) -> None:
+        self.key = key
+        self.site = site
+        self.due = due
+        self.degraded = False
+        self.running = False
+        self.version = 0
+
+    @property
+    def target(self) -> str:
+        """检测目标（标准化URL），同一网址的站点排期相位相同，落在同一批检测。"""
+        return normalize_url(self.site.get("url", ""))
+
+
+class SiteScheduler:
+    """按站点排期的调度器：优先队列按到期时间弹出站点，到期站点合并为一批检测。
+
+    Args:
+        run_batch: 检测一批站点的协程，返回 {站点名称: 结论}
+        load: 返回 (当前站点列表, 配置字典)，每次唤醒时在线程池中调用以同步增删的站点
+        load_states: 返回 {站点名称: {"verdict", ...}} 的已保存状态，启动时在线程池中调用一次，
+            上次结论为异常的站点沿用异常间隔（重启后不会丢失异常复查状态）
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[Dict[str, Any]]], Awaitable[Dict[str, str]]],
+        load: Callable[[], Tuple[List[Dict[str, Any]], Dict[str, Any]]],
+        load_states: Optional[Callable[[], Dict[str, Dict[str, Any]]]] = None,
+    ) -> None:
+        self._run_batch = run_batch
+        self._load = load
+        self._load_states = load_states
+        self._entries: Dict[str, _Entry] = {}
+        # (到期时间, 序号, 站点名称, 版本)，站点重新排期或被删除后旧记录惰性丢弃
+        self._heap: List[Tuple[float, int, str, int]] = []
+        self._seq = itertools.count()
+        self._tasks: Set[asyncio.Task] = set()
+        # 一批检测完成、站点重新排期后唤醒主循环
+        self._wakeup: Optional[asyncio.Event] = None
+        self.config = ScheduleConfig({})
+
+    def _push(self, entry: _Entry, due: float) -> None:
+        entry.due = due
+        entry.version += 1
+        heapq.heappush(self._heap, (due, next(self._seq), entry.key, entry.version))
+
+    @staticmethod
+    def _stagger(key: str, span: float) -> float:
+        """检测目标决定的固定偏移，使各站点在间隔内均匀错开。"""
+        if span <= 0:
+            return 0.0
+        return zlib.crc32(key.encode("utf-8")) % int(span)
+
+    def _place(self, entry: _Entry, ts: float) -> float:
+        """把排期时间调整到检测时段内；顺延到下一时段时按站点错开开始时间。"""
+        active, window = self.config.next_active(ts)
+        if active > ts:
+            span = min(window, self.config.site_interval(entry.site, entry.degraded))
+            active += self._stagger(entry.target, span)
+        return active
+
+    async def sync(self, initial: bool = False) -> None:
+        """同步站点列表与调度配置：新站点加入队列，已删除的站点移出。
+
+        load 会读取 SQLite 站点存储，放到线程池中执行，不阻塞与 Bot 共用的事件循环。
+        initial 为 True（启动时）时所有站点立即检测一次，之后按各自间隔错开；
+        此时同时读取已保存的站点状态，恢复各站点的异常复查标记。
+        """
+        sites, config = await asyncio.to_thread(self._load)
+        states: Optional[Dict[str, Dict[str, Any]]] = None
+        if initial and self._load_states is not None:
+            try:
+                states = await asyncio.to_thread(self._load_states)
+            except Exception as exc:
+                logging.warning("读取站点状态失败，异常复查标记从零开始: %s", exc)
+        self.apply(sites, config, initial, states)
+
+    def apply(
+        self,
+        sites: List[Dict[str, Any]],
+        config: Dict[str, Any],
+        initial: bool = False,
+        states: Optional[Dict[str, Dict[str, Any]]] = None,
+    ) -> None:
+        """按已读取的站点列表与配置更新调度队列（见 sync），states 为已保存的站点状态。"""
+        self.config = ScheduleConfig(config)
+        now = time.time()
+
+        current: Dict[str, Dict[str, Any]] = {}
+        for site in sites:
+            if site.get("url"):
+                current[site.get("name") or site["url"]] = site
+
+        for key in list(self._entries):
+            if key not in current:
+                del self._entries[key]
+
+        for key, site in current.items():
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.site = site
+                continue
+            entry = _Entry(key, site, now)
+            if states:
+                entry.degraded = (states.get(key) or {}).get("verdict") in DEGRADED_VERDICTS
+                if entry.degraded:
+                    logging.info("站点 %s 上次检测异常，沿用异常检测间隔", key)
+            self._entries[key] = entry
+            if initial:
+                self._push(entry, now)
+            else:
+                # 新增站点在当前间隔内按检测目标错开，避免同时开始
+                interval = self.config.site_interval(site, False)
+                self._push(entry, self._place(entry, now + self._stagger(entry.target, interval)))
+
+    def reschedule(self, entry: _Entry, verdict: Optional[str]) -> None:
+        """根据本次结论安排下一次检测：异常时缩短间隔，恢复后回到正常间隔。"""
+        if verdict is not None:
+            degraded = verdict in DEGRADED_VERDICTS
+            if degraded and not entry.degraded:
+                logging.warning("站点 %s 进入异常复查，检测间隔缩短为 %.0f 分钟", entry.key, self.config.degraded_interval / 60)
+            elif entry.degraded and not degraded:
+                logging.info("站点 %s 已恢复，回到正常检测间隔", entry.key)
+            entry.degraded = degraded
+
+        now = time.time()
+        interval = self.config.site_interval(entry.site, entry.degraded)
+        # 每个站点在间隔内有固定相位，即使同批检测，下一次也会分散到整个间隔内
+        base = now + interval
+        due = base - ((base - self._stagger(entry.target, interval)) % interval)
+        if due < now + interval / 2:
+            due += interval
+        # 抖动由检测目标与排期时间决定，同一网址的站点抖动相同，仍合并检测
+        rng = random.Random(f"{entry.target}:{int(due)}")
+        jitter = rng.uniform(-self.config.jitter, self.config.jitter) if self.config.jitter else 0.0
+        # 抖动不超过间隔的四分之一，避免间隔很短时排期倒退
+        jitter = max(min(jitter, interval / 4), -interval / 4)
+        self._push(entry, self._place(entry, due + jitter))
+
+    def pop_due(self, now: float) -> List[_Entry]:
+        """弹出已到期（含 BATCH_WINDOW 内即将到期）的站点。"""
+        batch: List[_Entry] = []
+        while self._heap and self._heap[0][0] <= now + BATCH_WINDOW:
+            _, _, key, version = heapq.heappop(self._heap)
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version or entry.running:
+                continue
+            entry.running = True
+            batch.append(entry)
+        return batch
+
+    def next_due(self) -> Optional[float]:
+        """队列中最早的到期时间（跳过已失效的记录）。"""
+        while self._heap:
+            _, _, key, version = self._heap[0]
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version and not entry.running:
+                return self._heap[0][0]
+            heapq.heappop(self._heap)
+        return None
+
+    async def _run(self, batch: List[_Entry]) -> None:
+        verdicts: Dict[str, str] = {}
+        try:
+            verdicts = await self._run_batch([entry.site for entry in batch])
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logging.error("定时检测执行失败: %s", exc, exc_info=True)
+        finally:
+            for entry in batch:
+                entry.running = False
+                if self._entries.get(entry.key) is entry:
+                    self.reschedule(entry, verdicts.get(entry.site.get("name", "")))
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    async def run(self) -> None:
+        """调度主循环：休眠到最近的到期时间（最长 RESYNC_SECONDS），无需逐秒轮询。"""
+        self._wakeup = asyncio.Event()
+        await self.sync(initial=True)
+        try:
+            while True:
+                self._wakeup.clear()
+                try:
+                    await self.sync()
+                    now = time.time()
+                    batch = self.pop_due(now)
+                    if batch:
+                        logging.info("定时检测 %d 个到期站点", len(batch))
+                        task = asyncio.create_task(self._run(batch))
+                        self._tasks.add(task)
+                        task.add_done_callback(self._tasks.discard)
+                    next_due = self.next_due()
+                    delay = RESYNC_SECONDS if next_due is None else min(max(next_due - time.time(), 0.0), RESYNC_SECONDS)
+                except Exception as exc:
+                    # 捕获异常但继续运行，避免调度停止
+                    logging.error("定时任务调度异常: %s", exc, exc_info=True)
+                    delay = RESYNC_SECONDS
+                # asyncio.wait 不会吞掉与唤醒同时到达的取消（wait_for 在 Python 3.11 中会）
+                waiter = asyncio.ensure_future(self._wakeup.wait())
+                try:
+                    await asyncio.wait({waiter}, timeout=delay)
+                finally:
+                    waiter.cancel()
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# 站点存储与匹配
+# 站点名称/URL 处理工具，以及可选的 SQLite（WAL）站点存储
+
+import logging
+import os
+import re
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, List, Set
+
+DEFAULT_DB_FILE = "data/teleping.db"
+BUSY_TIMEOUT_MS = 30000  # 多进程写冲突时的等待时间（毫秒）
+
+_SCHEME_RE = re.compile(r'^https?://')
+_WWW_RE = re.compile(r'^www\.')
+
+
+def extract_domain_from_url(url: str) -> str:
+    """从URL中提取域名作为站点名称。
+
+    示例:
+        https://www.example.com → example.com
+        https://www.example.com/path → example.com
+        www.example.com → example.com
+        example.com → example.com
+    """
+    # 移除协议前缀
+    url = _SCHEME_RE.sub('', url)
+    # 移除路径和参数
+    url = url.split('/')[0].split('?')[0].split('#')[0]
+    # 移除端口
+    url = url.split(':')[0]
+    # 移除 www. 前缀
+    url = _WWW_RE.sub('', url)
+    return url.strip()
+
+
+def normalize_url(url: str) -> str:
+    """标准化URL，确保有协议前缀。
+
+    Args:
+        url: 原始URL（可能没有协议）
+
+    Returns:
+        标准化的URL（确保有https://协议）
+
+    示例:
+        www.example.com → https://www.example.com
+        example.com → https://example.com
+        https://example.com → https://example.com
+    """
+    url = url.strip()
+    if not url.startswith(('http://', 'https://')):
+        url = f'https://{url}'
+    return url
+
+
+class NameAllocator:
+    """批量分配唯一站点名称：名称未被占用时直接使用，否则依次添加编号（example.com、example.com-2 ...）。
+
+    维护现有名称集合与每个基础名称下一个待尝试的编号，批量导入时总耗时与URL数量呈线性关系，
+    不会为每个URL重建名称集合或从 2 开始重新扫描编号。
+
+    Args:
+        names: 已存在的站点名称
+    """
+
+    def __init__(self, names: Iterable[str] = ()) -> None:
+        self._names: Set[str] = set(names)
+        # 基础名称 -> 下一个待尝试的编号（只增不减：名称只会被占用，最小空闲编号不会变小）
+        self._next_suffix: Dict[str, int] = {}
+
+    def add_names(self, names: Iterable[str]) -> None:
+        """登记已存在的名称。"""
+        self._names.update(names)
+
+    def allocate(self, base_name: str) -> str:
+        """分配一个唯一名称并登记为已占用。"""
+        if base_name not in self._names:
+            name = base_name
+        else:
+            counter = self._next_suffix.get(base_name, 2)
+            while f"{base_name}-{counter}" in self._names:
+                counter += 1
+            self._next_suffix[base_name] = counter + 1
+            name = f"{base_name}-{counter}"
+        self._names.add(name)
+        return name
+
+
+class SiteIndex:
+    """站点匹配索引：名称、URL、域名精确映射，以及 name-N 后缀规则的前缀映射。
+
+    输入（完整URL、带 www 的域名、纯域名或站点名称）与站点匹配的条件：
+    域名相同、URL 完全相同、名称相同，或名称为 "{输入域名}-..."（如 example.com-2）。
+    每个输入只需常数次查表，批量删除的耗时与输入数量近似线性，而不是 站点数 × 输入数。
+
+    Args:
+        sites: 站点列表，索引值为站点在列表中的下标
+    """
+
+    def __init__(self, sites: List[Dict[str, Any]]) -> None:
+        self.by_name: Dict[str, List[int]] = {}
+        self.by_url: Dict[str, List[int]] = {}
+        self.by_domain: Dict[str, List[int]] = {}
+        # 名称中每个 "-" 之前的前缀 -> 站点下标，用于匹配 name.startswith(f"{domain}-")
+        self.by_prefix: Dict[str, List[int]] = {}
+
+        for idx, site in enumerate(sites):
+            if not isinstance(site, dict):
+                continue
+            name = site.get("name", "")
+            url = site.get("url", "")
+            self.by_name.setdefault(name, []).append(idx)
+            self.by_url.setdefault(url, []).append(idx)
+            self.by_domain.setdefault(extract_domain_from_url(url), []).append(idx)
+            seen: Set[str] = set()
+            pos = name.find("-")
+            while pos != -1:
+                prefix = name[:pos]
+                if prefix not in seen:
+                    seen.add(prefix)
+                    self.by_prefix.setdefault(prefix, []).append(idx)
+                pos = name.find("-", pos + 1)
+
+    def match(self, url_or_domain: str) -> Set[int]:
+        """返回与输入匹配的站点下标（规则见类说明）。"""
+        input_domain = extract_domain_from_url(url_or_domain)
+        matched: Set[int] = set()
+        matched.update(self.by_domain.get(input_domain, ()))
+        matched.update(self.by_url.get(url_or_domain, ()))
+        matched.update(self.by_name.get(url_or_domain, ()))
+        matched.update(self.by_prefix.get(input_domain, ()))
+        return matched
+
+    def match_any(self, items: List[str]) -> Set[int]:
+        """返回与任一输入匹配的站点下标。"""
+        matched: Set[int] = set()
+        for item in items:
+            matched |= self.match(item)
+        return matched
+
+
+def _glob_escape(text: str) -> str:
+    """转义 GLOB 通配符，使其按字面匹配。"""
+    return "".join(f"[{ch}]" if ch in "*?[" else ch for ch in text)
+
+
+def connect_db(path: str, autocommit: bool = False) -> sqlite3.Connection:
+    """打开 SQLite 连接（设置忙等待超时，行以 sqlite3.Row 返回）。
+
+    autocommit 为 True 时（isolation_level=None）事务由 BEGIN IMMEDIATE / COMMIT 显式控制。
+    站点存储、站点状态表与积分流水共用该连接设置。
+    """
+    if autocommit:
+        conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    else:
+        conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def init_db(path: str, schema: str) -> None:
+    """创建数据库所在目录，启用 WAL 模式并执行建表语句。"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = connect_db(path)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(schema)
+    finally:
+        conn.close()
+
+
+class SqliteSiteStore:
+    """基于 SQLite（WAL 模式）的站点存储。
+
+    - name / norm_url / domain 建有索引，匹配查询无需遍历全部站点
+    - 增删为行级事务（BEGIN IMMEDIATE），多个进程共享同一数据库文件时也不会互相覆盖
+    - 首次启用时从 config.json 的 sites 数组一次性迁移
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_FILE) -> None:
+        self.path = path
+        init_db(
+            path,
+            """
+            CREATE TABLE IF NOT EXISTS sites (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE,
+                url TEXT NOT NULL,
+                norm_url TEXT NOT NULL,
+                domain TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sites_norm_url ON sites(norm_url);
+            CREATE INDEX IF NOT EXISTS idx_sites_domain ON sites(domain);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """,
+        )
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, name: str, url: str) -> None:
+        conn.execute(
+            "INSERT INTO sites (name, url, norm_url, domain, created_at) VALUES (?, ?, ?, ?, ?)",
+            (name, url, normalize_url(url), extract_domain_from_url(url), time.time()),
+        )
+
+    @staticmethod
+    def _existing_names(conn: sqlite3.Connection, base_name: str) -> List[str]:
+        """查询可能与基础名称冲突的现有名称（base 与 base-*）。"""
+        rows = conn.execute(
+            "SELECT name FROM sites WHERE name = ? OR name GLOB ?",
+            (base_name, _glob_escape(base_name) + "-*"),
+        ).fetchall()
+        return [row["name"] for row in rows]
+
+    def _allocate_name(self, conn: sqlite3.Connection, base_name: str) -> str:
+        """在事务内按 NameAllocator 的规则分配唯一名称。"""
+        return NameAllocator(self._existing_names(conn, base_name)).allocate(base_name)
+
+    def migrate_from_config(self, sites: List[Dict[str, Any]]) -> int:
+        """将 config.json 中的站点一次性迁移到数据库，已迁移过则跳过。
+
+        Returns:
+            本次迁移的站点数
+        """
+        conn = connect_db(self.path, autocommit=True)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+                conn.execute("ROLLBACK")
+                return 0
+            migrated = 0
+            for site in sites:
+                if not isinstance(site, dict):
+                    continue
+                url = str(site.get("url", ""))
+                name = str(site.get("name", "")) or extract_domain_from_url(url)
+                if not url:
+                    continue
+                if conn.execute("SELECT 1 FROM sites WHERE name = ?", (name,)).fetchone():
+                    name = self._allocate_name(conn, name)
+                self._insert(conn, name, url)
+                migrated += 1
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('migrated', ?)",
+                (time.strftime('%Y-%m-%d %H:%M:%S'),),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        logging.info("站点已从 config.json 迁移到 SQLite: %d 个", migrated)
+        return migrated
+
+    def list_sites(self) -> List[Dict[str, str]]:
+        """按添加顺序返回全部站点。"""
+        conn = connect_db(self.path, autocommit=True)
+        try:
+            rows = conn.execute("SELECT name, url FROM sites ORDER BY id").fetchall()
+        finally:
+            conn.close()
+        return [{"name": row["name"], "url": row["url"]} for row in rows]
+
+    def add_sites(self, urls: List[str]) -> List[Dict[str, str]]:
+        """在一个事务中批量添加站点，名称从URL提取域名并自动编号去重。
+
+        Returns:
+            新增的站点列表
+        """
+        added: List[Dict[str, str]] = []
+        allocator = NameAllocator()
+        # 每个基础名称只查询一次现有名称
+        seeded: Set[str] = set()
+        conn = connect_db(self.path, autocommit=True)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for url in urls:
+                if not url:
+                    continue
+                base_name = extract_domain_from_url(url)
+                if base_name not in seeded:
+                    seeded.add(base_name)
+                    allocator.add_names(self._existing_names(conn, base_name))
+                name = allocator.allocate(base_name)
+                self._insert(conn, name, url)
+                added.append({"name": name, "url": url})
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return added
+
+    def delete_matching(self, items: List[str]) -> List[Dict[str, str]]:
+        """在一个事务中删除与任一输入匹配的站点（规则同 SiteIndex.match）。
+
+        Returns:
+            被删除的站点列表（按添加顺序）
+        """
+        conn = connect_db(self.path, autocommit=True)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            matched: Dict[int, Dict[str, str]] = {}
+            for item in items:
+                domain = extract_domain_from_url(item)
+                # URL 完全相同的站点 norm_url 必然相同；各条件都走索引（MULTI-INDEX OR），不扫描全表
+                rows = conn.execute(
+                    "SELECT id, name, url FROM sites "
+                    "WHERE domain = ? OR norm_url = ? OR name = ? OR name GLOB ?",
+                    (domain, normalize_url(item), item, _glob_escape(domain) + "-*"),
+                ).fetchall()
+                for row in rows:
+                    matched[row["id"]] = {"name": row["name"], "url": row["url"]}
+            conn.executemany("DELETE FROM sites WHERE id = ?", [(site_id,) for site_id in matched])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return [matched[site_id] for site_id in sorted(matched)]
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# 站点最近状态存储
+# 定时检测每完成一个站点即写入其最近结论，/status 直接读取，无需调用 17CE
+
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+from site_store import DEFAULT_DB_FILE, connect_db, init_db
+
+# 站点结论
+VERDICT_NORMAL = "normal"
+VERDICT_ALERT = "alert"
+VERDICT_API_FAILED = "api_failed"
+
+TOP_REGIONS = 3  # 每个站点保存的失败地区数
+
+# 早期版本的数据库缺少的列（启动时补齐）
+_ADDED_COLUMNS = {
+    "nodes": "INTEGER",                        # 失败率对应的节点数
+    "expected": "INTEGER",                     # 预期节点数
+    "partial": "INTEGER NOT NULL DEFAULT 0",   # 是否为提前判定的部分结果
+}
+
+
+class SiteStatusStore:
+    """基于 SQLite（WAL 模式）的站点最近状态表，按站点名称逐条更新，重启后保留。
+
+    与 SqliteSiteStore 可共用同一个数据库文件（表名 site_status）。
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_FILE) -> None:
+        self.path = path
+        init_db(
+            path,
+            """
+            CREATE TABLE IF NOT EXISTS site_status (
+                name TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                verdict TEXT NOT NULL,
+                fail_rate REAL,
+                top_regions TEXT NOT NULL,
+                reason TEXT NOT NULL,
+                checked_at REAL NOT NULL,
+                nodes INTEGER,
+                expected INTEGER,
+                partial INTEGER NOT NULL DEFAULT 0
+            )
+            """,
+        )
+        conn = connect_db(path)
+        try:
+            existing = {row["name"] for row in conn.execute("PRAGMA table_info(site_status)")}
+            with conn:
+                for column, definition in _ADDED_COLUMNS.items():
+                    if column not in existing:
+                        conn.execute(f"ALTER TABLE site_status ADD COLUMN {column} {definition}")
+        finally:
+            conn.close()
+
+    def record(
+        self,
+        name: str,
+        url: str,
+        verdict: str,
+        fail_rate: Optional[float] = None,
+        regions: Optional[Dict[str, int]] = None,
+        reason: str = "",
+        nodes: Optional[int] = None,
+        expected: Optional[int] = None,
+        partial: bool = False,
+        checked_at: Optional[float] = None,
+    ) -> None:
+        """写入单个站点的最近检测结论（覆盖旧记录）。
+
+        partial 为 True 时 fail_rate 只覆盖提前判定前收到的 nodes 个节点（预期 expected 个）。
+        """
+        top_regions = sorted((regions or {}).items(), key=lambda x: x[1], reverse=True)[:TOP_REGIONS]
+        conn = connect_db(self.path)
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO site_status "
+                    "(name, url, verdict, fail_rate, top_regions, reason, checked_at, nodes, expected, partial) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        name,
+                        url,
+                        verdict,
+                        fail_rate,
+                        json.dumps(top_regions, ensure_ascii=False),
+                        reason,
+                        checked_at if checked_at is not None else time.time(),
+                        nodes,
+                        expected,
+                        int(partial),
+                    ),
+                )
+        except sqlite3.Error as exc:
+            logging.error("保存站点 %s 状态失败: %s", name, exc)
+        finally:
+            conn.close()
+
+    def delete(self, names: List[str]) -> None:
+        """删除站点的状态记录（站点被删除时调用，同名站点重新添加后不会沿用旧结论）。"""
+        if not names:
+            return
+        conn = connect_db(self.path)
+        try:
+            with conn:
+                conn.executemany("DELETE FROM site_status WHERE name = ?", [(name,) for name in names])
+        except sqlite3.Error as exc:
+            logging.error("删除站点状态失败: %s", exc)
+        finally:
+            conn.close()
+
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        """读取全部站点的最近状态。
+
+        Returns:
+            {站点名称: {"url", "verdict", "fail_rate", "top_regions": [(地区, 节点数)], "reason", "checked_at",
+                        "nodes", "expected", "partial"}}
+        """
+        conn = connect_db(self.path)
+        try:
+            rows = conn.execute("SELECT * FROM site_status").fetchall()
+        finally:
+            conn.close()
+
+        states: Dict[str, Dict[str, Any]] = {}
+        for row in rows:
+            try:
+                top_regions: List[Any] = json.loads(row["top_regions"])
+            except ValueError:
+                top_regions = []
+            states[row["name"]] = {
+                "url": row["url"],
+                "verdict": row["verdict"],
+                "fail_rate": row["fail_rate"],
+                "top_regions": [(region, count) for region, count in top_regions],
+                "reason": row["reason"],
+                "checked_at": row["checked_at"],
+                "nodes": row["nodes"],
+                "expected": row["expected"],
+                "partial": bool(row["partial"]),
+            }
+        return states
@@ -4,6 +4,7 @@
 import json
 from monitor import call_17ce_api, load_config
 from city_nodes_config import get_node_config
+from probe_client import node_counts
 
 def test_node_count():
     """测试实际返回的节点数"""
@@ -24,15 +25,15 @@ def test_node_count():
     print("\n⏳ 正在调用17CE API...")
 
     # 调用API
-    results = call_17ce_api(test_url, config)
+    results = call_17ce_api(test_url, config, keep_nodes=5)
 
     if results is None:
         print("\n❌ API调用失败")
         return
 
-    # 分析结果
+    # 分析结果（节点数来自流式统计，data 仅保留前5个原始节点）
     data = results.get("data", [])
-    node_count = len(data)
+    node_count = results["stats"].total
 
     print(f"\n" + "=" * 60)
     print(f"✅ 测试完成！")
@@ -64,6 +65,9 @@ def test_node_count():
           f"{len(node_config.get('nodetype', []))}类型 × "
           f"num={node_config.get('num', 1)}")
 
+    learned = node_counts.expected(node_config)
+    print(f"\n🧠 客户端学习到的预期节点数: {learned if learned else '尚未学习'}")
+
     if node_count > theory_count:
         print(f"\n⚠️  实际节点数({node_count}) > 理论值({theory_count})")
         print(f"   差值: {node_count - theory_count} 个")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""测试脚本：在本机启动 Webhook 服务，验证 Update 入队、secret token 校验与请求方法限制"""
+
+import asyncio
+import json
+
+import httpx
+from telegram import Bot, Update
+
+from webhook_server import WebhookServer, WebhookSettings
+
+LISTEN = "127.0.0.1"
+PORT = 18443
+PATH = "/telegram"
+SECRET = "teleping-test-secret"
+
+UPDATE = {
+    "update_id": 10001,
+    "message": {
+        "message_id": 1,
+        "date": 1700000000,
+        "chat": {"id": 123456, "type": "private"},
+        "from": {"id": 123456, "is_bot": False, "first_name": "test"},
+        "text": "/status",
+    },
+}
+
+
+class _FakeApplication:
+    """只提供 WebhookServer 用到的 bot 与 update_queue。"""
+
+    def __init__(self) -> None:
+        self.bot = Bot("123456:TEST")
+        self.update_queue: "asyncio.Queue[Update]" = asyncio.Queue()
+
+
+async def _run() -> None:
+    application = _FakeApplication()
+    settings = WebhookSettings({
+        "webhook": {
+            "url": f"https://bot.example.com{PATH}",
+            "listen": LISTEN,
+            "port": PORT,
+            "secret_token": SECRET,
+        }
+    })
+    server = WebhookServer(application, settings)
+    await server.start()
+    try:
+        async with httpx.AsyncClient(base_url=f"http://{LISTEN}:{PORT}") as client:
+            # 正确的 secret token：200，Update 进入队列
+            response = await client.post(PATH, content=json.dumps(UPDATE), headers={
+                "Content-Type": "application/json",
+                "X-Telegram-Bot-Api-Secret-Token": SECRET,
+            })
+            assert response.status_code == 200, response.status_code
+            update = application.update_queue.get_nowait()
+            assert isinstance(update, Update)
+            assert update.update_id == UPDATE["update_id"]
+            assert update.message.text == "/status"
+            print("✅ 正确 token: 200，Update 已入队")
+
+            # 错误的 secret token：403，不入队
+            response = await client.post(PATH, content=json.dumps(UPDATE), headers={
+                "Content-Type": "application/json",
+                "X-Telegram-Bot-Api-Secret-Token": "wrong",
+            })
+            assert response.status_code == 403, response.status_code
+            assert application.update_queue.empty()
+            print("✅ 错误 token: 403")
+
+            # GET 请求：405
+            response = await client.get(PATH, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+            assert response.status_code == 405, response.status_code
+            assert application.update_queue.empty()
+            print("✅ GET 请求: 405")
+    finally:
+        await server.close()
+
+    assert server.received == 1
+    assert server.rejected == 2
+
+
+def test_webhook_server():
+    """测试 Webhook 服务的请求处理"""
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    test_webhook_server()
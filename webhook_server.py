@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# Telegram Webhook 接收服务
+# 基于 asyncio 的最小 HTTP/1.1 服务：校验 secret token 后把 Update 放入 Application 的更新队列，
+# 由 Bot 与其他更新一样并发处理；不依赖 python-telegram-bot 的 webhooks 扩展（tornado）
+
+import asyncio
+import hmac
+import json
+import logging
+import secrets
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from telegram import Update
+
+DEFAULT_LISTEN = "0.0.0.0"
+DEFAULT_PORT = 8443
+MAX_BODY_BYTES = 1024 * 1024   # 单个请求体上限（Telegram 的 Update 远小于该值）
+MAX_HEADER_BYTES = 16 * 1024   # 请求头总长度上限
+IDLE_TIMEOUT = 75              # 长连接空闲超时（秒）
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    431: "Request Header Fields Too Large",
+    501: "Not Implemented",
+}
+
+
+class WebhookSettings:
+    """配置 webhook 字段解析出的 Webhook 参数，未配置 url 或 enabled 为 false 时不启用。
+
+    配置示例::
+
+        "webhook": {
+            "enabled": true,
+            "url": "https://bot.example.com/telegram",  # Telegram 推送的公网地址（反向代理到本服务）
+            "listen": "0.0.0.0",                       # 本地监听地址
+            "port": 8443,                              # 本地监听端口
+            "path": "/telegram",                       # 本地路径，默认取 url 的路径
+            "secret_token": "随机字符串"                # 校验请求头，未配置时每次启动随机生成
+        }
+    """
+
+    def __init__(self, config: Dict[str, Any]) -> None:
+        raw = config.get("webhook", {})
+        if not isinstance(raw, dict):
+            logging.error("配置中的 webhook 不是字典类型，已忽略")
+            raw = {}
+        self.url = str(raw.get("url") or "")
+        self.enabled = bool(self.url) and bool(raw.get("enabled", True))
+        self.listen = str(raw.get("listen") or DEFAULT_LISTEN)
+        try:
+            self.port = int(raw.get("port", DEFAULT_PORT))
+        except (ValueError, TypeError):
+            logging.warning("Webhook 配置 port=%r 解析失败，使用默认值 %s", raw.get("port"), DEFAULT_PORT)
+            self.port = DEFAULT_PORT
+        self.path = str(raw.get("path") or urlsplit(self.url).path or "/")
+        # Telegram 只接受 1-256 个 A-Z a-z 0-9 _ - 字符
+        self.secret_token = str(raw.get("secret_token") or secrets.token_urlsafe(32))
+
+
+class WebhookServer:
+    """接收 Telegram 推送的 Update，放入 application.update_queue。
+
+    只接受 POST settings.path 且 secret token 正确的请求；支持 HTTP/1.1 长连接，
+    请求之间互不阻塞，Update 由 Application 按 concurrent_updates 并发处理。
+    """
+
+    def __init__(self, application: Any, settings: WebhookSettings) -> None:
+        self.application = application
+        self.settings = settings
+        self._server: Optional[asyncio.AbstractServer] = None
+        # 进行中的连接，停止时主动关闭（空闲的长连接不会随监听关闭而结束）
+        self._connections: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self.received = 0
+        self.rejected = 0
+
+    async def start(self) -> None:
+        """开始监听，端口被占用等错误直接抛出。"""
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.settings.listen, self.settings.port, limit=MAX_HEADER_BYTES
+        )
+        logging.info("Webhook 服务已监听 %s:%s%s", self.settings.listen, self.settings.port, self.settings.path)
+
+    async def close(self) -> None:
+        """停止监听并关闭现有连接。"""
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in list(self._connections):
+            writer.close()
+        if self._connections:
+            await asyncio.wait(list(self._connections.values()), timeout=5)
+        await self._server.wait_closed()
+        self._server = None
+        logging.info("Webhook 服务已停止（接收 %d 个更新，拒绝 %d 个请求）", self.received, self.rejected)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), timeout=IDLE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except ValueError as exc:
+                    # 请求格式错误或超长，回复后关闭连接
+                    status = exc.args[0] if exc.args and isinstance(exc.args[0], int) else 400
+                    self.rejected += 1
+                    await self._respond(writer, status, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status = self._dispatch(method, path, headers, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self._respond(writer, status, keep_alive)
+                if not keep_alive:
+                    break
+        except Exception as exc:
+            logging.warning("Webhook 连接处理异常: %s", exc)
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        """读取一个请求，连接正常关闭时返回 None。"""
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise ValueError(431)
+        except asyncio.IncompleteReadError as exc:
+            if not exc.partial:
+                return None
+            raise
+
+        lines = head.decode("latin-1").split("\r\n")
+        parts = lines[0].split(" ")
+        if len(parts) != 3:
+            raise ValueError(400)
+        method, target, _ = parts
+        headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(":")
+            if not sep:
+                raise ValueError(400)
+            headers[name.strip().lower()] = value.strip()
+
+        # 不支持分块等传输编码（Telegram 使用 Content-Length），按长度读取会与后续请求错位，直接拒绝并断开
+        if "transfer-encoding" in headers:
+            raise ValueError(501)
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise ValueError(400)
+        if length < 0:
+            raise ValueError(400)
+        if length > MAX_BODY_BYTES:
+            raise ValueError(413)
+        body = await reader.readexactly(length) if length else b""
+        return method, urlsplit(target).path, headers, body
+
+    def _dispatch(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> int:
+        """校验请求并投递 Update，返回 HTTP 状态码。"""
+        if path != self.settings.path:
+            self.rejected += 1
+            return 404
+        if method != "POST":
+            self.rejected += 1
+            return 405
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, "").encode("latin-1"), self.settings.secret_token.encode()):
+            self.rejected += 1
+            logging.warning("Webhook 请求 secret token 校验失败，已拒绝")
+            return 403
+        try:
+            data = json.loads(body)
+            update = Update.de_json(data, self.application.bot)
+        except Exception as exc:
+            self.rejected += 1
+            logging.warning("Webhook 请求体解析失败: %s", exc)
+            return 400
+        self.application.update_queue.put_nowait(update)
+        self.received += 1
+        return 200
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, keep_alive: bool) -> None:
+        body = _REASONS.get(status, "").encode()
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: text/plain\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+        )
+        await writer.drain()